@@ -1,41 +1,49 @@
 import os
+import re
+import sys
 import json
-import requests
+import asyncio
+import hashlib
+import operator
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict, List, Any, TypedDict
-from dotenv import load_dotenv
-from langchain_core.messages import HumanMessage, AIMessage
+from typing import Dict, List, Any, TypedDict, Annotated, AsyncIterator, Iterable, Optional, Tuple
+from langchain_core.messages import HumanMessage, AIMessage, RemoveMessage, convert_to_messages
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
+from langchain_core.runnables.config import ContextThreadPoolExecutor
 from langchain_core.tools import tool
+from langgraph.config import get_stream_writer
 from langgraph.graph import StateGraph, END
-from langgraph.prebuilt import create_react_agent
-from langchain_gigachat import GigaChat
-from langfuse import Langfuse
-from langfuse.langchain import CallbackHandler
-from langgraph.prebuilt import ToolNode, tools_condition
-
-# Загружаем переменные окружения
-load_dotenv("config.env")
-
-# Инициализируем Langfuse для мониторинга
-langfuse = Langfuse(
-    public_key=os.getenv("LANGFUSE_PUBLIC_KEY"),
-    secret_key=os.getenv("LANGFUSE_SECRET_KEY"),
-    host=os.getenv("LANGFUSE_HOST", "http://localhost:3000")
-)
+from langgraph.graph.message import add_messages
+from langgraph.types import Send
+import text_analytics
+from llm_cache import ResponseCache, with_cache
+from llm_limits import LLMLimiter, call_deadline, with_limits
+from checkpoints import list_thread_ids
+from result_store import ResultStore, StoredResult, REUSE_RESULT
+from tracing import TraceSampler, BackgroundExporter, SampledTracingHandler
+from metrics import REGISTRY, MetricsRegistry, MetricsCallbackHandler, cache_collector
 
-# Создаем callback handler для LangChain
-langfuse_handler = CallbackHandler(
-    public_key=os.getenv("LANGFUSE_PUBLIC_KEY"),
-    update_trace=True
-)
+logger = logging.getLogger("agents")
+
+def _merge_dicts(left: Dict, right: Dict) -> Dict:
+    """Редьюсер состояния: объединяет результаты параллельных нод; значение None удаляет ключ"""
+    merged = {**(left or {}), **(right or {})}
+    return {key: value for key, value in merged.items() if value is not None}
 
 # Определяем структуру состояния
 class AgentState(TypedDict):
-    messages: List[Any]
+    # Ноды возвращают частичные обновления; поля с редьюсером дополняются, остальные заменяются
+    messages: Annotated[List[Any], add_messages]  # Журнал запуска; анализ и версии контента в нем - ссылки
     topic: str
     analysis: str
-    content: str
+    content: str  # Текущая версия контента
     feedback: str
     final_result: str
     tools_used: List[str]  # Список использованных инструментов
@@ -43,44 +51,515 @@ class AgentState(TypedDict):
     tools: List[Dict[str, Any]]  # Результаты от ToolNode
     needs_revision: bool  # Флаг необходимости доработки контента
     revision_count: int  # Счетчик итераций доработки
+    sections: List[str]  # Разделы из плана аналитика (режим parallel_sections)
+    section_drafts: Annotated[Dict[int, str], _merge_dicts]  # Тексты разделов по номерам до сборки материала
+    segments: List[str]  # Фрагменты контента (режим revision_mode="segments")
+    segment_issues: Dict[str, str]  # Открытые замечания критика по id фрагмента
+    segment_verdicts: Dict[str, str]  # Вердикты критика по хэшу текста фрагмента ("" - принят)
+    changed_segments: List[str]  # Фрагменты, переписанные на последней доработке
+    verdict: Dict[str, Any]  # Последний структурированный вердикт критика
+    scores: Annotated[List[float], operator.add]  # Оценки критика по итерациям
+    tokens_used: Annotated[int, operator.add]  # Токены, потраченные на вызовы LLM
+    started_at: float  # Время начала запуска (time.time())
+    deadline: Optional[float]  # Время (time.time()), к которому запуск должен завершиться; None - без дедлайна
+    truncated: Annotated[bool, operator.or_]  # Запуск прерван дедлайном, результат - лучший из полученных
+    node_timings: Annotated[Dict[str, float], _merge_dicts]  # Длительность последнего вызова LLM по нодам
+    draft_id: Optional[int]  # Номер текущей версии контента
+    drafts: Annotated[Dict[int, str], _merge_dicts]  # Вытесненные версии контента, которые нужно хранить
+    best_draft: Optional[int]  # Номер версии с наибольшей оценкой критика
+    best_score: Optional[float]  # Оценка этой версии
+    keep_drafts: bool  # Хранить все версии контента; иначе хранится только лучшая
+    max_messages: Optional[int]  # Сколько последних сообщений хранить в messages; None - все
+    tool_prefetch: Dict[str, Any]  # Анализ версии draft_id, посчитанный параллельно с критиком (режим pipelined)
+    accepted_content: str  # Принятая версия контента до обогащения инструментами
+    candidates: List[str]  # Варианты контента, ожидающие выбора критиком (режим speculative_drafts)
 
-# Инициализируем GigaChat с Langfuse callback и увеличенными таймаутами
-llm = GigaChat(
-    credentials=os.getenv("GIGACHAT_API_KEY"),
-    verify_ssl_certs=False,
-    timeout=120.0,  # Увеличиваем таймаут до 2 минут
-    request_timeout=120.0,  # Таймаут для HTTP-запросов
-    max_retries=3,  # Количество попыток при ошибке
-)
+class AgentRuntime:
+    """
+    Долгоживущее окружение мультиагентной системы.
+    
+    Клиенты GigaChat и Langfuse создаются лениво при первом обращении,
+    а скомпилированные графы кэшируются по конфигурации, поэтому один
+    экземпляр можно переиспользовать между запусками в рабочем процессе.
+    """
+    
+    def __init__(self, env_file: str = "config.env", llm=None, cache: Optional[ResponseCache] = None,
+                 cache_policy: Optional[Dict[str, str]] = None, checkpointer=None,
+                 metrics: Optional[MetricsRegistry] = REGISTRY, limiter: Optional[LLMLimiter] = None,
+                 trace_sampler: Optional[TraceSampler] = None, result_store: Optional[ResultStore] = None):
+        """
+        Args:
+            env_file: Файл с переменными окружения
+            llm: Готовая модель; если не задана, создается GigaChat по настройкам окружения
+            cache: Кэш ответов LLM (LRUCache, SQLiteCache); None отключает кэширование
+            cache_policy: Режимы кэширования по нодам, см. llm_cache.DEFAULT_CACHE_POLICY
+            checkpointer: Чекпоинтер LangGraph (checkpoints.create_checkpointer) для возобновляемых запусков
+            metrics: Реестр метрик (metrics.REGISTRY); None отключает сбор метрик
+            limiter: Общие ограничения вызовов LLM (llm_limits.LLMLimiter); для GigaChat из окружения
+                по умолчанию создается LLMLimiter.from_env()
+            trace_sampler: Отбор запусков для трассировки в Langfuse; по умолчанию TraceSampler.from_env()
+            result_store: Хранилище результатов по темам (result_store.ResultStore): для похожей темы
+                результат возвращается или запуск начинается с него; None - каждый запуск с нуля
+        """
+        self.env_file = env_file
+        self._llm = llm
+        self.cache = cache
+        self.cache_policy = cache_policy
+        self.checkpointer = checkpointer
+        self.metrics = metrics
+        self.limiter = limiter
+        self.result_store = result_store
+        if metrics is not None and cache is not None:
+            metrics.add_collector("llm_cache", cache_collector(cache))
+        self._langfuse = None
+        self._langfuse_handler = None
+        self.trace_sampler = trace_sampler
+        self._trace_callbacks: Optional[List[Any]] = None
+        self._env_loaded = False
+        self._graphs: Dict[Tuple, Any] = {}
+        self._metrics_handler = MetricsCallbackHandler(metrics) if metrics is not None else None
+        self._lock = threading.RLock()
+    
+    def load_env(self) -> None:
+        """Загружает переменные окружения (однократно)"""
+        with self._lock:
+            if not self._env_loaded:
+                from dotenv import load_dotenv
+                load_dotenv(self.env_file)
+                self._env_loaded = True
+    
+    @property
+    def llm(self):
+        """Клиент GigaChat"""
+        if self._llm is None:
+            with self._lock:
+                if self._llm is None:
+                    self.load_env()
+                    from langchain_gigachat import GigaChat
+                    # Инициализируем GigaChat с увеличенными таймаутами
+                    self._llm = GigaChat(
+                        credentials=os.getenv("GIGACHAT_API_KEY"),
+                        verify_ssl_certs=False,
+                        timeout=120.0,  # Увеличиваем таймаут до 2 минут
+                    )
+                    # Клиент сам не повторяет запросы и не знает о лимитах провайдера
+                    if self.limiter is None:
+                        self.limiter = LLMLimiter.from_env(self.metrics)
+        return self._llm
+    
+    @property
+    def langfuse(self):
+        """Клиент Langfuse для мониторинга"""
+        if self._langfuse is None:
+            with self._lock:
+                if self._langfuse is None:
+                    self.load_env()
+                    from langfuse import Langfuse
+                    self._langfuse = Langfuse(
+                        public_key=os.getenv("LANGFUSE_PUBLIC_KEY"),
+                        secret_key=os.getenv("LANGFUSE_SECRET_KEY"),
+                        host=os.getenv("LANGFUSE_HOST", "http://localhost:3000")
+                    )
+        return self._langfuse
+    
+    @property
+    def langfuse_handler(self):
+        """Callback handler Langfuse для LangChain"""
+        if self._langfuse_handler is None:
+            with self._lock:
+                if self._langfuse_handler is None:
+                    # Handler использует клиент Langfuse, поэтому создаем его первым
+                    self.langfuse
+                    from langfuse.langchain import CallbackHandler
+                    self._langfuse_handler = CallbackHandler(
+                        public_key=os.getenv("LANGFUSE_PUBLIC_KEY"),
+                        update_trace=True
+                    )
+        return self._langfuse_handler
+    
+    def trace_callbacks(self) -> List[Any]:
+        """
+        Callbacks трассировки по умолчанию.
+        
+        Без ключей Langfuse или при отключенном отборе список пуст: клиенты Langfuse
+        не создаются, а запуски не проходят через обработчик трассировки.
+        """
+        if self._trace_callbacks is None:
+            with self._lock:
+                if self._trace_callbacks is None:
+                    self.load_env()
+                    if self.trace_sampler is None:
+                        self.trace_sampler = TraceSampler.from_env()
+                    configured = os.getenv("LANGFUSE_PUBLIC_KEY") and os.getenv("LANGFUSE_SECRET_KEY")
+                    if not configured or not self.trace_sampler.enabled:
+                        self._trace_callbacks = []
+                    else:
+                        # Обработчик Langfuse создается в фоновом потоке при первой отобранной трассе
+                        exporter = BackgroundExporter(lambda: self.langfuse_handler, metrics=self.metrics)
+                        self._trace_callbacks = [SampledTracingHandler(exporter, self.trace_sampler, self.metrics)]
+        return self._trace_callbacks
+    
+    def flush_traces(self, timeout: Optional[float] = 10.0) -> None:
+        """Дожидается отправки отобранных трасс в Langfuse"""
+        for handler in self._trace_callbacks or []:
+            handler.exporter.flush(timeout)
+        if self._langfuse is not None:
+            self._langfuse.flush()
+    
+    def get_graph(self, callbacks: Optional[List[Any]] = None, **graph_options):
+        """
+        Возвращает скомпилированный граф для заданной конфигурации.
+        
+        Граф компилируется один раз и переиспользуется при повторных вызовах
+        с теми же параметрами. Callback-обработчики в ключ кэша не входят: они
+        подключаются к скомпилированному графу через конфигурацию запуска, поэтому
+        обработчики на каждый запрос не приводят к новой компиляции.
+        
+        Args:
+            callbacks: Callback-обработчики графа; по умолчанию trace_callbacks()
+            graph_options: Параметры create_agent_graph (max_revisions, parallel_sections, ...)
+        """
+        if callbacks is None:
+            callbacks = self.trace_callbacks()
+        if self._metrics_handler is not None:
+            callbacks = list(callbacks) + [self._metrics_handler]
+        return self._compiled_graph(**graph_options).with_config(callbacks=list(callbacks))
+    
+    def _compiled_graph(self, **graph_options):
+        """Скомпилированный граф без callback-обработчиков из кэша окружения"""
+        key = tuple(sorted(graph_options.items()))
+        graph = self._graphs.get(key)
+        if graph is None:
+            with self._lock:
+                graph = self._graphs.get(key)
+                if graph is None:
+                    # Модель создается первой: вместе с ней создаются ограничения по умолчанию
+                    llm = self.llm
+                    graph = create_agent_graph(
+                        llm,
+                        callbacks=[],
+                        cache=self.cache,
+                        cache_policy=self.cache_policy,
+                        checkpointer=self.checkpointer,
+                        limiter=self.limiter,
+                        **graph_options
+                    )
+                    self._graphs[key] = graph
+        return graph
+    
+    def warmup(self, **graph_options) -> None:
+        """Заранее создает клиенты и компилирует граф, чтобы первый запрос не платил за инициализацию"""
+        self.get_graph(**graph_options)
+
+
+_default_runtime: Optional[AgentRuntime] = None
+_default_runtime_lock = threading.Lock()
+
+def get_runtime() -> AgentRuntime:
+    """Возвращает общее окружение процесса, создавая его при первом обращении"""
+    global _default_runtime
+    if _default_runtime is None:
+        with _default_runtime_lock:
+            if _default_runtime is None:
+                _default_runtime = AgentRuntime()
+    return _default_runtime
+
+def __getattr__(name: str):
+    # Ленивый доступ к клиентам по умолчанию: agents.llm, agents.langfuse, agents.langfuse_handler
+    if name in ("llm", "langfuse", "langfuse_handler"):
+        return getattr(get_runtime(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+async def _astream_llm(llm, messages, node: str):
+    """Получает ответ LLM потоком, передавая токены в custom-поток графа"""
+    write = get_stream_writer()
+    response = None
+    async for chunk in llm.astream(messages):
+        if chunk.content:
+            write({"type": "token", "node": node, "content": chunk.content})
+        response = chunk if response is None else response + chunk
+    return response if response is not None else AIMessage(content="")
+
+def _response_tokens(response) -> int:
+    """Количество токенов, потраченных на ответ LLM (0 для ответов из кэша и без статистики)"""
+    if response.response_metadata.get("cache_hit"):
+        return 0
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return usage.get("total_tokens", 0)
+    return response.response_metadata.get("token_usage", {}).get("total_tokens", 0)
+
+def _log(state: AgentState, *messages) -> List[Any]:
+    """
+    Обновление журнала messages с учетом max_messages.
+    
+    Returns:
+        Новые сообщения и RemoveMessage для вытесняемых старых
+    """
+    limit = state.get("max_messages")
+    if limit is None:
+        return list(messages)
+    if limit <= 0:
+        return []
+    history = state.get("messages") or []
+    overflow = len(history) + len(messages) - limit
+    if overflow <= 0:
+        return list(messages)
+    removed = [RemoveMessage(id=message.id) for message in history[:overflow]]
+    return removed + list(messages[max(0, overflow - len(history)):])
+
+def _draft_message(draft_id: int) -> AIMessage:
+    """Сообщение о новой версии контента: текст не копируется, а берется по номеру версии"""
+    return AIMessage(content=f"Контент: [версия {draft_id}]", additional_kwargs={"ref": "draft", "draft_id": draft_id})
+
+def _new_draft(state: AgentState, text: str) -> Dict[str, Any]:
+    """
+    Частичное обновление с новой версией контента.
+    
+    Текущая версия хранится только в content. Вытесненная версия переносится в drafts,
+    если запуск хранит все версии (keep_drafts) или у нее лучшая оценка критика.
+    """
+    previous = state.get("draft_id")
+    draft_id = 0 if previous is None else previous + 1
+    update = {"content": text, "draft_id": draft_id, "messages": _log(state, _draft_message(draft_id))}
+    if previous is not None and (state.get("keep_drafts") or previous == state.get("best_draft")):
+        update["drafts"] = {previous: state["content"]}
+    return update
+
+def _draft_text(state: AgentState, draft_id: Optional[int]) -> Optional[str]:
+    """Текст версии контента по номеру; None, если версия не сохранена"""
+    if draft_id is None:
+        return None
+    if draft_id == state.get("draft_id"):
+        return state["content"]
+    return (state.get("drafts") or {}).get(draft_id)
+
+class DeadlineExceeded(TimeoutError):
+    """Дедлайн запуска истек до завершения вызова LLM"""
+
+_deadline_pool: Optional[ContextThreadPoolExecutor] = None
+_deadline_pool_lock = threading.Lock()
+
+def _deadline_executor() -> ContextThreadPoolExecutor:
+    """Пул потоков для синхронных вызовов LLM с дедлайном"""
+    global _deadline_pool
+    if _deadline_pool is None:
+        with _deadline_pool_lock:
+            if _deadline_pool is None:
+                _deadline_pool = ContextThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-deadline")
+    return _deadline_pool
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    return None if deadline is None else deadline - time.time()
+
+def _invoke_before(llm, messages, deadline: Optional[float]):
+    """Синхронный вызов LLM, который прерывается по дедлайну"""
+    remaining = _remaining(deadline)
+    if remaining is None:
+        return llm.invoke(messages)
+    if remaining <= 0:
+        raise DeadlineExceeded("Дедлайн запуска истек")
+    future = _deadline_executor().submit(_invoke_until, llm, messages, deadline)
+    try:
+        return future.result(timeout=remaining)
+    except FutureTimeoutError:
+        # Синхронный HTTP-запрос нельзя прервать: он завершится в фоне, а ответ будет отброшен
+        future.cancel()
+        raise DeadlineExceeded("Дедлайн запуска истек во время вызова LLM") from None
+
+def _invoke_until(llm, messages, deadline: float):
+    # Вызов, брошенный по дедлайну, продолжается в потоке пула: лимиты не ждут и не повторяют его дольше
+    with call_deadline(deadline):
+        return llm.invoke(messages)
+
+async def _await_before(awaitable, deadline: Optional[float]):
+    """Ожидает вызов LLM не дольше дедлайна, отменяя его по истечении"""
+    remaining = _remaining(deadline)
+    if remaining is None:
+        return await awaitable
+    if remaining <= 0:
+        awaitable.close()
+        raise DeadlineExceeded("Дедлайн запуска истек")
+    try:
+        return await asyncio.wait_for(awaitable, remaining)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("Дедлайн запуска истек во время вызова LLM") from None
+
+def _out_of_time(state: AgentState, reserve: Tuple[str, ...] = ()) -> bool:
+    """
+    Проверяет, успеет ли нода до дедлайна.
+    
+    Args:
+        state: Состояние графа (или задание Send с полем deadline)
+        reserve: Ноды, на последовательный вызов которых должно хватить оставшегося времени,
+            по длительности их последних вызовов в этом запуске
+    """
+    if state.get("truncated"):
+        return True
+    remaining = _remaining(state.get("deadline"))
+    if remaining is None:
+        return False
+    timings = state.get("node_timings") or {}
+    return remaining <= sum(timings.get(node, 0.0) for node in reserve)
+
+def _truncate(name: str) -> Dict[str, Any]:
+    """Частичное обновление для ноды, пропущенной из-за дедлайна: состояние остается прежним"""
+    logger.info("Дедлайн запуска: нода %s пропущена, используем лучший полученный результат", name)
+    return {"truncated": True}
+
+# Общая обертка для LLM-нод: одна логика для синхронного и асинхронного запуска
+def _llm_node(name, llm, prepare, apply, on_error=None, stream: bool = False, reserve: Tuple[str, ...] = ()):
+    """
+    Собирает ноду графа, вызывающую LLM, с синхронной и асинхронной реализацией.
+
+    Args:
+        name: Имя ноды
+        llm: Модель, к которой обращается нода
+        prepare: Функция (state) -> messages, формирующая запрос к LLM; если она вернула словарь,
+            вызов LLM не нужен и нода возвращает его как обновление состояния
+        apply: Функция (state, response) -> dict, возвращающая частичное обновление состояния
+            по ответу; state не изменяется, токены и длительность вызова нода добавляет сама
+        on_error: Функция (state, error) -> dict для обработки ошибки LLM; если не задана,
+            ошибка пробрасывается
+        stream: В асинхронном режиме получать ответ через llm.astream и отдавать токены в поток графа
+        reserve: Ноды, на вызов которых должно хватить времени до дедлайна, иначе нода пропускается
+            (по умолчанию нода пропускается только после дедлайна); незавершенный к дедлайну вызов
+            отменяется, а нода возвращает состояние без изменений с флагом truncated
+
+    Returns:
+        Runnable, который граф вызывает через invoke или ainvoke
+    """
+    def finish(state: AgentState, response, started: float) -> Dict[str, Any]:
+        return {
+            **apply(state, response),
+            "tokens_used": _response_tokens(response),
+            "node_timings": {name: time.time() - started},
+        }
+
+    def fail(state: AgentState, e: Exception) -> Dict[str, Any]:
+        if on_error is None:
+            raise e
+        return on_error(state, e) or {}
+
+    def node(state: AgentState) -> Dict[str, Any]:
+        if _out_of_time(state, reserve):
+            return _truncate(name)
+        messages = prepare(state)
+        if isinstance(messages, dict):
+            return messages
+        started = time.time()
+        try:
+            response = _invoke_before(llm, messages, state.get("deadline"))
+        except DeadlineExceeded:
+            return _truncate(name)
+        except Exception as e:
+            return fail(state, e)
+        return finish(state, response, started)
+
+    async def anode(state: AgentState) -> Dict[str, Any]:
+        if _out_of_time(state, reserve):
+            return _truncate(name)
+        messages = prepare(state)
+        if isinstance(messages, dict):
+            return messages
+        started = time.time()
+        try:
+            if stream:
+                response = await _await_before(_astream_llm(llm, messages, name), state.get("deadline"))
+            else:
+                response = await _await_before(llm.ainvoke(messages), state.get("deadline"))
+        except DeadlineExceeded:
+            return _truncate(name)
+        except Exception as e:
+            return fail(state, e)
+        return finish(state, response, started)
+
+    return RunnableLambda(node, afunc=anode, name=name)
 
 # Определяем агентов
-def create_analyst_agent():
+# Разделы плана, которые аналитик перечисляет в режиме parallel_sections
+# Пробелы внутри строки - [^\S\n]: пустой заголовок не должен захватывать следующую строку плана
+SECTION_LINE_RE = re.compile(r"^(?:[^\S\n]|[*#>-])*РАЗДЕЛ\**[^\S\n]*\d*[^\S\n]*[:.]\**[^\S\n]*(.+?)[^\S\n]*$", re.MULTILINE | re.IGNORECASE)
+HEADING_RE = re.compile(r"^[^\S\n]*#{1,3}[^\S\n]+(.+?)[^\S\n]*$", re.MULTILINE)
+NUMBERED_RE = re.compile(r"^[^\S\n]*\d+[.)][^\S\n]+(.+?)[^\S\n]*$", re.MULTILINE)
+
+def parse_sections(analysis: str, max_sections: int = 8) -> List[str]:
+    """
+    Извлекает список разделов из анализа.
+    
+    Сначала ищутся явные строки "РАЗДЕЛ: ...", затем заголовки Markdown и
+    нумерованные пункты. Если разделов больше max_sections, соседние разделы
+    объединяются, чтобы не дробить материал на слишком мелкие части.
+    
+    Returns:
+        Список описаний разделов; пустой, если план не удалось разобрать
+    """
+    sections = []
+    for pattern in (SECTION_LINE_RE, HEADING_RE, NUMBERED_RE):
+        sections = [item.strip("* ") for item in pattern.findall(analysis) if item.strip("* ")]
+        if len(sections) >= 2:
+            break
+    if len(sections) < 2:
+        return []
+    if len(sections) > max_sections:
+        size = -(-len(sections) // max_sections)
+        sections = ["; ".join(sections[i:i + size]) for i in range(0, len(sections), size)]
+    return sections
+
+def create_analyst_agent(llm=None, sections: bool = False):
     """Агент-аналитик: анализирует тему и создает план"""
+    log = logger.getChild("analyst")
+    if llm is None:
+        llm = get_runtime().llm
+    system_prompt = """Ты опытный аналитик. Твоя задача - проанализировать заданную тему и создать детальный план работы.
+        Будь конкретным и структурированным в своем анализе."""
+    if sections:
+        # Разделы пишутся параллельно, поэтому план должен явно их перечислять
+        system_prompt += """
+        В конце анализа перечисли разделы будущего материала, каждый с новой строки в формате:
+        РАЗДЕЛ: <название раздела> - <что в нем раскрыть>"""
     prompt = ChatPromptTemplate.from_messages([
-        ("system", """Ты опытный аналитик. Твоя задача - проанализировать заданную тему и создать детальный план работы.
-        Будь конкретным и структурированным в своем анализе."""),
+        ("system", system_prompt),
         ("user", "Проанализируй тему: {topic}")
     ])
     
-    def analyst(state: AgentState) -> AgentState:
-        print("DEBUG: Аналитик начал работу")
+    def prepare(state: AgentState):
+        log.debug("Аналитик начал работу")
         messages = prompt.format_messages(topic=state["topic"])
-        print(f"DEBUG: Аналитик отправил запрос: {messages[-1].content[:100]}...")
-        try:
-            response = llm.invoke(messages)
-            state["analysis"] = response.content
-            state["messages"].append(AIMessage(content=f"Анализ: {response.content}"))
-            print(f"DEBUG: Аналитик получил ответ длиной {len(response.content)} символов")
-        except Exception as e:
-            print(f"DEBUG: Ошибка аналитика: {e}")
-            state["analysis"] = f"Ошибка анализа: {e}"
-        print("DEBUG: Аналитик завершил работу")
-        return state
+        log.debug("Аналитик отправил запрос: %s...", messages[-1].content[:100])
+        return messages
     
-    return analyst
+    def apply(state: AgentState, response):
+        update = {
+            "analysis": response.content,
+            # Текст анализа хранится один раз, в поле analysis
+            "messages": _log(state, AIMessage(content="Анализ: [analysis]", additional_kwargs={"ref": "analysis"}))
+        }
+        log.debug("Аналитик получил ответ длиной %s символов", len(response.content))
+        if sections:
+            update["sections"] = parse_sections(response.content)
+            log.debug("Аналитик выделил разделов: %s", len(update['sections']))
+        log.debug("Аналитик завершил работу")
+        return update
+    
+    def on_error(state: AgentState, e: Exception):
+        log.warning("Ошибка аналитика: %s", e)
+        log.debug("Аналитик завершил работу")
+        return {"analysis": f"Ошибка анализа: {e}"}
+    
+    return _llm_node("analyst", llm, prepare, apply, on_error)
+
+def _next_revision_count(state: AgentState) -> int:
+    """Номер итерации писателя: если контент уже есть, это доработка; первый контент - итерация 0"""
+    if state.get("content", "").strip():
+        return state.get("revision_count", 0) + 1
+    return 0
 
-def create_writer_agent():
+def create_writer_agent(llm=None):
     """Агент-писатель: создает контент на основе анализа и учитывает критику"""
+    log = logger.getChild("writer")
+    if llm is None:
+        llm = get_runtime().llm
     prompt = ChatPromptTemplate.from_messages([
         ("system", """Ты талантливый писатель. Создай качественный, структурированный контент на основе предоставленного анализа.
         
@@ -95,296 +574,943 @@ def create_writer_agent():
 Если есть критика, улучши существующий контент, учитывая все замечания редактора.""")
     ])
     
-    def writer(state: AgentState) -> AgentState:
-        print("DEBUG: Писатель начал работу")
-        
-        # Проверяем, есть ли уже контент (это доработка)
-        is_revision = bool(state.get("content", "").strip())
-        if is_revision:
-            # Увеличиваем счетчик доработок
-            state["revision_count"] = state.get("revision_count", 0) + 1
-            print(f"DEBUG: Писатель дорабатывает контент на основе критики (итерация {state['revision_count']})")
+    def prepare(state: AgentState):
+        log.debug("Писатель начал работу")
+        if _next_revision_count(state):
+            log.debug("Писатель дорабатывает контент на основе критики (итерация %s)", _next_revision_count(state))
         else:
-            # Инициализируем счетчик для первого контента
-            state["revision_count"] = 0
-            print("DEBUG: Писатель создает первичный контент")
+            log.debug("Писатель создает первичный контент")
             
-        messages = prompt.format_messages(
+        return prompt.format_messages(
             topic=state["topic"],
             analysis=state["analysis"],
             content=state.get("content", ""),
             feedback=state.get("feedback", "")
         )
+    
+    def apply(state: AgentState, response):
+        log.debug("Писатель получил ответ длиной %s символов", len(response.content))
+        log.debug("Писатель завершил работу")
+        return {**_new_draft(state, response.content), "revision_count": _next_revision_count(state)}
+    
+    def on_error(state: AgentState, e: Exception):
+        log.warning("Ошибка писателя: %s", e)
+        return {**_new_draft(state, f"Ошибка создания контента: {e}"), "revision_count": _next_revision_count(state)}
+    
+    # Доработку начинаем, только если до дедлайна успеем и ее, и проверку критиком
+    return _llm_node("writer", llm, prepare, apply, on_error, stream=True, reserve=("writer", "critic"))
+
+def create_section_writer_agent(llm=None):
+    """Агент-писатель раздела: пишет один раздел материала по общему плану"""
+    log = logger.getChild("section_writer")
+    if llm is None:
+        llm = get_runtime().llm
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", """Ты талантливый писатель. Ты пишешь один раздел большого материала, остальные разделы пишут твои коллеги.
+        Раскрой только свой раздел, начни его с заголовка и не повторяй содержание других разделов.
+        Пиши ясно, логично и увлекательно."""),
+        ("user", """Тема: {topic}
+Общий план: {analysis}
+
+Твой раздел ({index} из {total}): {section}""")
+    ])
+    
+    # На вход нода получает не состояние графа, а задание из Send
+    def prepare(task: Dict[str, Any]):
+        log.debug("Писатель раздела %s/%s начал работу", task['index'] + 1, task['total'])
+        return prompt.format_messages(
+            topic=task["topic"],
+            analysis=task["analysis"],
+            index=task["index"] + 1,
+            total=task["total"],
+            section=task["section"]
+        )
+    
+    def apply(task: Dict[str, Any], response):
+        log.debug("Писатель раздела %s/%s получил ответ длиной %s символов", task['index'] + 1, task['total'], len(response.content))
+        return {"section_drafts": {task["index"]: response.content}}
+    
+    def on_error(task: Dict[str, Any], e: Exception):
+        log.warning("Ошибка писателя раздела %s: %s", task['index'] + 1, e)
+        return {"section_drafts": {task["index"]: f"Ошибка создания раздела «{task['section']}»: {e}"}}
+    
+    return _llm_node("section_writer", llm, prepare, apply, on_error)
+
+def route_sections(state: AgentState):
+    """Раздает разделы плана параллельным писателям; без разделов - к обычному писателю"""
+    sections = state.get("sections") or []
+    if not sections:
+        logger.debug("Разделы не выделены, контент пишет один писатель")
+        return "writer"
+    logger.debug("Отправляем %s разделов параллельным писателям", len(sections))
+    return [
+        Send("section_writer", {
+            "topic": state["topic"],
+            "analysis": state["analysis"],
+            "section": section,
+            "index": index,
+            "total": len(sections),
+            "deadline": state.get("deadline")
+        })
+        for index, section in enumerate(sections)
+    ]
+
+def merge_sections(state: AgentState) -> Dict[str, Any]:
+    """Собирает разделы в единый материал в порядке плана"""
+    drafts = state.get("section_drafts", {})
+    content = "\n\n".join(drafts[index] for index in sorted(drafts))
+    logger.debug("Разделы собраны в материал длиной %s символов", len(content))
+    # Тексты разделов вошли в материал, отдельно их больше не храним
+    return {**_new_draft(state, content), "revision_count": 0, "section_drafts": dict.fromkeys(drafts)}
+
+def section_from_line(line: str) -> Optional[str]:
+    """Раздел из строки плана "РАЗДЕЛ: ..."; None, если строка не описывает раздел"""
+    match = SECTION_LINE_RE.match(line)
+    return match.group(1).strip("* ") if match else None
+
+def create_pipelined_analyst_agent(llm=None, section_llm=None, max_sections: int = 8):
+    """
+    Аналитик для конвейерного режима: план читается потоком, и каждый раздел отдается
+    писателю, как только его строка в плане завершена, пока аналитик продолжает ответ.
+    
+    Нода возвращает и анализ, и тексты разделов, поэтому генерация анализа почти целиком
+    уходит с критического пути запуска. Перекрытие работает при асинхронном запуске;
+    при синхронном разделы пишутся параллельно после получения всего анализа.
+    """
+    log = logger.getChild("analyst")
+    if llm is None:
+        llm = get_runtime().llm
+    if section_llm is None:
+        section_llm = llm
+    # Разделы нужны писателям как можно раньше, поэтому план идет до развернутого анализа
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", """Ты опытный аналитик. Твоя задача - проанализировать заданную тему и создать детальный план работы.
+        Будь конкретным и структурированным в своем анализе.
+        Начни ответ с разделов будущего материала (не больше {max_sections}), каждый с новой строки в формате:
+        РАЗДЕЛ: <название раздела> - <что в нем раскрыть>
+        После списка разделов приведи развернутый анализ темы."""),
+        ("user", "Проанализируй тему: {topic}")
+    ])
+    section_prompt = ChatPromptTemplate.from_messages([
+        ("system", """Ты талантливый писатель. Ты пишешь один раздел большого материала, остальные разделы пишут твои коллеги.
+        Раскрой только свой раздел, начни его с заголовка и не повторяй содержание других разделов.
+        Пиши ясно, логично и увлекательно."""),
+        ("user", """Тема: {topic}
+Разделы плана, известные к началу работы:
+{plan}
+
+Твой раздел ({index}): {section}""")
+    ])
+    
+    def section_messages(state: AgentState, sections: List[str]):
+        plan = "\n".join(f"{number}. {item}" for number, item in enumerate(sections, 1))
+        log.debug("Раздел %s отдан писателю до завершения анализа", len(sections))
+        return section_prompt.format_messages(topic=state["topic"], plan=plan, index=len(sections), section=sections[-1])
+    
+    def finish(state: AgentState, analysis, sections: List[str], drafts: List[Any], started: float) -> Dict[str, Any]:
+        log.debug("Аналитик получил ответ длиной %s символов, разделов: %s", len(analysis.content), len(sections))
+        update = {
+            "analysis": analysis.content,
+            "messages": _log(state, AIMessage(content="Анализ: [analysis]", additional_kwargs={"ref": "analysis"})),
+            "sections": sections if len(sections) >= 2 else [],
+            "tokens_used": _response_tokens(analysis),
+            "node_timings": {"analyst": time.time() - started}
+        }
+        if len(sections) < 2:
+            # План не разобран на разделы: материал напишет обычный писатель
+            return update
+        update["section_drafts"] = {}
+        for index, (section, draft) in enumerate(zip(sections, drafts)):
+            if isinstance(draft, Exception):
+                log.warning("Ошибка писателя раздела %s: %s", index + 1, draft)
+                update["section_drafts"][index] = f"Ошибка создания раздела «{section}»: {draft}"
+            else:
+                update["section_drafts"][index] = draft.content
+                update["tokens_used"] += _response_tokens(draft)
+        return update
+    
+    def on_error(e: Exception) -> Dict[str, Any]:
+        log.warning("Ошибка аналитика: %s", e)
+        return {"analysis": f"Ошибка анализа: {e}", "sections": []}
+    
+    def node(state: AgentState) -> Dict[str, Any]:
+        if _out_of_time(state):
+            return _truncate("analyst")
+        deadline = state.get("deadline")
+        started = time.time()
+        try:
+            analysis = _invoke_before(llm, prompt.format_messages(topic=state["topic"], max_sections=max_sections), deadline)
+        except DeadlineExceeded:
+            return _truncate("analyst")
+        except Exception as e:
+            return on_error(e)
+        sections = [section for section in map(section_from_line, analysis.content.splitlines()) if section][:max_sections]
+        if len(sections) < 2:
+            return finish(state, analysis, sections, [], started)
+        
+        def invoke_safe(count: int):
+            try:
+                return _invoke_before(section_llm, section_messages(state, sections[:count]), deadline)
+            except Exception as e:
+                return e
+        
+        with ContextThreadPoolExecutor(max_workers=len(sections)) as pool:
+            drafts = list(pool.map(invoke_safe, range(1, len(sections) + 1)))
+        if any(isinstance(draft, DeadlineExceeded) for draft in drafts):
+            return _truncate("analyst")
+        return finish(state, analysis, sections, drafts, started)
+    
+    async def anode(state: AgentState) -> Dict[str, Any]:
+        if _out_of_time(state):
+            return _truncate("analyst")
+        started = time.time()
+        sections: List[str] = []
+        tasks: List[asyncio.Task] = []
+        
+        async def write_section() -> Any:
+            try:
+                return await section_llm.ainvoke(section_messages(state, list(sections)))
+            except Exception as e:
+                return e
+        
+        def take_line(line: str) -> None:
+            section = section_from_line(line)
+            if section and len(sections) < max_sections:
+                sections.append(section)
+                tasks.append(asyncio.create_task(write_section()))
+        
+        async def pipeline():
+            analysis = None
+            pending = ""
+            try:
+                async for chunk in llm.astream(prompt.format_messages(topic=state["topic"], max_sections=max_sections)):
+                    analysis = chunk if analysis is None else analysis + chunk
+                    pending += chunk.content
+                    *lines, pending = pending.split("\n")
+                    for line in lines:
+                        take_line(line)
+                take_line(pending)
+                drafts = await asyncio.gather(*tasks)
+            except BaseException:
+                # Ошибка аналитика или дедлайн: разделы без полного плана не нужны
+                for task in tasks:
+                    task.cancel()
+                raise
+            return finish(state, analysis if analysis is not None else AIMessage(content=""), sections, drafts, started)
+        
         try:
-            response = llm.invoke(messages)
-            state["content"] = response.content
-            state["messages"].append(AIMessage(content=f"Контент: {response.content}"))
-            print(f"DEBUG: Писатель получил ответ длиной {len(response.content)} символов")
-            print("DEBUG: Писатель завершил работу")
+            return await _await_before(pipeline(), state.get("deadline"))
+        except DeadlineExceeded:
+            return _truncate("analyst")
         except Exception as e:
-            print(f"DEBUG: Ошибка писателя: {e}")
-            state["content"] = f"Ошибка создания контента: {e}"
-        return state
+            return on_error(e)
+    
+    return RunnableLambda(node, afunc=anode, name="analyst")
+
+def route_start(state: AgentState) -> str:
+    """Точка входа: аналитик или, если контент уже есть (запуск с результата похожей темы), критик"""
+    return "critic" if state.get("content") else "analyst"
+
+def route_pipelined(state: AgentState) -> str:
+    """После конвейерного аналитика: к сборке разделов или, если плана нет, к обычному писателю"""
+    return "merge_sections" if state.get("section_drafts") else "writer"
+
+def create_tools_prefetch_agent():
+    """
+    Нода, которая анализирует текущий контент параллельно с критиком, чтобы инструменты не ждали анализа.
+    
+    Пока критик выбирает среди вариантов (speculative_drafts), выбранной версии еще нет:
+    анализ не выполняется, а результат прошлого круга сбрасывается. Инструменты берут
+    анализ, только если он посчитан для той же версии контента, что и отдается.
+    """
+    def tools_prefetch(state: AgentState) -> Dict[str, Any]:
+        if state.get("candidates"):
+            return {"tool_prefetch": {}}
+        if state.get("truncated"):
+            return {}
+        content = state["content"]
+        return {"tool_prefetch": {
+            "draft_id": state.get("draft_id"),
+            "key": segment_hash(content),
+            "result": analyze_text.invoke({"text": content})
+        }}
+    
+    return tools_prefetch
+
+# Формат структурированного вердикта критика
+VERDICT_FORMAT = """ВАЖНО: В конце ответа ты ДОЛЖЕН привести итоговый вердикт одной строкой в формате JSON:
+{{"score": <общая оценка от 0 до 10>, "criteria": {{"structure": <0-10>, "completeness": <0-10>, "clarity": <0-10>, "relevance": <0-10>}}, "decision": "ДОРАБОТАТЬ" или "ПРИНЯТЬ"}}
+- "ДОРАБОТАТЬ" - если контент требует значительных улучшений
+- "ПРИНЯТЬ" - если контент достаточно хорош и готов к финализации"""
+
+def _last_json_object(text: str, keys: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+    """Последний JSON-объект в тексте, в котором есть хотя бы одно из полей keys"""
+    decoder = json.JSONDecoder()
+    position = text.rfind("{")
+    while position != -1:
+        try:
+            data, _ = decoder.raw_decode(text, position)
+        except ValueError:
+            data = None
+        if isinstance(data, dict) and any(key in data for key in keys):
+            return data
+        position = text.rfind("{", 0, position)
+    return None
+
+def parse_verdict(text: str) -> Dict[str, Any]:
+    """
+    Извлекает структурированный вердикт критика.
+    
+    Берется последний JSON-объект с полями score/decision; если его нет,
+    решение ищется по маркерам "РЕШЕНИЕ: ДОРАБОТАТЬ" / "РЕШЕНИЕ: ПРИНЯТЬ".
     
-    return writer
+    Returns:
+        Словарь с полями score (float или None), criteria (оценки по критериям)
+        и decision ("revise", "accept" или None, если решение неясно)
+    """
+    verdict = {"score": None, "criteria": {}, "decision": None}
+    data = _last_json_object(text, ("score", "decision"))
+    if data is not None:
+        try:
+            verdict["score"] = float(data["score"]) if data.get("score") is not None else None
+        except (TypeError, ValueError):
+            pass
+        criteria = data.get("criteria")
+        if isinstance(criteria, dict):
+            verdict["criteria"] = {
+                name: float(mark) for name, mark in criteria.items() if isinstance(mark, (int, float))
+            }
+        decision = str(data.get("decision", "")).upper()
+        if "ДОРАБОТ" in decision or "REVISE" in decision:
+            verdict["decision"] = "revise"
+        elif "ПРИНЯ" in decision or "ACCEPT" in decision:
+            verdict["decision"] = "accept"
+    if verdict["decision"] is None:
+        if "РЕШЕНИЕ: ДОРАБОТАТЬ" in text:
+            verdict["decision"] = "revise"
+        elif "РЕШЕНИЕ: ПРИНЯТЬ" in text:
+            verdict["decision"] = "accept"
+    return verdict
 
-def create_critic_agent():
+def _record_verdict(state: AgentState, text: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Разбирает вердикт критика.
+    
+    Returns:
+        Вердикт и частичное обновление состояния: вердикт, оценка и лучшая версия контента
+    """
+    verdict = parse_verdict(text)
+    update = {"verdict": verdict}
+    if verdict["score"] is not None:
+        update["scores"] = [verdict["score"]]
+        logger.debug("Оценка критика: %s", verdict['score'])
+        best_score = state.get("best_score")
+        if best_score is None or verdict["score"] >= best_score:
+            update["best_score"] = verdict["score"]
+            update["best_draft"] = state.get("draft_id")
+            previous = state.get("best_draft")
+            if previous is not None and previous != state.get("draft_id") and not state.get("keep_drafts"):
+                # Прежняя лучшая версия хранилась только ради оценки
+                update["drafts"] = {previous: None}
+    return verdict, update
+
+def create_critic_agent(llm=None):
     """Агент-критик: оценивает контент и принимает решение о необходимости доработки"""
+    log = logger.getChild("critic")
+    if llm is None:
+        llm = get_runtime().llm
     prompt = ChatPromptTemplate.from_messages([
         ("system", """Ты строгий критик и редактор. Твоя задача - проанализировать контент и принять решение о его качестве.
 
 Критерии оценки:
-- Структура и логика изложения
-- Полнота раскрытия темы  
-- Качество и ясность текста
-- Соответствие теме
+- Структура и логика изложения (structure)
+- Полнота раскрытия темы (completeness)
+- Качество и ясность текста (clarity)
+- Соответствие теме (relevance)
 
-ВАЖНО: В конце своей критики ты ДОЛЖЕН явно указать одно из решений:
-- "РЕШЕНИЕ: ДОРАБОТАТЬ" - если контент требует значительных улучшений
-- "РЕШЕНИЕ: ПРИНЯТЬ" - если контент достаточно хорош и готов к финализации
+Дай конструктивную обратную связь с конкретными предложениями по улучшению.
 
-Дай конструктивную обратную связь с конкретными предложениями по улучшению."""),
+""" + VERDICT_FORMAT),
         ("user", "Тема: {topic}\nАнализ: {analysis}\nКонтент: {content}\n\nОцени этот контент и дай подробную критику с решением о дальнейших действиях.")
     ])
     
-    def critic(state: AgentState) -> AgentState:
-        print("DEBUG: Критик начал работу")
-        messages = prompt.format_messages(
+    def prepare(state: AgentState):
+        log.debug("Критик начал работу")
+        return prompt.format_messages(
             topic=state["topic"],
             analysis=state["analysis"],
             content=state["content"]
         )
-        response = llm.invoke(messages)
-        state["feedback"] = response.content
-        state["messages"].append(AIMessage(content=f"Критика: {response.content}"))
-        
+    
+    def apply(state: AgentState, response):
         # Определяем решение критика
-        if "РЕШЕНИЕ: ДОРАБОТАТЬ" in response.content:
-            state["needs_revision"] = True
-            print("DEBUG: Критик решил, что контент нужно доработать")
-        elif "РЕШЕНИЕ: ПРИНЯТЬ" in response.content:
-            state["needs_revision"] = False
-            print("DEBUG: Критик принял контент")
+        verdict, update = _record_verdict(state, response.content)
+        update["feedback"] = response.content
+        update["messages"] = _log(state, AIMessage(content=f"Критика: {response.content}"))
+        if verdict["decision"] == "revise":
+            update["needs_revision"] = True
+            log.debug("Критик решил, что контент нужно доработать")
+        elif verdict["decision"] == "accept":
+            update["needs_revision"] = False
+            log.debug("Критик принял контент")
         else:
-            # По умолчанию считаем, что нужна доработка, если решение неясно
-            state["needs_revision"] = True
-            print("DEBUG: Критик не дал четкого решения, отправляем на доработку")
+            # Решение неясно: окончательно его принимает политика доработок
+            update["needs_revision"] = True
+            log.debug("Критик не дал четкого решения")
             
-        print("DEBUG: Критик завершил работу")
-        return state
+        log.debug("Критик завершил работу")
+        return update
     
-    return critic
+    return _llm_node("critic", llm, prepare, apply)
 
 
 
-def create_tools_agent():
-    """Агент-инструментарий с использованием ToolNode"""
+# Спекулятивные черновики (speculative_drafts > 1): писатель пишет несколько вариантов одновременно,
+# критик оценивает их одним вызовом, а лучший вариант принимается или дорабатывается
+DRAFT_VARIANTS = (
+    "",
+    "Сделай акцент на практических примерах и применении.",
+    "Пиши сжато и строго структурированно, с четкими выводами.",
+    "Сделай акцент на глубине анализа и аргументации.",
+    "Пиши живо и увлекательно, для широкой аудитории.",
+)
+
+MULTI_VERDICT_FORMAT = """Разбор каждого варианта начни с отдельной строки "ВАРИАНТ <номер>:".
+ВАЖНО: В конце ответа ты ДОЛЖЕН привести вердикты по всем вариантам одной строкой в формате JSON:
+{{"verdicts": [{{"draft": <номер варианта>, "score": <общая оценка от 0 до 10>, "criteria": {{"structure": <0-10>, "completeness": <0-10>, "clarity": <0-10>, "relevance": <0-10>}}, "decision": "ДОРАБОТАТЬ" или "ПРИНЯТЬ"}}, ...]}}
+- "ДОРАБОТАТЬ" - если вариант требует значительных улучшений
+- "ПРИНЯТЬ" - если вариант достаточно хорош и готов к финализации"""
+
+DRAFT_REVIEW_RE = re.compile(r"^[\s*#>-]*ВАРИАНТ\s*(\d+)\s*\**\s*[:.]?\**", re.MULTILINE | re.IGNORECASE)
+VERDICTS_JSON_RE = re.compile(r"\{\s*\"verdicts\"")
+
+def split_draft_reviews(text: str, count: int) -> List[str]:
+    """
+    Делит ответ критика о нескольких вариантах на разборы отдельных вариантов.
     
-    @tool
-    def analyze_text(text: str) -> str:
-        """
-        Анализирует текст и возвращает полезную информацию о нем.
-        
-        Args:
-            text: Текст для анализа
-        """
+    Разбор варианта - его блок "ВАРИАНТ n: ..." и JSON-вердикт из общего списка verdicts,
+    то есть текст того же вида, что ответ критика об одном варианте (см. parse_verdict).
+    
+    Returns:
+        count разборов по порядку вариантов; пустая строка, если о варианте ничего нет
+    """
+    end = len(text)
+    tail = list(VERDICTS_JSON_RE.finditer(text))
+    if tail:
+        end = tail[-1].start()
+    blocks = {}
+    markers = list(DRAFT_REVIEW_RE.finditer(text, 0, end))
+    for position, match in enumerate(markers):
+        stop = markers[position + 1].start() if position + 1 < len(markers) else end
+        blocks.setdefault(int(match.group(1)) - 1, text[match.end():stop].strip())
+    data = _last_json_object(text, ("verdicts",)) or {}
+    verdicts = {}
+    for item in data.get("verdicts") or []:
         try:
-            # Подсчет слов
-            words = text.split()
-            word_count = len(words)
-            
-            # Простой анализ настроения
-            positive_words = ['хорошо', 'отлично', 'прекрасно', 'замечательно', 'удивительно', 'великолепно']
-            negative_words = ['плохо', 'ужасно', 'отвратительно', 'ужас', 'кошмар', 'отвратительно']
-            
-            text_lower = text.lower()
-            positive_count = sum(1 for word in positive_words if word in text_lower)
-            negative_count = sum(1 for word in negative_words if word in text_lower)
-            
-            if positive_count > negative_count:
-                sentiment = "Положительная"
-            elif negative_count > positive_count:
-                sentiment = "Отрицательная"
-            else:
-                sentiment = "Нейтральная"
-            
-            # Подсчет предложений (простой способ)
-            sentences = text.split('.')
-            sentence_count = len([s for s in sentences if s.strip()])
-            
-            # Средняя длина предложения
-            avg_sentence_length = word_count / sentence_count if sentence_count > 0 else 0
-            
-            # Текущее время
-            from datetime import datetime
-            current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            
-            # Формируем результат анализа
-            analysis_result = f"""
-📊 АНАЛИЗ ТЕКСТА:
-⏰ Время анализа: {current_time}
-📝 Количество слов: {word_count}
-📄 Количество предложений: {sentence_count}
-📏 Средняя длина предложения: {avg_sentence_length:.1f} слов
-😊 Эмоциональная окраска: {sentiment}
-            """.strip()
-            
-            return analysis_result
-            
-        except Exception as e:
-            return f"Ошибка при анализе текста: {str(e)}"
+            index = int(item["draft"]) - 1
+        except (TypeError, KeyError, ValueError):
+            continue
+        verdicts.setdefault(index, json.dumps({k: v for k, v in item.items() if k != "draft"}, ensure_ascii=False))
+    return ["\n".join(part for part in (blocks.get(index), verdicts.get(index)) if part) for index in range(count)]
+
+def best_draft_index(verdicts: List[Dict[str, Any]]) -> int:
+    """Номер лучшего варианта: по оценке, при равной оценке - принятый критиком, затем более ранний"""
+    def rank(index: int):
+        verdict = verdicts[index]
+        score = verdict["score"] if verdict["score"] is not None else -1.0
+        return score, verdict["decision"] == "accept", -index
+    return max(range(len(verdicts)), key=rank)
+
+def create_speculative_writer_agent(llm=None, drafts: int = 3):
+    """
+    Агент-писатель спекулятивного режима: пишет drafts вариантов контента одновременно.
+    
+    Варианты отличаются акцентом в промпте (DRAFT_VARIANTS), поэтому различаются и по ключу
+    кэша ответов. Варианты попадают в candidates, а текущим контентом становится тот,
+    который выберет критик. При доработке все варианты переписывают выбранный контент
+    по замечаниям критика.
+    """
+    log = logger.getChild("writer")
+    if llm is None:
+        llm = get_runtime().llm
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", """Ты талантливый писатель. Создай качественный, структурированный контент на основе предоставленного анализа.
+        
+        Если есть критика от редактора, обязательно учти все замечания и улучши контент.
+        Пиши ясно, логично и увлекательно.
+        Вариант {variant}. {hint}"""),
+        ("user", """Тема: {topic}
+Анализ: {analysis}
+Предыдущий контент: {content}
+Критика редактора: {feedback}
+
+Если это первая версия (нет предыдущего контента), создай новый материал. 
+Если есть критика, улучши существующий контент, учитывая все замечания редактора.""")
+    ])
+    
+    def jobs(state: AgentState) -> List[List[Any]]:
+        return [
+            prompt.format_messages(
+                variant=index + 1,
+                hint=DRAFT_VARIANTS[index % len(DRAFT_VARIANTS)],
+                topic=state["topic"],
+                analysis=state["analysis"],
+                content=state.get("content", ""),
+                feedback=state.get("feedback", "")
+            )
+            for index in range(drafts)
+        ]
     
-    # Создаем инструменты
-    tools = [analyze_text]
+    def finish(state: AgentState, responses, started: float) -> Dict[str, Any]:
+        candidates = []
+        tokens = 0
+        for index, response in enumerate(responses):
+            if isinstance(response, Exception):
+                if not isinstance(response, DeadlineExceeded):
+                    log.warning("Ошибка варианта %s: %s", index + 1, response)
+                continue
+            candidates.append(response.content)
+            tokens += _response_tokens(response)
+        log.debug("Писатель написал вариантов: %s из %s", len(candidates), len(responses))
+        log.debug("Писатель завершил работу")
+        if not candidates:
+            if any(isinstance(response, DeadlineExceeded) for response in responses):
+                return _truncate("writer")
+            return {**_new_draft(state, f"Ошибка создания контента: {responses[0]}"),
+                    "revision_count": _next_revision_count(state), "candidates": []}
+        # Успевшие к дедлайну варианты оценит критик, если на него хватит времени
+        return {
+            "candidates": candidates,
+            "revision_count": _next_revision_count(state),
+            "tokens_used": tokens,
+            "node_timings": {"writer": time.time() - started}
+        }
     
-    def tools_agent(state: AgentState) -> AgentState:
-        print("DEBUG: ToolNode агент-инструментарий начал работу")
+    def node(state: AgentState) -> Dict[str, Any]:
+        if _out_of_time(state, ("writer", "critic")):
+            return _truncate("writer")
+        log.debug("Писатель пишет %s вариантов (итерация %s)", drafts, _next_revision_count(state))
+        todo = jobs(state)
+        started = time.time()
         
-        try:
-            # Всегда анализируем контент с помощью инструмента
-            text_to_analyze = state["content"]
-            print(f"DEBUG: Анализируем текст длиной {len(text_to_analyze)} символов")
-            
-            # Вызываем инструмент напрямую
-            analysis_result = analyze_text.invoke({"text": text_to_analyze})
-            
-            # Обогащаем контент результатами анализа
-            enriched_content = f"""
-{state["content"]}
+        def invoke_safe(messages):
+            try:
+                return _invoke_before(llm, messages, state.get("deadline"))
+            except Exception as e:
+                return e
+        
+        with ContextThreadPoolExecutor(max_workers=len(todo)) as pool:
+            responses = list(pool.map(invoke_safe, todo))
+        return finish(state, responses, started)
+    
+    async def anode(state: AgentState) -> Dict[str, Any]:
+        if _out_of_time(state, ("writer", "critic")):
+            return _truncate("writer")
+        log.debug("Писатель пишет %s вариантов (итерация %s)", drafts, _next_revision_count(state))
+        todo = jobs(state)
+        started = time.time()
+        responses = await asyncio.gather(
+            *(_await_before(llm.ainvoke(messages), state.get("deadline")) for messages in todo),
+            return_exceptions=True
+        )
+        return finish(state, responses, started)
+    
+    return RunnableLambda(node, afunc=anode, name="writer")
 
----
-{analysis_result}
-            """.strip()
-            
-            # Обновляем состояние
-            state["tools_used"] = ["analyze_text"]
-            state["tool_results"] = {"text_analysis": analysis_result}
-            state["content"] = enriched_content
-            state["messages"].append(AIMessage(content=f"Обогащенный контент: {enriched_content[:200]}..."))
-            
-            print(f"DEBUG: ToolNode агент использовал инструмент: analyze_text")
-            print(f"DEBUG: Результат анализа получен")
-            
-        except Exception as e:
-            print(f"DEBUG: Ошибка ToolNode агента: {e}")
-            # Fallback к простому анализу
-            from datetime import datetime
-            current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            word_count = len(state["content"].split())
-            
-            tools_results = {
-                "analyze_text": f"Простой анализ: {word_count} слов, Время: {current_time}"
-            }
-            tools_used = ["analyze_text"]
-            
-            state["tools_used"] = tools_used
-            state["tool_results"] = tools_results
-            
-            enriched_content = f"""
-{state["content"]}
+def create_speculative_critic_agent(llm=None, single_critic=None):
+    """
+    Агент-критик спекулятивного режима: оценивает все варианты писателя одним вызовом
+    и делает текущим контентом лучший из них.
+    
+    Оценка, решение и замечания берутся из разбора лучшего варианта, поэтому политика
+    доработок и писатель работают с ними так же, как с ответом обычного критика.
+    Контент без вариантов (после сборки разделов или запуска с сохраненного результата)
+    проверяет обычный критик single_critic.
+    """
+    log = logger.getChild("critic")
+    if llm is None:
+        llm = get_runtime().llm
+    if single_critic is None:
+        single_critic = create_critic_agent(llm)
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", """Ты строгий критик и редактор. Тебе даны несколько вариантов контента на одну тему.
+Проанализируй каждый вариант и прими решение о его качестве.
 
----
-📊 ПРОСТОЙ АНАЛИЗ:
-⏰ {current_time}
-📝 Количество слов: {word_count}
-❌ Произошла ошибка при использовании ToolNode агента
-            """.strip()
-            
-            state["content"] = enriched_content
-        
-        print("DEBUG: ToolNode агент-инструментарий завершил работу")
-        return state
+Критерии оценки:
+- Структура и логика изложения (structure)
+- Полнота раскрытия темы (completeness)
+- Качество и ясность текста (clarity)
+- Соответствие теме (relevance)
+
+Для каждого варианта дай конструктивную обратную связь с конкретными предложениями по улучшению.
+
+""" + MULTI_VERDICT_FORMAT),
+        ("user", "Тема: {topic}\nАнализ: {analysis}\n\n{drafts}\n\nОцени каждый вариант и дай подробную критику с решением о дальнейших действиях.")
+    ])
     
-    return tools_agent
+    def prepare(state: AgentState):
+        log.debug("Критик оценивает вариантов: %s", len(state["candidates"]))
+        return prompt.format_messages(
+            topic=state["topic"],
+            analysis=state["analysis"],
+            drafts="\n\n".join(f"ВАРИАНТ {index + 1}:\n{text}" for index, text in enumerate(state["candidates"]))
+        )
+    
+    def accept(state: AgentState, text: str, review: str) -> Dict[str, Any]:
+        """Делает вариант текущей версией контента и записывает его разбор как вердикт критика"""
+        draft = _new_draft(state, text)
+        verdict, update = _record_verdict({**state, **draft}, review)
+        drafts = {**draft.get("drafts", {}), **update.get("drafts", {})}
+        update.update({
+            "content": draft["content"],
+            "draft_id": draft["draft_id"],
+            "candidates": [],
+            "feedback": review,
+            "needs_revision": verdict["decision"] != "accept",
+            "messages": _log(state, _draft_message(draft["draft_id"]), AIMessage(content=f"Критика: {review}"))
+        })
+        if drafts:
+            update["drafts"] = drafts
+        return update
+    
+    def apply(state: AgentState, response):
+        candidates = state["candidates"]
+        reviews = split_draft_reviews(response.content, len(candidates))
+        verdicts = [parse_verdict(review) for review in reviews]
+        best = best_draft_index(verdicts)
+        log.debug("Оценки вариантов: %s, выбран вариант %s", [verdict["score"] for verdict in verdicts], best + 1)
+        log.debug("Критик завершил работу")
+        # Без разбора по вариантам замечания лучшего варианта - весь ответ критика
+        return accept(state, candidates[best], reviews[best] or response.content)
+    
+    batched = _llm_node("critic", llm, prepare, apply)
+    
+    def settle(state: AgentState, update: Dict[str, Any]) -> Dict[str, Any]:
+        if update.get("truncated") and "candidates" not in update:
+            # Критик не успел до дедлайна: берем первый вариант без оценки,
+            # а инструменты отдадут лучшую оцененную версию, если она есть
+            update = {**update, **_new_draft(state, state["candidates"][0]), "candidates": []}
+        return update
+    
+    def node(state: AgentState, config) -> Dict[str, Any]:
+        if not state.get("candidates"):
+            return single_critic.invoke(state, config)
+        return settle(state, batched.invoke(state, config))
+    
+    async def anode(state: AgentState, config) -> Dict[str, Any]:
+        if not state.get("candidates"):
+            return await single_critic.ainvoke(state, config)
+        return settle(state, await batched.ainvoke(state, config))
+    
+    return RunnableLambda(node, afunc=anode, name="critic")
 
-# Функция принятия решения для условного перехода
-def should_continue(state: AgentState) -> str:
-    """Определяет, нужна ли доработка контента или можно финализировать"""
-    max_revisions = 3  # Максимальное количество доработок
-    current_revisions = state.get("revision_count", 0)
+
+
+# Адресные доработки (revision_mode="segments"): критик ссылается на фрагменты по id,
+# писатель переписывает только их, а критик перепроверяет только измененный текст
+ISSUE_RE = re.compile(r"ЗАМЕЧАНИЕ\s*\[(P\d+)\]\s*:\s*(.+)")
+
+def split_segments(content: str) -> List[str]:
+    """Разбивает контент на фрагменты по пустым строкам"""
+    return [block.strip() for block in re.split(r"\n\s*\n", content) if block.strip()]
+
+def segment_id(index: int) -> str:
+    """Идентификатор фрагмента, на который ссылается критик"""
+    return f"P{index + 1}"
+
+def segment_hash(text: str) -> str:
+    """Ключ кэша вердиктов: одинаковый текст фрагмента не перепроверяется"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+def current_segments(state: AgentState) -> List[str]:
+    """Фрагменты текущей версии контента"""
+    segments = state.get("segments") or []
+    if "\n\n".join(segments) == state["content"]:
+        return segments
+    return split_segments(state["content"])
+
+def _outstanding_issues(segments: List[str], verdicts: Dict[str, str]) -> Dict[str, str]:
+    """Замечания, которые относятся к текущему тексту фрагментов"""
+    issues = {}
+    for index, segment in enumerate(segments):
+        issue = verdicts.get(segment_hash(segment))
+        if issue:
+            issues[segment_id(index)] = issue
+    return issues
+
+def pending_segments(segments: List[str], verdicts: Dict[str, str]) -> List[int]:
+    """Номера фрагментов, для которых у критика еще нет вердикта"""
+    return [index for index, segment in enumerate(segments) if segment_hash(segment) not in verdicts]
+
+def is_recheck(segments: List[str], pending: List[int]) -> bool:
+    """
+    Перепроверка исправлений: часть фрагментов текущего текста уже принята критиком.
     
-    if state.get("needs_revision", True) and current_revisions < max_revisions:
-        print(f"DEBUG: Отправляем контент на доработку писателю (итерация {current_revisions + 1}/{max_revisions})")
-        return "writer"
-    else:
-        if current_revisions >= max_revisions:
-            print(f"DEBUG: Достигнут лимит доработок ({max_revisions}), переходим к инструментам")
+    После полной доработки все фрагменты новые, и текст проверяется целиком, с анализом.
+    """
+    return len(pending) < len(segments)
+
+def create_segment_critic_agent(llm=None):
+    """Агент-критик для адресных доработок: дает замечания по фрагментам и переиспользует прежние вердикты"""
+    log = logger.getChild("critic")
+    if llm is None:
+        llm = get_runtime().llm
+    system_prompt = """Ты строгий критик и редактор. Твоя задача - проанализировать контент и принять решение о его качестве.
+
+Критерии оценки:
+- Структура и логика изложения
+- Полнота раскрытия темы  
+- Качество и ясность текста
+- Соответствие теме
+
+Контент разбит на фрагменты с идентификаторами [P1], [P2] и т.д.
+Для каждого фрагмента, который требует доработки, напиши замечание отдельной строкой:
+ЗАМЕЧАНИЕ [P<номер>]: <что именно исправить>
+Фрагменты без замечаний не упоминай.
+
+""" + VERDICT_FORMAT
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        ("user", "Тема: {topic}\nАнализ: {analysis}\nКонтент:\n{segments}\n\nОцени этот контент и дай замечания по фрагментам с решением о дальнейших действиях.")
+    ])
+    recheck_prompt = ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        ("user", "Тема: {topic}\nПовторная проверка: остальные фрагменты уже приняты, ниже только исправленные.\nФрагменты:\n{segments}\n\nОцени исправленные фрагменты и дай замечания с решением о дальнейших действиях.")
+    ])
+    
+    def decide(segments: List[str], verdicts: Dict[str, str], decision: Optional[str], recheck: bool) -> Dict[str, Any]:
+        update = {
+            "segments": segments,
+            "segment_verdicts": verdicts,
+            "segment_issues": _outstanding_issues(segments, verdicts)
+        }
+        if update["segment_issues"]:
+            update["needs_revision"] = True
+            log.debug("Критик оставил замечания к фрагментам: %s", ', '.join(update['segment_issues']))
+        elif decision == "accept" or recheck:
+            # При перепроверке без новых замечаний все исправления приняты
+            update["needs_revision"] = False
+            log.debug("Критик принял контент")
         else:
-            print("DEBUG: Контент принят, переходим к инструментам")
-        return "tools"
+            # Доработка без адресных замечаний: писатель переписывает материал целиком
+            update["needs_revision"] = True
+            log.debug("Критик не дал адресных замечаний, отправляем на полную доработку")
+        return update
+    
+    def prepare(state: AgentState):
+        log.debug("Критик начал работу")
+        segments = current_segments(state)
+        verdicts = state.get("segment_verdicts") or {}
+        pending = pending_segments(segments, verdicts)
+        if not pending:
+            log.debug("Все фрагменты уже проверены, используем сохраненные вердикты")
+            return decide(segments, verdicts, "accept", recheck=True)
+        log.debug("Критик проверяет фрагментов: %s из %s", len(pending), len(segments))
+        segments_text = "\n\n".join(
+            f"[{segment_id(index)}]\n{segments[index]}" for index in pending
+        )
+        if is_recheck(segments, pending):
+            return recheck_prompt.format_messages(topic=state["topic"], segments=segments_text)
+        return prompt.format_messages(topic=state["topic"], analysis=state["analysis"], segments=segments_text)
+    
+    def apply(state: AgentState, response):
+        segments = current_segments(state)
+        verdicts = dict(state.get("segment_verdicts") or {})
+        pending = pending_segments(segments, verdicts)
+        recheck = is_recheck(segments, pending)
+        issues = dict(ISSUE_RE.findall(response.content))
+        for index in pending:
+            verdicts[segment_hash(segments[index])] = issues.get(segment_id(index), "").strip()
+        verdict, update = _record_verdict(state, response.content)
+        update["feedback"] = response.content
+        update["messages"] = _log(state, AIMessage(content=f"Критика: {response.content}"))
+        update.update(decide(segments, verdicts, verdict["decision"], recheck))
+        log.debug("Критик завершил работу")
+        return update
+    
+    return _llm_node("critic", llm, prepare, apply)
 
-# Создаем граф агентов
-def create_agent_graph():
-    """Создает граф мультиагентной системы с простой нодой для инструментов"""
+def create_segment_writer_agent(llm=None, full_writer=None):
+    """
+    Агент-писатель для адресных доработок: переписывает только фрагменты с замечаниями.
     
-    # Создаем граф
-    workflow = StateGraph(AgentState)
+    Первая версия материала и доработки без адресных замечаний выполняются
+    обычным писателем full_writer.
+    """
+    log = logger.getChild("writer")
+    if llm is None:
+        llm = get_runtime().llm
+    if full_writer is None:
+        full_writer = create_writer_agent(llm)
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", """Ты талантливый писатель. Перепиши один фрагмент материала, учитывая замечание редактора.
+        Сохрани стиль и связность с соседними фрагментами. Верни только новый текст фрагмента, без пояснений."""),
+        ("user", """Тема: {topic}
+Предыдущий фрагмент: {before}
+Фрагмент для доработки: {segment}
+Следующий фрагмент: {after}
+Замечание редактора: {issue}""")
+    ])
+    
+    def jobs(state: AgentState) -> List[Tuple[int, List[Any]]]:
+        segments = state["segments"]
+        result = []
+        for index, segment in enumerate(segments):
+            issue = state["segment_issues"].get(segment_id(index))
+            if issue:
+                result.append((index, prompt.format_messages(
+                    topic=state["topic"],
+                    before=segments[index - 1][-500:] if index > 0 else "",
+                    segment=segment,
+                    after=segments[index + 1][:500] if index + 1 < len(segments) else "",
+                    issue=issue
+                )))
+        return result
+    
+    def apply(state: AgentState, rewritten: List[Tuple[int, Any]]) -> Dict[str, Any]:
+        segments = list(state["segments"])
+        changed = []
+        tokens = 0
+        for index, response in rewritten:
+            if isinstance(response, Exception):
+                log.warning("Ошибка доработки фрагмента %s: %s", segment_id(index), response)
+                continue
+            segments[index] = response.content.strip()
+            changed.append(segment_id(index))
+            tokens += _response_tokens(response)
+        log.debug("Писатель переписал фрагменты: %s", ', '.join(changed) or 'нет')
+        log.debug("Писатель завершил работу")
+        return {
+            **_new_draft(state, "\n\n".join(segments)),
+            "revision_count": state.get("revision_count", 0) + 1,
+            "segments": segments,
+            "changed_segments": changed,
+            "tokens_used": tokens
+        }
+    
+    def is_segment_revision(state: AgentState) -> bool:
+        return bool(state.get("content", "").strip()) and bool(state.get("segment_issues"))
+    
+    def finish(state: AgentState, todo, responses, started: float) -> Dict[str, Any]:
+        update = apply(state, [(index, response) for (index, _), response in zip(todo, responses)])
+        if any(isinstance(response, DeadlineExceeded) for response in responses):
+            # Успевшие фрагменты сохраняем, но проверять их критик уже не будет
+            update["truncated"] = True
+        update["node_timings"] = {"writer": time.time() - started}
+        return update
+    
+    def node(state: AgentState, config) -> Dict[str, Any]:
+        if not is_segment_revision(state):
+            return {**full_writer.invoke(state, config), "changed_segments": []}
+        if _out_of_time(state, ("writer", "critic")):
+            return _truncate("writer")
+        log.debug("Писатель дорабатывает фрагменты по замечаниям (итерация %s)", state.get('revision_count', 0) + 1)
+        todo = jobs(state)
+        started = time.time()
+        
+        def invoke_safe(messages):
+            try:
+                return _invoke_before(llm, messages, state.get("deadline"))
+            except Exception as e:
+                return e
+        
+        with ContextThreadPoolExecutor(max_workers=len(todo)) as pool:
+            responses = list(pool.map(invoke_safe, [messages for _, messages in todo]))
+        return finish(state, todo, responses, started)
+    
+    async def anode(state: AgentState, config) -> Dict[str, Any]:
+        if not is_segment_revision(state):
+            return {**await full_writer.ainvoke(state, config), "changed_segments": []}
+        if _out_of_time(state, ("writer", "critic")):
+            return _truncate("writer")
+        log.debug("Писатель дорабатывает фрагменты по замечаниям (итерация %s)", state.get('revision_count', 0) + 1)
+        todo = jobs(state)
+        started = time.time()
+        responses = await asyncio.gather(
+            *(_await_before(llm.ainvoke(messages), state.get("deadline")) for _, messages in todo),
+            return_exceptions=True
+        )
+        return finish(state, todo, responses, started)
     
-    # Создаем простую функцию для анализа текста
-    def analyze_text_node(state: AgentState) -> AgentState:
-        """Нода для анализа текста с помощью инструмента"""
-        print("DEBUG: Анализ текста с помощью инструмента")
+    return RunnableLambda(node, afunc=anode, name="writer")
+
+@tool
+def analyze_text(text: str) -> str:
+    """
+    Анализирует текст и возвращает полезную информацию о нем.
+    
+    Args:
+        text: Текст для анализа
+    """
+    try:
+        return text_analytics.format_report(text_analytics.analyze_text(text))
+    except Exception as e:
+        return f"Ошибка при анализе текста: {str(e)}"
+
+def create_tools_agent():
+    """Нода-инструментарий: анализирует финальный контент и обогащает его результатами"""
+    log = logger.getChild("tools")
+    
+    def tools_agent(state: AgentState) -> Dict[str, Any]:
+        content = state["content"]
+        update = {}
+        best_text = _draft_text(state, state.get("best_draft"))
+        if state.get("truncated") and best_text:
+            # Запуск прерван дедлайном: отдаем версию с лучшей оценкой критика
+            content = best_text
+            update["draft_id"] = state["best_draft"]
+        if not state.get("keep_drafts") and state.get("drafts"):
+            # Запуск завершается: промежуточные версии больше не нужны
+            update["drafts"] = dict.fromkeys(state["drafts"])
+        update["accepted_content"] = content
+        if not content.strip():
+            # Дедлайн истек до первой версии: анализировать нечего, контент остается пустым
+            log.debug("Контента нет, анализ текста пропущен")
+            return update
+        log.debug("Анализ текста с помощью инструмента")
         
         try:
-            # Создаем инструмент
-            @tool
-            def analyze_text(text: str) -> str:
-                """Анализирует текст и возвращает статистику"""
-                try:
-                    words = text.split()
-                    word_count = len(words)
-                    sentences = text.split('.')
-                    sentence_count = len([s for s in sentences if s.strip()])
-                    
-                    from datetime import datetime
-                    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    
-                    return f"""
-📊 АНАЛИЗ ТЕКСТА:
-⏰ Время анализа: {current_time}
-📝 Количество слов: {word_count}
-📄 Количество предложений: {sentence_count}
-                    """.strip()
-                except Exception as e:
-                    return f"Ошибка при анализе текста: {str(e)}"
-            
             # Анализируем контент
-            text_to_analyze = state["content"]
-            analysis_result = analyze_text.invoke({"text": text_to_analyze})
+            prefetch = state.get("tool_prefetch") or {}
+            draft_id = update.get("draft_id", state.get("draft_id"))
+            if prefetch.get("draft_id") == draft_id and prefetch.get("key") == segment_hash(content):
+                # Текст уже проанализирован, пока критик проверял ту же версию
+                analysis_result = prefetch["result"]
+            else:
+                analysis_result = analyze_text.invoke({"text": content})
             
             # Обогащаем контент результатами анализа
             enriched_content = f"""
-{state["content"]}
+{content}
 
 ---
 {analysis_result}
             """.strip()
             
             # Обновляем состояние
-            state["tools_used"] = ["analyze_text"]
-            state["tool_results"] = {"analyze_text": analysis_result}
-            state["content"] = enriched_content
-            state["messages"].append(AIMessage(content=f"Обогащенный контент: {enriched_content[:200]}..."))
+            update["tools_used"] = ["analyze_text"]
+            update["tool_results"] = {"analyze_text": analysis_result}
+            update["content"] = enriched_content
+            update["messages"] = _log(state, AIMessage(content=f"Обогащенный контент: {enriched_content[:200]}..."))
             
-            print(f"DEBUG: Контент обогащен результатами анализа")
+            log.debug("Контент обогащен результатами анализа")
             
         except Exception as e:
-            print(f"DEBUG: Ошибка анализа текста: {e}")
+            log.warning("Ошибка анализа текста: %s", e)
             # Fallback к простому анализу
-            from datetime import datetime
             current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            word_count = len(state["content"].split())
+            word_count = len(content.split())
             
             tools_results = {
                 "text_analysis": f"Простой анализ: {word_count} слов, Время: {current_time}"
             }
             tools_used = ["analyze_text"]
             
-            state["tools_used"] = tools_used
-            state["tool_results"] = tools_results
+            update["tools_used"] = tools_used
+            update["tool_results"] = tools_results
             
             enriched_content = f"""
-{state["content"]}
+{content}
 
 ---
 📊 ПРОСТОЙ АНАЛИЗ:
@@ -393,25 +1519,183 @@ def create_agent_graph():
 ❌ Произошла ошибка при использовании инструмента анализа
             """.strip()
             
-            state["content"] = enriched_content
+            update["content"] = enriched_content
+        
+        return update
+    
+    return tools_agent
+
+@dataclass(frozen=True)
+class RevisionPolicy:
+    """
+    Политика доработок: решает после каждого вердикта критика, нужен ли еще круг писатель → критик.
+    
+    Доработка прекращается, если критик принял контент, исчерпан лимит итераций,
+    оценка достигла порога, оценка почти не растет между итерациями или
+    исчерпан бюджет запуска по токенам или времени.
+    
+    Attributes:
+        max_revisions: Максимальное количество доработок
+        score_threshold: Оценка (0-10), начиная с которой контент принимается; None - не учитывать
+        min_improvement: Минимальный прирост оценки за итерацию; меньший прирост останавливает доработки
+        max_tokens: Бюджет токенов на запуск; None - без ограничения
+        max_latency: Бюджет времени на запуск в секундах; None - без ограничения
+        revise_on_unclear: Отправлять ли на доработку, если критик не дал ни решения, ни оценки
+    """
+    max_revisions: int = 3
+    score_threshold: Optional[float] = 8.0
+    min_improvement: Optional[float] = 0.5
+    max_tokens: Optional[int] = None
+    max_latency: Optional[float] = None
+    revise_on_unclear: bool = False
+    
+    def stop_reason(self, state: AgentState) -> Optional[str]:
+        """Причина завершения доработок или None, если нужен еще один круг"""
+        verdict = state.get("verdict") or {}
+        score = verdict.get("score")
+        scores = state.get("scores", [])
         
-        return state
+        if state.get("truncated"):
+            return "Истек дедлайн запуска"
+        if not state.get("needs_revision", True):
+            return "Контент принят"
+        if verdict.get("decision") is None and score is None and not self.revise_on_unclear:
+            return "Критик не дал четкого решения, контент принимается как есть"
+        if state.get("revision_count", 0) >= self.max_revisions:
+            return f"Достигнут лимит доработок ({self.max_revisions})"
+        if self.score_threshold is not None and score is not None and score >= self.score_threshold:
+            return f"Оценка {score} достигла порога {self.score_threshold}"
+        if self.min_improvement is not None and len(scores) >= 2 and scores[-1] - scores[-2] < self.min_improvement:
+            return f"Оценка почти не растет ({scores[-2]} → {scores[-1]})"
+        if self.max_tokens is not None and state.get("tokens_used", 0) >= self.max_tokens:
+            return f"Исчерпан бюджет токенов ({state.get('tokens_used', 0)}/{self.max_tokens})"
+        if self.max_latency is not None and time.time() - state.get("started_at", time.time()) >= self.max_latency:
+            return f"Исчерпан бюджет времени ({self.max_latency} с)"
+        return None
+    
+    def __call__(self, state: AgentState) -> str:
+        """Условный переход от критика: writer или tools"""
+        reason = self.stop_reason(state)
+        if reason is None:
+            logger.debug("Отправляем контент на доработку писателю (итерация %s/%s)", state.get('revision_count', 0) + 1, self.max_revisions)
+            return "writer"
+        logger.debug("%s, переходим к инструментам", reason)
+        return "tools"
+
+# Функция принятия решения для условного перехода
+def should_continue(state: AgentState, max_revisions: int = 3) -> str:
+    """Определяет, нужна ли доработка контента или можно финализировать"""
+    return RevisionPolicy(max_revisions=max_revisions)(state)
+
+# Создаем граф агентов
+def create_agent_graph(llm=None, max_revisions: int = 3, callbacks: Optional[List[Any]] = None,
+                       cache: Optional[ResponseCache] = None, cache_policy: Optional[Dict[str, str]] = None,
+                       checkpointer=None, parallel_sections: bool = False, section_concurrency: Optional[int] = None,
+                       revision_mode: str = "full", revision_policy: Optional[RevisionPolicy] = None,
+                       metrics: Optional[MetricsRegistry] = None, limiter: Optional[LLMLimiter] = None,
+                       pipelined: bool = False, speculative_drafts: int = 1):
+    """
+    Создает граф мультиагентной системы с простой нодой для инструментов
+    
+    Args:
+        llm: Модель для агентов; по умолчанию берется из окружения get_runtime()
+        max_revisions: Максимальное количество доработок
+        callbacks: Callback-обработчики графа; по умолчанию трассировка окружения get_runtime()
+        cache: Кэш ответов LLM; None отключает кэширование
+        cache_policy: Режимы кэширования по нодам, см. llm_cache.DEFAULT_CACHE_POLICY
+        checkpointer: Чекпоинтер LangGraph; при его наличии запуск сохраняется после каждой ноды
+            и может быть продолжен с места сбоя по thread_id
+        parallel_sections: Аналитик перечисляет разделы, которые пишутся параллельно
+            и собираются в единый материал перед критиком; доработки выполняет обычный писатель
+        section_concurrency: Ограничение числа одновременно выполняемых нод за запуск
+            (в режиме parallel_sections - число одновременно пишущихся разделов)
+        revision_mode: "full" - писатель переписывает материал целиком;
+            "segments" - критик дает замечания по фрагментам, писатель переписывает только их,
+            а критик перепроверяет только измененные фрагменты
+        revision_policy: Политика доработок; по умолчанию RevisionPolicy(max_revisions=max_revisions)
+        metrics: Реестр метрик; при его наличии длительности нод, вызовы LLM и токены
+            записываются через MetricsCallbackHandler
+        limiter: Общие ограничения вызовов LLM: лимиты запросов и токенов, адаптивный параллелизм,
+            повторы и дублирование медленных вызовов; None при модели из окружения - ограничения
+            окружения get_runtime(), при переданной модели - вызовы без ограничений
+        pipelined: Конвейерный режим: разделы плана пишутся параллельно уже во время ответа аналитика
+            (как parallel_sections, но без ожидания всего анализа), а анализ текста для инструментов
+            выполняется одновременно с проверкой критиком
+        speculative_drafts: Сколько вариантов контента писатель пишет одновременно на каждом круге;
+            критик оценивает их одним вызовом и выбирает лучший, который принимается или дорабатывается
+            по revision_policy (порог принятия - score_threshold); токены вариантов в поток не передаются.
+            1 - один вариант за круг
+    """
+    if revision_mode not in ("full", "segments"):
+        raise ValueError(f"Неизвестный режим доработки: {revision_mode}")
+    if speculative_drafts < 1:
+        raise ValueError(f"Число вариантов должно быть не меньше 1: {speculative_drafts}")
+    if speculative_drafts > 1 and revision_mode == "segments":
+        raise ValueError('speculative_drafts несовместим с revision_mode="segments"')
+    if llm is None:
+        runtime = get_runtime()
+        llm = runtime.llm
+        # Клиент из окружения сам не повторяет запросы: ограничения берем у того же окружения
+        if limiter is None:
+            limiter = runtime.limiter
+    if callbacks is None:
+        callbacks = get_runtime().trace_callbacks()
+    if metrics is not None:
+        callbacks = list(callbacks) + [MetricsCallbackHandler(metrics)]
+    
+    # Создаем граф
+    workflow = StateGraph(AgentState)
     
     # Добавляем узлы (агентов)
-    workflow.add_node("analyst", create_analyst_agent())
-    workflow.add_node("writer", create_writer_agent())
-    workflow.add_node("critic", create_critic_agent())
-    workflow.add_node("tools", analyze_text_node)
+    def node_llm(node: str):
+        # Кэш снаружи: ответ из кэша не расходует лимиты провайдера
+        return with_cache(with_limits(llm, limiter, node), cache, node, cache_policy)
+    
+    if pipelined:
+        workflow.add_node("analyst", create_pipelined_analyst_agent(node_llm("analyst"), node_llm("section_writer")))
+    else:
+        workflow.add_node("analyst", create_analyst_agent(node_llm("analyst"), sections=parallel_sections))
+    writer_llm = node_llm("writer")
+    critic_llm = node_llm("critic")
+    if revision_mode == "segments":
+        workflow.add_node("writer", create_segment_writer_agent(writer_llm, create_writer_agent(writer_llm)))
+        workflow.add_node("critic", create_segment_critic_agent(critic_llm))
+    elif speculative_drafts > 1:
+        workflow.add_node("writer", create_speculative_writer_agent(writer_llm, speculative_drafts))
+        workflow.add_node("critic", create_speculative_critic_agent(critic_llm, create_critic_agent(critic_llm)))
+    else:
+        workflow.add_node("writer", create_writer_agent(writer_llm))
+        workflow.add_node("critic", create_critic_agent(critic_llm))
+    workflow.add_node("tools", create_tools_agent())
     
     # Определяем поток выполнения
-    workflow.set_entry_point("analyst")
-    workflow.add_edge("analyst", "writer")
+    # Запуск с сохраненным контентом похожей темы начинается с его проверки критиком
+    workflow.set_conditional_entry_point(route_start, ["analyst", "critic"])
+    if pipelined:
+        # Разделы уже написаны в ноде аналитика: остается собрать их
+        workflow.add_node("merge_sections", merge_sections)
+        workflow.add_conditional_edges("analyst", route_pipelined, ["merge_sections", "writer"])
+        workflow.add_edge("merge_sections", "critic")
+        # Анализ текста идет параллельно с критиком; инструменты возьмут его, если контент принят как есть
+        workflow.add_node("tools_prefetch", create_tools_prefetch_agent())
+        workflow.add_edge("merge_sections", "tools_prefetch")
+        workflow.add_edge("writer", "tools_prefetch")
+        workflow.add_edge("tools_prefetch", END)
+    elif parallel_sections:
+        # Map-reduce: каждый раздел плана пишется отдельной задачей, затем разделы собираются
+        workflow.add_node("section_writer", create_section_writer_agent(node_llm("section_writer")))
+        workflow.add_node("merge_sections", merge_sections)
+        workflow.add_conditional_edges("analyst", route_sections, ["section_writer", "writer"])
+        workflow.add_edge("section_writer", "merge_sections")
+        workflow.add_edge("merge_sections", "critic")
+    else:
+        workflow.add_edge("analyst", "writer")
     workflow.add_edge("writer", "critic")
     
     # Условный переход от критика
     workflow.add_conditional_edges(
         "critic",
-        should_continue,
+        revision_policy or RevisionPolicy(max_revisions=max_revisions),
         {
             "writer": "writer",  # Если нужна доработка - обратно к писателю
             "tools": "tools"     # Если контент принят - к инструментам
@@ -420,59 +1704,570 @@ def create_agent_graph():
     
     workflow.add_edge("tools", END)
     
-    return workflow.compile().with_config(callbacks=[langfuse_handler])
+    config = {"callbacks": callbacks}
+    if section_concurrency is not None:
+        config["max_concurrency"] = section_concurrency
+    return workflow.compile(checkpointer=checkpointer).with_config(**config)
 
-# Функция для запуска мультиагентной системы
-def run_multi_agent_system(topic: str) -> Dict[str, Any]:
+def _resolve_deadline(timeout: Optional[float], deadline: Optional[float]) -> Optional[float]:
+    """Дедлайн запуска по таймауту в секундах и/или абсолютному времени (time.time())"""
+    if timeout is not None:
+        deadline = min(deadline, time.time() + timeout) if deadline is not None else time.time() + timeout
+    return deadline
+
+def _initial_state(topic: str, deadline: Optional[float] = None, keep_drafts: bool = True,
+                   max_messages: Optional[int] = None, seed: Optional[StoredResult] = None) -> AgentState:
     """
-    Запускает мультиагентную систему для обработки заданной темы
+    Создает начальное состояние графа для темы.
     
-    Args:
-        topic: Тема для обработки
-        use_langfuse: Использовать ли Langfuse трассировку
-        
-    Returns:
-        Результат работы системы
+    С seed запуск начинается с анализа и принятого контента похожей темы:
+    контент становится версией 0 и сразу отправляется критику.
     """
-    # Создаем граф
-    graph = create_agent_graph()
-    
-    # Инициализируем состояние
-    initial_state = AgentState(
-        messages=[],
+    content = seed.result["accepted_content"] if seed is not None else ""
+    return AgentState(
+        messages=[_draft_message(0)] if content else [],
         topic=topic,
-        analysis="",
-        content="",
+        analysis=seed.result["analysis"] if seed is not None else "",
+        content=content,
         feedback="",
         final_result="",
         tools_used=[],
         tool_results={},
         tools=[],  # Результаты от ToolNode
         needs_revision=False,
-        revision_count=0
+        revision_count=0,
+        sections=[],
+        section_drafts={},
+        segments=[],
+        segment_issues={},
+        segment_verdicts={},
+        changed_segments=[],
+        verdict={},
+        scores=[],
+        tokens_used=0,
+        started_at=time.time(),
+        deadline=deadline,
+        truncated=False,
+        node_timings={},
+        draft_id=0 if content else None,
+        drafts={},
+        best_draft=None,
+        best_score=None,
+        keep_drafts=keep_drafts,
+        max_messages=max_messages,
+        tool_prefetch={},
+        accepted_content="",
+        candidates=[]
     )
-    
-    # Запускаем систему
-    result = graph.invoke(initial_state)
-    
+
+def _expand_messages(result: AgentState) -> List[Any]:
+    """Журнал запуска, в котором ссылки на анализ и версии контента заменены их текстом"""
+    messages = []
+    for message in result.get("messages", []):
+        ref = message.additional_kwargs.get("ref")
+        if ref == "analysis":
+            message = AIMessage(content=f"Анализ: {result['analysis']}", id=message.id)
+        elif ref == "draft":
+            text = _draft_text(result, message.additional_kwargs["draft_id"])
+            if text is not None:
+                message = AIMessage(content=f"Контент: {text}", id=message.id)
+        messages.append(message)
+    return messages
+
+def _build_result(result: AgentState, run_id: Optional[str] = None) -> Dict[str, Any]:
+    """Преобразует финальное состояние графа в результат работы системы"""
     return {
+        "run_id": run_id,
         "topic": result["topic"],
         "analysis": result["analysis"],
         "content": result["content"],
         "feedback": result["feedback"],
+        "verdict": result.get("verdict", {}),
+        "scores": result.get("scores", []),
+        "tokens_used": result.get("tokens_used", 0),
+        "truncated": result.get("truncated", False),
         "final_result": result["content"],  # Используем content как финальный результат
-        "messages": result["messages"],
+        "messages": _expand_messages(result),
         "tools_used": result.get("tools_used", []),
-        "tool_results": result.get("tool_results", {})
+        "tool_results": result.get("tool_results", {}),
+        "accepted_content": result.get("accepted_content", "")
     }
 
-# Пример использования
-if __name__ == "__main__":
+def jsonable_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Результат запуска в виде, пригодном для JSON: сообщения LangChain заменяются словарями"""
+    messages = [
+        message if isinstance(message, dict) else {"type": message.type, "content": message.content}
+        for message in result.get("messages", [])
+    ]
+    return {**result, "messages": messages}
+
+def _lookup_result(runtime: AgentRuntime, topic: str) -> Optional[StoredResult]:
+    """Результат похожей темы из хранилища окружения; для seed нужен сохраненный принятый контент"""
+    if runtime.result_store is None:
+        return None
+    stored = runtime.result_store.lookup(topic)
+    if stored is None or (stored.mode != REUSE_RESULT and not stored.result.get("accepted_content")):
+        return None
+    logger.info("Тема «%s» похожа на «%s» (%.2f): %s", topic, stored.topic, stored.similarity,
+                "результат переиспользован" if stored.mode == REUSE_RESULT else "запуск с сохраненного контента")
+    return stored
+
+def _reused_result(topic: str, stored: StoredResult) -> Dict[str, Any]:
+    """Сохраненный результат похожей темы в формате результата запуска"""
+    return {
+        **stored.result,
+        # В хранилище журнал лежит словарями (jsonable_result); результат запуска содержит сообщения
+        "messages": convert_to_messages(stored.result.get("messages", [])),
+        "run_id": None,
+        "topic": topic,
+        "tokens_used": 0,
+        "reused": {"topic": stored.topic, "similarity": stored.similarity, "mode": stored.mode}
+    }
+
+def _store_result(runtime: AgentRuntime, result: Dict[str, Any], seed: Optional[StoredResult]) -> Dict[str, Any]:
+    """Сохраняет полный результат в хранилище окружения и отмечает, с чего начинался запуск"""
+    if seed is not None:
+        result["reused"] = {"topic": seed.topic, "similarity": seed.similarity, "mode": seed.mode}
+    if runtime.result_store is not None and not result["truncated"] and result["accepted_content"]:
+        runtime.result_store.put(result["topic"], jsonable_result({k: v for k, v in result.items() if k != "reused"}))
+    return result
+
+def _run_config(runtime: AgentRuntime, run_id: Optional[str]) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    """Конфигурация запуска: при наличии чекпоинтера запуск привязывается к thread_id"""
+    if runtime.checkpointer is None:
+        return None, None
+    run_id = run_id or uuid.uuid4().hex
+    return run_id, {"configurable": {"thread_id": run_id}}
+
+# Функция для запуска мультиагентной системы
+def run_multi_agent_system(topic: str, runtime: Optional[AgentRuntime] = None,
+                           run_id: Optional[str] = None, timeout: Optional[float] = None,
+                           deadline: Optional[float] = None, keep_drafts: bool = True,
+                           max_messages: Optional[int] = None, **graph_options) -> Dict[str, Any]:
+    """
+    Запускает мультиагентную систему для обработки заданной темы
+    
+    Args:
+        topic: Тема для обработки
+        runtime: Окружение с клиентами и кэшем графов; по умолчанию get_runtime()
+        graph_options: Параметры графа (max_revisions, parallel_sections, ...), см. create_agent_graph
+        run_id: Идентификатор запуска для чекпоинтов; по умолчанию генерируется
+        timeout: Ограничение времени запуска в секундах; по истечении вызовы LLM отменяются,
+            доработки пропускаются и возвращается лучший полученный контент с truncated=True
+        deadline: То же в виде абсолютного времени time.time(); учитывается более ранний из двух
+        keep_drafts: Хранить в состоянии все версии контента, чтобы messages результата содержали
+            их текст; False - хранятся только текущая и лучшая по оценке критика, а к концу
+            запуска - только финальная, промежуточные версии в messages остаются ссылками "[версия N]"
+        max_messages: Сколько последних сообщений хранить в messages; None - все, 0 - не вести журнал
+        
+    Returns:
+        Результат работы системы
+    """
+    runtime = runtime or get_runtime()
+    # Похожую тему уже обрабатывали: возвращаем результат или начинаем с него
+    stored = _lookup_result(runtime, topic)
+    if stored is not None and stored.mode == REUSE_RESULT:
+        return _reused_result(topic, stored)
+    # Берем скомпилированный граф из кэша окружения
+    graph = runtime.get_graph(**graph_options)
+    run_id, config = _run_config(runtime, run_id)
+    
+    # Запускаем систему
+    state = _initial_state(topic, _resolve_deadline(timeout, deadline), keep_drafts, max_messages, stored)
+    result = graph.invoke(state, config)
+    
+    return _store_result(runtime, _build_result(result, run_id), stored)
+
+async def arun_multi_agent_system(topic: str, runtime: Optional[AgentRuntime] = None,
+                                  run_id: Optional[str] = None, timeout: Optional[float] = None,
+                                  deadline: Optional[float] = None, keep_drafts: bool = True,
+                                  max_messages: Optional[int] = None, **graph_options) -> Dict[str, Any]:
+    """
+    Асинхронно запускает мультиагентную систему для обработки заданной темы.
+    
+    Все LLM-вызовы выполняются через ainvoke, поэтому множество запусков
+    могут ожидать ответа GigaChat одновременно в одном потоке.
+    
+    Args:
+        topic: Тема для обработки
+        runtime: Окружение с клиентами и кэшем графов; по умолчанию get_runtime()
+        graph_options: Параметры графа (max_revisions, parallel_sections, ...), см. create_agent_graph
+        run_id: Идентификатор запуска для чекпоинтов; по умолчанию генерируется
+        timeout: Ограничение времени запуска в секундах; по истечении вызовы LLM отменяются,
+            доработки пропускаются и возвращается лучший полученный контент с truncated=True
+        deadline: То же в виде абсолютного времени time.time(); учитывается более ранний из двух
+        keep_drafts: Хранить в состоянии все версии контента, чтобы messages результата содержали
+            их текст; False - хранятся только текущая и лучшая по оценке критика, а к концу
+            запуска - только финальная, промежуточные версии в messages остаются ссылками "[версия N]"
+        max_messages: Сколько последних сообщений хранить в messages; None - все, 0 - не вести журнал
+        
+    Returns:
+        Результат работы системы
+    """
+    runtime = runtime or get_runtime()
+    stored = _lookup_result(runtime, topic)
+    if stored is not None and stored.mode == REUSE_RESULT:
+        return _reused_result(topic, stored)
+    graph = runtime.get_graph(**graph_options)
+    run_id, config = _run_config(runtime, run_id)
+    state = _initial_state(topic, _resolve_deadline(timeout, deadline), keep_drafts, max_messages, stored)
+    result = await graph.ainvoke(state, config)
+    return _store_result(runtime, _build_result(result, run_id), stored)
+
+async def astream_multi_agent_system(topic: str, runtime: Optional[AgentRuntime] = None,
+                                     run_id: Optional[str] = None, timeout: Optional[float] = None,
+                                     deadline: Optional[float] = None, keep_drafts: bool = True,
+                                     max_messages: Optional[int] = None, **graph_options) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Запускает мультиагентную систему, отдавая прогресс по мере выполнения.
+    
+    Типы событий:
+        {"type": "node_start", "node": ...} - нода начала работу
+        {"type": "node_end", "node": ..., "error": ...} - нода завершила работу
+        {"type": "token", "node": "writer", "content": ...} - фрагмент текста писателя
+        {"type": "final", "result": ...} - результат, как у run_multi_agent_system
+    
+    Args:
+        topic: Тема для обработки
+        runtime: Окружение с клиентами и кэшем графов; по умолчанию get_runtime()
+        graph_options: Параметры графа (max_revisions, parallel_sections, ...), см. create_agent_graph
+        run_id: Идентификатор запуска для чекпоинтов; по умолчанию генерируется
+        timeout: Ограничение времени запуска в секундах; по истечении вызовы LLM отменяются,
+            доработки пропускаются и возвращается лучший полученный контент с truncated=True
+        deadline: То же в виде абсолютного времени time.time(); учитывается более ранний из двух
+        keep_drafts: Хранить в состоянии все версии контента, чтобы messages результата содержали
+            их текст; False - хранятся только текущая и лучшая по оценке критика, а к концу
+            запуска - только финальная, промежуточные версии в messages остаются ссылками "[версия N]"
+        max_messages: Сколько последних сообщений хранить в messages; None - все, 0 - не вести журнал
+    """
+    runtime = runtime or get_runtime()
+    stored = _lookup_result(runtime, topic)
+    if stored is not None and stored.mode == REUSE_RESULT:
+        yield {"type": "final", "result": _reused_result(topic, stored)}
+        return
+    graph = runtime.get_graph(**graph_options)
+    run_id, config = _run_config(runtime, run_id)
+    final_state = None
+    state = _initial_state(topic, _resolve_deadline(timeout, deadline), keep_drafts, max_messages, stored)
+    async for mode, payload in graph.astream(state, config, stream_mode=["tasks", "custom", "values"]):
+        if mode == "custom":
+            yield payload
+        elif mode == "tasks":
+            if "input" in payload:
+                yield {"type": "node_start", "node": payload["name"]}
+            else:
+                yield {"type": "node_end", "node": payload["name"], "error": payload.get("error")}
+        else:
+            final_state = payload
+    yield {"type": "final", "result": _store_result(runtime, _build_result(final_state, run_id), stored)}
+
+def _require_checkpointer(runtime: AgentRuntime) -> None:
+    if runtime.checkpointer is None:
+        raise ValueError("Для возобновления запусков окружению нужен checkpointer")
+
+def _resume_update(snapshot, timeout: Optional[float]) -> Optional[Dict[str, Any]]:
+    """Новый дедлайн продолжаемого запуска; None - состояние менять не нужно"""
+    deadline = _resolve_deadline(timeout, None)
+    if deadline == snapshot.values.get("deadline"):
+        return None
+    return {"deadline": deadline}
+
+def resume_run(run_id: str, runtime: Optional[AgentRuntime] = None, timeout: Optional[float] = None,
+               **graph_options) -> Dict[str, Any]:
+    """
+    Продолжает прерванный запуск с последней успешно завершенной ноды.
+    
+    Уже полученные ответы аналитика, писателя и критика берутся из чекпоинта
+    и повторно не запрашиваются. Для завершенного запуска возвращает его результат.
+    Дедлайн исходного запуска не переносится: после сбоя или перезапуска он обычно
+    уже истек, и все оставшиеся ноды были бы пропущены.
+    
+    Args:
+        run_id: Идентификатор запуска
+        runtime: Окружение с чекпоинтером; по умолчанию get_runtime()
+        timeout: Ограничение времени продолжения в секундах, отсчитывается от вызова;
+            None - без дедлайна
+        graph_options: Параметры графа (max_revisions, parallel_sections, ...), см. create_agent_graph
+        
+    Returns:
+        Результат работы системы
+    """
+    runtime = runtime or get_runtime()
+    _require_checkpointer(runtime)
+    graph = runtime.get_graph(**graph_options)
+    config = {"configurable": {"thread_id": run_id}}
+    snapshot = graph.get_state(config)
+    if not snapshot.values:
+        raise KeyError(f"Запуск {run_id} не найден")
+    if not snapshot.next:
+        return _build_result(snapshot.values, run_id)
+    update = _resume_update(snapshot, timeout)
+    if update is not None:
+        config = graph.update_state(config, update)
+    return _build_result(graph.invoke(None, config), run_id)
+
+async def aresume_run(run_id: str, runtime: Optional[AgentRuntime] = None, timeout: Optional[float] = None,
+                      **graph_options) -> Dict[str, Any]:
+    """Асинхронный вариант resume_run"""
+    runtime = runtime or get_runtime()
+    _require_checkpointer(runtime)
+    graph = runtime.get_graph(**graph_options)
+    config = {"configurable": {"thread_id": run_id}}
+    snapshot = await graph.aget_state(config)
+    if not snapshot.values:
+        raise KeyError(f"Запуск {run_id} не найден")
+    if not snapshot.next:
+        return _build_result(snapshot.values, run_id)
+    update = _resume_update(snapshot, timeout)
+    if update is not None:
+        config = await graph.aupdate_state(config, update)
+    return _build_result(await graph.ainvoke(None, config), run_id)
+
+def list_incomplete_runs(runtime: Optional[AgentRuntime] = None, **graph_options) -> List[Dict[str, Any]]:
+    """
+    Возвращает незавершенные запуски из чекпоинтера.
+    
+    Returns:
+        Список словарей с полями run_id, topic, next (ноды, с которых продолжится запуск)
+        и updated_at (время последнего чекпоинта)
+    """
+    runtime = runtime or get_runtime()
+    _require_checkpointer(runtime)
+    graph = runtime.get_graph(**graph_options)
+    runs = []
+    for run_id in list_thread_ids(runtime.checkpointer):
+        snapshot = graph.get_state({"configurable": {"thread_id": run_id}})
+        if snapshot.next:
+            runs.append({
+                "run_id": run_id,
+                "topic": snapshot.values.get("topic", ""),
+                "next": list(snapshot.next),
+                "updated_at": snapshot.created_at
+            })
+    return sorted(runs, key=lambda run: run["updated_at"] or "")
+
+async def run_batch(topics: Iterable[str], max_concurrency: int = 10, runtime: Optional[AgentRuntime] = None,
+                    timeout: Optional[float] = None, **graph_options) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Обрабатывает набор тем с ограничением числа одновременных запусков.
+    
+    Темы читаются из итератора по мере освобождения слотов, поэтому
+    в памяти одновременно находится не более max_concurrency запусков.
+    Результаты отдаются в порядке завершения.
+    
+    Args:
+        topics: Итерируемый набор тем
+        max_concurrency: Максимальное число одновременно выполняемых запусков
+        runtime: Окружение с клиентами и кэшем графов; по умолчанию get_runtime()
+        timeout: Ограничение времени каждого запуска в секундах, отсчитывается от его старта
+        graph_options: Параметры графа (max_revisions, parallel_sections, ...), см. create_agent_graph,
+            а также keep_drafts и max_messages, см. arun_multi_agent_system
+        
+    Yields:
+        Пары (индекс темы во входном наборе, результат). Если запуск упал,
+        результат содержит тему и текст ошибки в поле "error".
+    """
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency должен быть не меньше 1")
+    
+    runtime = runtime or get_runtime()
+    
+    async def run_one(index: int, topic: str) -> Tuple[int, Dict[str, Any]]:
+        try:
+            return index, await arun_multi_agent_system(topic, runtime=runtime, timeout=timeout, **graph_options)
+        except Exception as e:
+            logger.warning("Ошибка обработки темы #%s: %s", index, e)
+            return index, {"topic": topic, "error": str(e)}
+    
+    pending = set()
+    topic_iter = enumerate(topics)
+    try:
+        while True:
+            # Дозаполняем пул запусков из входного итератора
+            for index, topic in topic_iter:
+                pending.add(asyncio.ensure_future(run_one(index, topic)))
+                if len(pending) >= max_concurrency:
+                    break
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        # Отменяем незавершенные запуски, если потребитель прервал итерацию
+        for task in pending:
+            task.cancel()
+
+class _JsonFormatter(logging.Formatter):
+    """Форматирует записи лога как JSON-строки для сборщиков логов"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+def configure_logging(level: str = "INFO", json_format: bool = False) -> None:
+    """
+    Настраивает логирование системы.
+    
+    Args:
+        level: Уровень логов (DEBUG - подробный ход работы агентов)
+        json_format: Писать записи в формате JSON
+    """
+    handler = logging.StreamHandler()
+    if json_format:
+        handler.setFormatter(_JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logger.handlers[:] = [handler]
+    logger.setLevel(level.upper())
+    logger.propagate = False
+
+def print_result(result: Dict[str, Any]) -> None:
+    """Печатает результат работы системы"""
+    print("\n📊 АНАЛИЗ:")
+    print(result["analysis"])
+    print("\n" + "="*50)
+    
+    print("\n✍️ КОНТЕНТ:")
+    print(result["content"])
+    print("\n" + "="*50)
+    
+    print("\n🔍 КРИТИКА:")
+    print(result["feedback"])
+    print("\n" + "="*50)
+    
+    print("\n🎯 ФИНАЛЬНЫЙ РЕЗУЛЬТАТ:")
+    print(result["content"])
+    if result.get("truncated"):
+        print("\n⏰ Запуск прерван по времени: показан лучший полученный вариант")
+    print("\n" + "="*50)
+    
+    # Показываем информацию об использованных инструментах
+    if result.get("tools_used"):
+        print("\n🔧 ИСПОЛЬЗОВАННЫЕ ИНСТРУМЕНТЫ:")
+        for tool_name in result["tools_used"]:
+            print(f"   - {tool_name}")
+        
+        print("\n📊 РЕЗУЛЬТАТЫ РАБОТЫ ИНСТРУМЕНТОВ:")
+        for tool_name, tool_result in result.get("tool_results", {}).items():
+            print(f"   {tool_name}: {tool_result}")
+    
+    print("\n" + "="*50)
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Точка входа командной строки"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Мультиагентная система на LangGraph и GigaChat")
+    parser.add_argument("--log-level", default=os.getenv("LOG_LEVEL", "INFO"), help="Уровень логов (DEBUG, INFO, WARNING)")
+    parser.add_argument("--log-json", action="store_true", help="Писать логи в формате JSON")
+    parser.add_argument("--metrics-port", type=int, help="Порт HTTP-эндпоинта /metrics для Prometheus")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="Адрес HTTP-эндпоинта /metrics")
+    parser.add_argument("--result-db", help="SQLite-файл результатов по темам: похожие темы не обрабатываются заново")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    run_parser = subparsers.add_parser("run", help="Обработать тему")
     # Пример темы для обработки
-    test_topic = "Искусственный интеллект в современном образовании"
+    run_parser.add_argument("topic", nargs="?", default="Искусственный интеллект в современном образовании")
+    run_parser.add_argument("--run-id", help="Идентификатор запуска для чекпоинтов")
+    run_parser.add_argument("--checkpoint-db", help="SQLite-файл чекпоинтов; без него запуск не сохраняется")
+    run_parser.add_argument("--timeout", type=float, help="Ограничение времени запуска в секундах")
+    
+    runs_parser = subparsers.add_parser("runs", help="Показать незавершенные запуски")
+    runs_parser.add_argument("--checkpoint-db", default="checkpoints.sqlite")
+    
+    resume_parser = subparsers.add_parser("resume", help="Продолжить незавершенный запуск")
+    resume_parser.add_argument("run_id")
+    resume_parser.add_argument("--checkpoint-db", default="checkpoints.sqlite")
+    resume_parser.add_argument("--timeout", type=float, help="Ограничение времени продолжения в секундах")
+    
+    batch_parser = subparsers.add_parser("batch", help="Обработать темы из JSONL/CSV с записью результатов в JSONL")
+    batch_parser.add_argument("input", help="JSONL или CSV с темами")
+    batch_parser.add_argument("-o", "--output", required=True, help="JSONL с результатами; дописывается по мере завершения")
+    batch_parser.add_argument("--workers", type=int, default=10, help="Число одновременно выполняемых запусков")
+    batch_parser.add_argument("--timeout", type=float, help="Ограничение времени каждого запуска в секундах")
+    batch_parser.add_argument("--topic-field", default="topic", help="Поле (колонка) с темой")
+    batch_parser.add_argument("--id-field", default="id", help="Поле (колонка) с идентификатором записи")
+    batch_parser.add_argument("--no-resume", action="store_true", help="Перезаписать выходной файл вместо продолжения")
+    batch_parser.add_argument("--processes", type=int, default=1,
+                              help="Число рабочих процессов; лимиты GIGACHAT_* делятся между ними")
+    batch_parser.add_argument("--cache-db", help="SQLite-файл кэша ответов LLM, общий для всех процессов")
+    batch_parser.add_argument("--checkpoint-db", help="SQLite-файл чекпоинтов; без него запуски не сохраняются")
+    
+    serve_parser = subparsers.add_parser("serve", help="Запустить HTTP-сервис с очередью заданий")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--workers", type=int, default=4, help="Число одновременно выполняемых запусков")
+    serve_parser.add_argument("--max-queue", type=int, default=100, help="Размер очереди; при заполнении ответ 429")
+    serve_parser.add_argument("--drain-timeout", type=float, default=300.0,
+                              help="Сколько секунд при остановке ждать принятые задания")
+    serve_parser.add_argument("--checkpoint-db", help="SQLite-файл чекпоинтов; без него запуски не сохраняются")
+    
+    args = parser.parse_args(argv)
+    if args.command is None:
+        args = parser.parse_args(list(sys.argv[1:] if argv is None else argv) + ["run"])
+    configure_logging(args.log_level, args.log_json)
+    if args.metrics_port:
+        from metrics import start_metrics_server
+        start_metrics_server(args.metrics_port, host=args.metrics_host)
     
-    print("🚀 Запуск мультиагентной системы...")
-    print(f"📝 Тема: {test_topic}")
+    # Загружаем переменные окружения
+    checkpointer = None
+    if args.checkpoint_db:
+        from checkpoints import create_checkpointer
+        checkpointer = create_checkpointer(args.checkpoint_db)
+    cache = None
+    if getattr(args, "cache_db", None):
+        from llm_cache import SQLiteCache
+        cache = SQLiteCache(args.cache_db)
+    result_store = ResultStore(args.result_db) if args.result_db else None
+    runtime = AgentRuntime(cache=cache, checkpointer=checkpointer, result_store=result_store)
+    runtime.load_env()
+    
+    if args.command == "batch":
+        from functools import partial
+        from batch import process_file
+        from sharding import worker_runtime
+        print(f"📦 Пакет: {args.input} → {args.output} (процессов {args.processes}, обработчиков {args.workers})")
+        summary = asyncio.run(process_file(
+            args.input, args.output, workers=args.workers, runtime=runtime, timeout=args.timeout,
+            resume=not args.no_resume, topic_field=args.topic_field, id_field=args.id_field,
+            processes=args.processes,
+            runtime_factory=partial(worker_runtime, runtime.env_file, args.cache_db, args.processes, args.result_db,
+                                    args.checkpoint_db)
+        ))
+        runtime.flush_traces()
+        print(f"✅ Обработано {summary['processed']} тем за {summary['elapsed']:.0f} с, "
+              f"ошибок {summary['errors']}, пропущено готовых {summary['skipped']}")
+        return
+    
+    if args.command == "serve":
+        from server import serve
+        print(f"🌐 Сервис: http://{args.host}:{args.port} (обработчиков {args.workers}, очередь {args.max_queue})")
+        serve(args.host, args.port, runtime=runtime, workers=args.workers,
+              max_queue=args.max_queue, drain_timeout=args.drain_timeout)
+        return
+    
+    if args.command == "runs":
+        runs = list_incomplete_runs(runtime)
+        if not runs:
+            print("✅ Незавершенных запусков нет")
+        for run in runs:
+            print(f"{run['run_id']}  {run['updated_at']}  → {', '.join(run['next'])}  {run['topic']}")
+        return
+    
+    if args.command == "run":
+        print("🚀 Запуск мультиагентной системы...")
+        print(f"📝 Тема: {args.topic}")
+    else:
+        print(f"🔁 Продолжение запуска {args.run_id}...")
     print("-" * 50)
     
     # Проверяем настройки Langfuse
@@ -491,43 +2286,30 @@ if __name__ == "__main__":
     print("-" * 50)
     
     try:
-        # Используем Langfuse только для мониторинга, не для трассировки графа
-        result = run_multi_agent_system(test_topic)
-        
-        print("\n📊 АНАЛИЗ:")
-        print(result["analysis"])
-        print("\n" + "="*50)
-        
-        print("\n✍️ КОНТЕНТ:")
-        print(result["content"])
-        print("\n" + "="*50)
-        
-        print("\n🔍 КРИТИКА:")
-        print(result["feedback"])
-        print("\n" + "="*50)
-        
-        print("\n🎯 ФИНАЛЬНЫЙ РЕЗУЛЬТАТ:")
-        print(result["content"])
-        print("\n" + "="*50)
-        
-        # Показываем информацию об использованных инструментах
-        if result.get("tools_used"):
-            print("\n🔧 ИСПОЛЬЗОВАННЫЕ ИНСТРУМЕНТЫ:")
-            for tool_name in result["tools_used"]:
-                print(f"   - {tool_name}")
-            
-            print("\n📊 РЕЗУЛЬТАТЫ РАБОТЫ ИНСТРУМЕНТОВ:")
-            for tool_name, tool_result in result.get("tool_results", {}).items():
-                print(f"   {tool_name}: {tool_result}")
+        if args.command == "run":
+            if checkpointer is not None:
+                args.run_id = args.run_id or uuid.uuid4().hex
+                print(f"🆔 Запуск: {args.run_id}")
+            result = run_multi_agent_system(args.topic, runtime=runtime, run_id=args.run_id, timeout=args.timeout)
+        else:
+            result = resume_run(args.run_id, runtime=runtime, timeout=args.timeout)
         
-        print("\n" + "="*50)
+        print_result(result)
         print("\n✅ Мультиагентная система завершила работу!")
         
         if langfuse_enabled:
-            print("\n📈 Трассировка сохранена в Langfuse")
+            print("\n📈 Трассировка отправлена в Langfuse (с учетом LANGFUSE_SAMPLE_RATE)")
             print("🔗 Проверьте дашборд для детального анализа")
         
     except Exception as e:
         print(f"❌ Ошибка: {e}")
+        if checkpointer is not None and args.run_id:
+            print(f"💡 Продолжить запуск: python agents.py resume {args.run_id} --checkpoint-db {args.checkpoint_db}")
         if langfuse_enabled:
             print("💡 Проверьте настройки Langfuse в config.env")
+    finally:
+        runtime.flush_traces()
+
+# Пример использования
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import os
+import csv
+import sys
+import json
+import time
+import logging
+from typing import Any, Callable, Dict, Iterator, Optional, Set, TextIO, Tuple
+import agents
+from agents import AgentRuntime
+from sharding import run_sharded
+
+logger = logging.getLogger("agents.batch")
+
+
+def read_topics(path: str, topic_field: str = "topic", id_field: str = "id") -> Iterator[Tuple[str, str]]:
+    """
+    Читает темы из JSONL или CSV построчно, не загружая файл целиком.
+
+    В JSONL строка - объект с полем темы или просто JSON-строка; в CSV темы берутся из колонки
+    topic_field. Если у записи нет поля id_field, идентификатором служит номер строки в файле:
+    он не сдвигается, когда соседние строки пропущены, поэтому продолжение пакета находит те же
+    записи. Записи с уже встречавшимся идентификатором пропускаются с предупреждением.
+
+    Yields:
+        Пары (идентификатор, тема)
+    """
+    return _iter_topics(path, topic_field, id_field, warn=True)
+
+def _iter_topics(path: str, topic_field: str, id_field: str, warn: bool) -> Iterator[Tuple[str, str]]:
+    seen: Set[str] = set()
+    with open(path, encoding="utf-8", newline="") as f:
+        for line, record in _records(f, path, warn):
+            if isinstance(record, str):
+                item_id, topic = str(line), record
+            else:
+                topic = record.get(topic_field) if isinstance(record, dict) else None
+                if not topic:
+                    if warn:
+                        logger.warning("Запись в строке %s без темы (%s) пропущена", line, topic_field)
+                    continue
+                item_id = str(record.get(id_field) or line)
+            if item_id in seen:
+                if warn:
+                    logger.warning("Запись в строке %s повторяет id %s и пропущена", line, item_id)
+                continue
+            seen.add(item_id)
+            yield item_id, topic
+
+def _records(f, path: str, warn: bool) -> Iterator[Tuple[int, Any]]:
+    """Записи файла с номером строки, на которой запись заканчивается"""
+    if path.lower().endswith(".csv"):
+        reader = csv.DictReader(f)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as e:
+            if warn:
+                logger.warning("Строка %s не разобрана как JSON и пропущена: %s", number, e)
+
+def count_topics(path: str, topic_field: str = "topic", id_field: str = "id") -> int:
+    """
+    Количество записей, которые будут обработаны, для оценки оставшегося времени.
+
+    Считается так же, как читает read_topics: пустые, неразобранные, без темы и повторные
+    записи не учитываются. Файл читается построчно.
+    """
+    return sum(1 for _ in _iter_topics(path, topic_field, id_field, warn=False))
+
+def completed_ids(path: str) -> Set[str]:
+    """
+    Идентификаторы записей, уже успешно обработанных в выходном файле.
+
+    Оборванная при аварийной остановке последняя строка отрезается, чтобы дозапись
+    продолжилась с целой строки. Записи с ошибкой не считаются завершенными.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    valid_size = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            valid_size += len(line)
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if not record.get("error"):
+                done.add(str(record.get("id")))
+    if valid_size < os.path.getsize(path):
+        logger.warning("Отрезана оборванная последняя строка %s", path)
+        with open(path, "r+b") as f:
+            f.truncate(valid_size)
+    return done
+
+
+class Progress:
+    """Живая строка прогресса: обработано, скорость и оставшееся время"""
+
+    def __init__(self, total: Optional[int] = None, stream: TextIO = sys.stderr, interval: float = 1.0):
+        self.total = total
+        self.stream = stream
+        self.interval = interval
+        self.done = 0
+        self.errors = 0
+        self.started = time.time()
+        self._printed = 0.0
+
+    def update(self, error: bool = False) -> None:
+        self.done += 1
+        self.errors += error
+        if time.time() - self._printed >= self.interval:
+            self.print()
+
+    def print(self, end: str = "") -> None:
+        self._printed = time.time()
+        elapsed = self._printed - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        line = f"\r✅ {self.done}" + (f"/{self.total}" if self.total is not None else "")
+        line += f" | {rate:.2f} тем/с | ошибок {self.errors}"
+        if self.total is not None and rate > 0:
+            remaining = max(0, self.total - self.done) / rate
+            line += f" | осталось ~{int(remaining // 3600)}ч {int(remaining % 3600 // 60):02d}м {int(remaining % 60):02d}с"
+        self.stream.write(line + end)
+        self.stream.flush()
+
+
+async def process_file(input_path: str, output_path: str, workers: int = 10, runtime: Optional[AgentRuntime] = None,
+                       timeout: Optional[float] = None, resume: bool = True, topic_field: str = "topic",
+                       id_field: str = "id", progress: bool = True, processes: int = 1,
+                       runtime_factory: Optional[Callable[[], AgentRuntime]] = None, **graph_options) -> Dict[str, Any]:
+    """
+    Обрабатывает темы из файла и дописывает результаты в JSONL по мере завершения.
+
+    Входной файл читается потоково, в памяти одновременно не более workers запусков на процесс,
+    а каждая строка результата записывается и сбрасывается на диск сразу. При resume
+    записи, уже успешно обработанные в output_path, пропускаются - прерванный пакет
+    продолжается с места остановки; повторная запись по тому же id заменяет прежнюю.
+
+    Args:
+        input_path: JSONL или CSV с темами, см. read_topics
+        output_path: JSONL с результатами: {"id": ..., **результат}, у ошибок - поле "error"
+        workers: Число одновременно выполняемых запусков (в каждом процессе при processes > 1)
+        runtime: Окружение с клиентами и кэшем графов; по умолчанию get_runtime() (при processes > 1
+            не используется: у каждого процесса свое окружение, см. runtime_factory)
+        timeout: Ограничение времени каждого запуска в секундах
+        resume: Пропускать записи, уже обработанные в output_path; иначе файл перезаписывается
+        topic_field: Поле (колонка) с темой
+        id_field: Поле (колонка) с идентификатором записи
+        progress: Печатать прогресс в stderr
+        processes: Число рабочих процессов; больше 1 - темы распределяются между процессами, см. sharding.run_sharded
+        runtime_factory: Окружение рабочего процесса, см. sharding.run_sharded
+        graph_options: Параметры графа и запуска, см. run_batch
+
+    Returns:
+        Сводка: processed, errors, skipped, elapsed
+    """
+    done = completed_ids(output_path) if resume else set()
+    total = max(0, count_topics(input_path, topic_field, id_field) - len(done)) if progress else None
+    tracker = Progress(total) if progress else None
+    # Идентификаторы выполняемых запусков по индексу в run_batch: не больше workers записей
+    running: Dict[int, str] = {}
+    skipped = 0
+
+    def topics() -> Iterator[str]:
+        nonlocal skipped
+        index = 0
+        for item_id, topic in read_topics(input_path, topic_field, id_field):
+            if item_id in done:
+                skipped += 1
+                continue
+            running[index] = item_id
+            index += 1
+            yield topic
+
+    if processes > 1:
+        results = run_sharded(topics(), processes=processes, concurrency=workers, runtime_factory=runtime_factory,
+                              timeout=timeout, **graph_options)
+    else:
+        results = agents.run_batch(topics(), max_concurrency=workers, runtime=runtime, timeout=timeout, **graph_options)
+    processed = errors = 0
+    started = time.time()
+    with open(output_path, "a" if resume else "w", encoding="utf-8") as out:
+        async for index, result in results:
+            record = {"id": running.pop(index), **agents.jsonable_result(result)}
+            # Одна запись - одна строка: при аварийной остановке теряется не больше текущей строки
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            processed += 1
+            errors += "error" in result
+            if tracker is not None:
+                tracker.update(error="error" in result)
+    if tracker is not None:
+        tracker.print(end="\n")
+    summary = {"processed": processed, "errors": errors, "skipped": skipped, "elapsed": time.time() - started}
+    logger.info("Пакет обработан: %s тем, ошибок %s, пропущено готовых %s", processed, errors, skipped)
+    return summary
@@ -0,0 +1,8 @@
+"""Офлайн-бенчмарки мультиагентной системы на детерминированной замене GigaChat: python -m benchmarks"""
+from benchmarks.fake_llm import FakeGigaChat, FakeLLMError
+from benchmarks.runner import bench_latency, bench_memory, bench_nodes, bench_throughput, compare, percentile, summarize
+
+__all__ = [
+    "FakeGigaChat", "FakeLLMError",
+    "bench_latency", "bench_memory", "bench_nodes", "bench_throughput", "compare", "percentile", "summarize",
+]
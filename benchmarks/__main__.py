@@ -0,0 +1,111 @@
+import sys
+import json
+import argparse
+import agents
+from benchmarks.fake_llm import FakeGigaChat
+from benchmarks.runner import bench_latency, bench_memory, bench_nodes, bench_throughput, compare
+
+
+def _floats(value: str):
+    return [float(item) for item in value.split(",") if item]
+
+def _ints(value: str):
+    return [int(item) for item in value.split(",") if item]
+
+def print_report(report):
+    """Выводит отчет бенчмарка в консоль"""
+    if "latency" in report:
+        data = report["latency"]
+        print(f"⏱️  Задержка ({data['mode']}, {data['count']} запусков): "
+              f"p50={data['p50']:.3f}s p95={data['p95']:.3f}s p99={data['p99']:.3f}s max={data['max']:.3f}s")
+        print(f"🔄 Доработок за запуск: в среднем {data['revisions_mean']:.2f}, максимум {data['revisions_max']}; "
+              f"токенов в среднем {data['tokens_mean']:.0f}; ошибок {data['errors']}")
+    if "throughput" in report:
+        print("🚀 Пропускная способность run_batch:")
+        for level, data in report["throughput"]["levels"].items():
+            print(f"   concurrency={level:<4} {data['runs_per_sec']:8.2f} запусков/с  "
+                  f"средняя задержка {data['latency_mean']:.3f}s  ошибок {data['errors']}")
+    if "nodes" in report:
+        print("🧩 Ноды (среднее за вызов):")
+        for node, data in report["nodes"]["nodes"].items():
+            print(f"   {node:<15} {data['calls']:>5} вызовов  всего {data['mean'] * 1000:8.2f} мс  "
+                  f"LLM {data['llm_mean'] * 1000:8.2f} мс  накладные {data['overhead_mean'] * 1000:7.2f} мс")
+    if "memory" in report:
+        data = report["memory"]
+        print(f"💾 Память на запуск: {data['peak_kb_per_run']:.0f} КБ в среднем, максимум {data['peak_kb_max']:.0f} КБ")
+
+def main(argv=None) -> int:
+    """Офлайн-бенчмарк мультиагентной системы на фейковой модели"""
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Офлайн-бенчмарк мультиагентной системы")
+    parser.add_argument("--scenarios", default="latency,throughput,nodes,memory",
+                        help="Сценарии через запятую: latency, throughput, nodes, memory")
+    parser.add_argument("--runs", type=int, default=20, help="Запусков в каждом сценарии")
+    parser.add_argument("--concurrency", type=_ints, default=[1, 4, 16], help="Уровни параллелизма для throughput")
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync", help="API для сценария latency")
+    parser.add_argument("--latency", type=float, default=0.02, help="Медианная задержка модели, секунды")
+    parser.add_argument("--latency-sigma", type=float, default=0.0, help="Разброс лог-нормальной задержки")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="Скорость генерации; 0 - мгновенно")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Доля вызовов модели со сбоем")
+    parser.add_argument("--critic-scores", type=_floats, default=[6.0, 8.5], help="Оценки критика по кругам")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-revisions", type=int, default=3)
+    parser.add_argument("--parallel-sections", action="store_true")
+    parser.add_argument("--pipelined", action="store_true", help="Конвейерный режим аналитик → писатели разделов")
+    parser.add_argument("--revision-mode", choices=["full", "segments"], default="full")
+    parser.add_argument("--drafts", type=int, default=1, help="Вариантов контента за круг (speculative_drafts)")
+    parser.add_argument("--accept-score", type=float, default=8.0, help="Оценка, с которой контент принимается")
+    parser.add_argument("--json", dest="json_path", help="Сохранить отчет в JSON-файл")
+    parser.add_argument("--baseline", help="JSON-отчет для сравнения; при регрессии код выхода 1")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Допустимое ухудшение относительно baseline")
+    args = parser.parse_args(argv)
+
+    # Внедренные сбои ожидаемы, предупреждения агентов не выводим
+    agents.configure_logging("ERROR")
+    llm = FakeGigaChat(
+        latency=args.latency,
+        latency_sigma=args.latency_sigma,
+        tokens_per_second=args.tokens_per_second,
+        failure_rate=args.failure_rate,
+        critic_scores=args.critic_scores,
+        accept_score=args.accept_score,
+        seed=args.seed,
+    )
+    graph_options = {
+        "max_revisions": args.max_revisions,
+        "parallel_sections": args.parallel_sections,
+        "pipelined": args.pipelined,
+        "revision_mode": args.revision_mode,
+        "speculative_drafts": args.drafts,
+        "revision_policy": agents.RevisionPolicy(max_revisions=args.max_revisions, score_threshold=args.accept_score),
+    }
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    report = {"config": {**vars(args), "scenarios": scenarios}}
+    for name in scenarios:
+        if name == "latency":
+            report[name] = bench_latency(llm, args.runs, args.mode, **graph_options)
+        elif name == "throughput":
+            report[name] = bench_throughput(llm, args.runs, args.concurrency, **graph_options)
+        elif name == "nodes":
+            report[name] = bench_nodes(llm, args.runs, **graph_options)
+        elif name == "memory":
+            report[name] = bench_memory(llm, args.runs, **graph_options)
+        else:
+            parser.error(f"Неизвестный сценарий: {name}")
+    print_report(report)
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        if regressions:
+            print("❌ Регрессии относительно baseline:")
+            for line in regressions:
+                print(f"   {line}")
+            return 1
+        print("✅ Регрессий относительно baseline нет")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+import re
+import json
+import time
+import math
+import random
+import asyncio
+import hashlib
+import threading
+from typing import Dict, List, Any, Iterator, AsyncIterator
+from pydantic import Field, PrivateAttr
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Метка редакции в тексте писателя: по ней критик понимает, какой это круг доработки
+REVISION_MARK_RE = re.compile(r"\[ред\. (\d+)\]")
+SEGMENT_ID_RE = re.compile(r"\[(P\d+)\]")
+DRAFT_RE = re.compile(r"^ВАРИАНТ \d+:", re.MULTILINE)
+
+# Длина ответа в токенах по умолчанию для каждой роли
+DEFAULT_RESPONSE_TOKENS = {
+    "analyst": 300,
+    "writer": 800,
+    "section_writer": 250,
+    "segment_writer": 120,
+    "critic": 150,
+}
+
+FILLER_WORDS = (
+    "система", "данные", "модель", "обучение", "результат", "подход", "анализ", "задача",
+    "студенты", "технологии", "процесс", "качество", "пример", "развитие", "хорошо", "метод",
+)
+
+
+class FakeLLMError(RuntimeError):
+    """Сбой, внедренный фейковой моделью"""
+
+
+class FakeGigaChat(BaseChatModel):
+    """
+    Детерминированная замена GigaChat для офлайн-бенчмарков.
+
+    Роль вызова определяется по системному промпту агента, ответ строится так,
+    чтобы его разобрали ноды графа: план с разделами, текст из абзацев с меткой
+    редакции, вердикт критика по сценарию critic_scores. Задержки и сбои зависят
+    только от seed и текста промпта, поэтому не меняются от порядка запуска задач.
+    """
+
+    latency: float = 0.02  # Медиана задержки до первого токена, секунды
+    latency_sigma: float = 0.0  # Разброс лог-нормального распределения задержки; 0 - фиксированная
+    tokens_per_second: float = 0.0  # Скорость генерации; 0 - ответ генерируется мгновенно
+    failure_rate: float = 0.0  # Доля вызовов, завершающихся FakeLLMError
+    critic_scores: List[float] = Field(default_factory=lambda: [6.0, 8.5])  # Оценки критика по кругам
+    accept_score: float = 8.0  # С какой оценки критик пишет "ПРИНЯТЬ"
+    draft_spread: float = 2.0  # Разброс оценок вариантов сверх оценки круга (режим speculative_drafts)
+    sections: int = 4  # Количество разделов в плане аналитика
+    paragraphs: int = 5  # Количество абзацев в тексте писателя
+    response_tokens: Dict[str, int] = Field(default_factory=lambda: dict(DEFAULT_RESPONSE_TOKENS))
+    seed: int = 0
+    temperature: float = 0.0
+
+    _attempts: Dict[str, int] = PrivateAttr(default_factory=dict)
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gigachat"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"seed": self.seed, "temperature": self.temperature}
+
+    # --- сценарий ответа ---
+
+    @staticmethod
+    def role(messages: List[BaseMessage]) -> str:
+        """Роль агента по системному промпту"""
+        system = messages[0].content if messages else ""
+        if "строгий критик" in system:
+            return "critic"
+        if "аналитик" in system:
+            return "analyst"
+        if "один раздел" in system:
+            return "section_writer"
+        if "Перепиши один фрагмент" in system:
+            return "segment_writer"
+        return "writer"
+
+    def _rng(self, messages: List[BaseMessage]) -> random.Random:
+        """Генератор случайных чисел для вызова: зависит от seed, промпта и номера повтора"""
+        prompt = "\n".join(str(message.content) for message in messages)
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        with self._lock:
+            attempt = self._attempts.get(digest, 0)
+            self._attempts[digest] = attempt + 1
+        return random.Random(f"{self.seed}:{digest}:{attempt}")
+
+    def _filler(self, rng: random.Random, words: int) -> str:
+        sentences = []
+        while words > 0:
+            size = min(words, rng.randint(6, 14))
+            sentence = " ".join(rng.choice(FILLER_WORDS) for _ in range(size))
+            sentences.append(sentence.capitalize() + ".")
+            words -= size
+        return " ".join(sentences)
+
+    def _paragraphs(self, rng: random.Random, words: int, count: int, mark: int) -> str:
+        per_paragraph = max(1, words // max(1, count))
+        paragraphs = [self._filler(rng, per_paragraph) for _ in range(count)]
+        paragraphs[-1] += f" [ред. {mark}]"
+        return "\n\n".join(paragraphs)
+
+    def _content(self, role: str, messages: List[BaseMessage], rng: random.Random) -> str:
+        user = messages[-1].content if messages else ""
+        words = self.response_tokens.get(role, 100)
+        marks = [int(mark) for mark in REVISION_MARK_RE.findall(user)]
+        if role == "analyst":
+            plan = "\n".join(
+                f"РАЗДЕЛ: Раздел {index + 1} - {self._filler(rng, 6)}" for index in range(self.sections)
+            )
+            if "Начни ответ с разделов" in messages[0].content:
+                # Конвейерный режим: план идет до развернутого анализа
+                return f"{plan}\n\n{self._filler(rng, words)}"
+            return f"{self._filler(rng, words)}\n\n{plan}"
+        if role == "critic":
+            round_index = max(marks, default=0)
+            score = self.critic_scores[min(round_index, len(self.critic_scores) - 1)] if self.critic_scores else self.accept_score
+            if '"verdicts"' in messages[0].content:
+                return self._draft_verdicts(rng, user, score, words)
+            decision = "ПРИНЯТЬ" if score >= self.accept_score else "ДОРАБОТАТЬ"
+            lines = [self._filler(rng, words)]
+            segment_ids = SEGMENT_ID_RE.findall(user)
+            if decision == "ДОРАБОТАТЬ" and segment_ids:
+                lines.append(f"ЗАМЕЧАНИЕ [{segment_ids[0]}]: {self._filler(rng, 8)}")
+            criteria = {name: score for name in ("structure", "completeness", "clarity", "relevance")}
+            lines.append('{"score": %s, "criteria": %s, "decision": "%s"}' % (
+                score, str(criteria).replace("'", '"'), decision))
+            return "\n".join(lines)
+        if role == "segment_writer":
+            # Метка переписанного фрагмента - следующая после метки исходного
+            return f"{self._filler(rng, words)} [ред. {max(marks, default=0) + 1}]"
+        if role == "section_writer":
+            return self._filler(rng, words)
+        # Первая версия получает метку 0, каждая доработка - следующую
+        # (материал из параллельных разделов меток не содержит, его доработка - первая)
+        is_revision = '"decision"' in user
+        mark = max(marks, default=0) + 1 if is_revision else 0
+        return self._paragraphs(rng, words, self.paragraphs, mark)
+
+    def _draft_verdicts(self, rng: random.Random, user: str, score: float, words: int) -> str:
+        """Ответ критика о нескольких вариантах: каждый вариант получает оценку круга плюс случайную прибавку"""
+        count = len(DRAFT_RE.findall(user))
+        lines, verdicts = [], []
+        for number in range(1, count + 1):
+            draft_score = round(min(10.0, score + rng.uniform(0.0, self.draft_spread)), 1)
+            decision = "ПРИНЯТЬ" if draft_score >= self.accept_score else "ДОРАБОТАТЬ"
+            lines.append(f"ВАРИАНТ {number}: {self._filler(rng, max(1, words // count))}")
+            verdicts.append({"draft": number, "score": draft_score, "decision": decision})
+        lines.append(json.dumps({"verdicts": verdicts}, ensure_ascii=False))
+        return "\n".join(lines)
+
+    def _plan(self, messages: List[BaseMessage]):
+        """Текст ответа, задержка до первого токена и время генерации"""
+        rng = self._rng(messages)
+        if self.failure_rate and rng.random() < self.failure_rate:
+            return None, self._sample_latency(rng), 0.0
+        content = self._content(self.role(messages), messages, rng)
+        tokens = len(content.split())
+        duration = tokens / self.tokens_per_second if self.tokens_per_second else 0.0
+        return content, self._sample_latency(rng), duration
+
+    def _sample_latency(self, rng: random.Random) -> float:
+        if self.latency_sigma:
+            return self.latency * math.exp(rng.gauss(0.0, self.latency_sigma))
+        return self.latency
+
+    def _message(self, messages: List[BaseMessage], content: str) -> AIMessage:
+        input_tokens = sum(len(str(message.content).split()) for message in messages)
+        output_tokens = len(content.split())
+        return AIMessage(content=content, usage_metadata={
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        })
+
+    @staticmethod
+    def _chunks(content: str, size: int = 8) -> List[str]:
+        words = content.split(" ")
+        return [" ".join(words[i:i + size]) + (" " if i + size < len(words) else "") for i in range(0, len(words), size)]
+
+    # --- интерфейс BaseChatModel ---
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        content, latency, duration = self._plan(messages)
+        time.sleep(latency + duration)
+        if content is None:
+            raise FakeLLMError("Внедренный сбой модели")
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, content))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        content, latency, duration = self._plan(messages)
+        await asyncio.sleep(latency + duration)
+        if content is None:
+            raise FakeLLMError("Внедренный сбой модели")
+        return ChatResult(generations=[ChatGeneration(message=self._message(messages, content))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        content, latency, duration = self._plan(messages)
+        time.sleep(latency)
+        if content is None:
+            raise FakeLLMError("Внедренный сбой модели")
+        chunks = self._chunks(content)
+        for text in chunks:
+            time.sleep(duration / len(chunks))
+            if run_manager:
+                run_manager.on_llm_new_token(text)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._message(messages, content).usage_metadata))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        content, latency, duration = self._plan(messages)
+        await asyncio.sleep(latency)
+        if content is None:
+            raise FakeLLMError("Внедренный сбой модели")
+        chunks = self._chunks(content)
+        for text in chunks:
+            await asyncio.sleep(duration / len(chunks))
+            if run_manager:
+                await run_manager.on_llm_new_token(text)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=text))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._message(messages, content).usage_metadata))
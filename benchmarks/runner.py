@@ -0,0 +1,198 @@
+import time
+import asyncio
+import tracemalloc
+from typing import Dict, List, Any, Iterable, Optional
+import agents
+from metrics import MetricsRegistry
+from benchmarks.fake_llm import FakeGigaChat
+
+# Метрики, которые сравниваются с базовым прогоном: имя -> True, если больше - лучше
+REGRESSION_KEYS = {
+    "latency.p50": False,
+    "latency.p95": False,
+    "throughput.best_runs_per_sec": True,
+    "memory.peak_kb_per_run": False,
+}
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль q (0-100) с линейной интерполяцией"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """Среднее и перцентили ряда значений"""
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else 0.0,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values, default=0.0),
+    }
+
+def make_runtime(llm: FakeGigaChat, registry: Optional[MetricsRegistry] = None) -> agents.AgentRuntime:
+    """Окружение с фейковой моделью и отдельным реестром метрик, без Langfuse"""
+    return agents.AgentRuntime(llm=llm, metrics=registry or MetricsRegistry())
+
+def _topics(count: int) -> List[str]:
+    return [f"Тема бенчмарка {index}" for index in range(count)]
+
+def _revisions(result: Dict[str, Any]) -> int:
+    # Каждый круг критика добавляет оценку; доработок на одну меньше
+    return max(0, len(result.get("scores", [])) - 1)
+
+
+def bench_latency(llm: FakeGigaChat, runs: int, mode: str = "sync", **graph_options) -> Dict[str, Any]:
+    """
+    Последовательные запуски: задержка от начала до конца, доработки и токены.
+
+    Args:
+        llm: Фейковая модель
+        runs: Количество запусков
+        mode: "sync" - run_multi_agent_system, "async" - arun_multi_agent_system
+        graph_options: Параметры create_agent_graph
+    """
+    runtime = make_runtime(llm)
+    runtime.warmup(callbacks=[], **graph_options)
+    latencies, revisions, tokens, errors = [], [], [], 0
+
+    async def arun(topic: str):
+        return await agents.arun_multi_agent_system(topic, runtime=runtime, callbacks=[], **graph_options)
+
+    for topic in _topics(runs):
+        start = time.perf_counter()
+        try:
+            if mode == "async":
+                result = asyncio.run(arun(topic))
+            else:
+                result = agents.run_multi_agent_system(topic, runtime=runtime, callbacks=[], **graph_options)
+        except Exception:
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+        revisions.append(_revisions(result))
+        tokens.append(result.get("tokens_used", 0))
+    return {
+        "mode": mode,
+        **summarize(latencies),
+        "errors": errors,
+        "revisions_mean": sum(revisions) / len(revisions) if revisions else 0.0,
+        "revisions_max": max(revisions, default=0),
+        "tokens_mean": sum(tokens) / len(tokens) if tokens else 0.0,
+    }
+
+def bench_throughput(llm: FakeGigaChat, runs: int, concurrency_levels: Iterable[int], **graph_options) -> Dict[str, Any]:
+    """Пропускная способность run_batch при разном числе одновременных запусков"""
+    levels = {}
+    for level in concurrency_levels:
+        registry = MetricsRegistry()
+        runtime = make_runtime(llm, registry)
+        runtime.warmup(callbacks=[], **graph_options)
+
+        async def consume() -> int:
+            errors = 0
+            async for _, result in agents.run_batch(_topics(runs), max_concurrency=level, runtime=runtime,
+                                                    callbacks=[], **graph_options):
+                errors += "error" in result
+            return errors
+
+        start = time.perf_counter()
+        errors = asyncio.run(consume())
+        elapsed = time.perf_counter() - start
+        durations = registry.snapshot().get("agent_run_duration_seconds", {}).get("values", {})
+        series = durations.get((), {"sum": 0.0, "count": 0})
+        levels[level] = {
+            "elapsed": elapsed,
+            "runs_per_sec": runs / elapsed if elapsed else 0.0,
+            "latency_mean": series["sum"] / series["count"] if series["count"] else 0.0,
+            "errors": errors,
+        }
+    best = max((data["runs_per_sec"] for data in levels.values()), default=0.0)
+    return {"levels": levels, "best_runs_per_sec": best}
+
+def bench_nodes(llm: FakeGigaChat, runs: int, **graph_options) -> Dict[str, Any]:
+    """
+    Время нод и накладные расходы графа.
+
+    Накладные расходы ноды - ее длительность за вычетом времени, пока выполнялся хотя бы
+    один ее вызов LLM: форматирование промптов, разбор ответов, работа с состоянием.
+    Параллельные вызовы одной ноды считаются по реальному времени, а не суммой.
+    """
+    registry = MetricsRegistry()
+    runtime = make_runtime(llm, registry)
+    runtime.warmup(callbacks=[], **graph_options)
+    for topic in _topics(runs):
+        try:
+            agents.run_multi_agent_system(topic, runtime=runtime, callbacks=[], **graph_options)
+        except Exception:
+            pass
+    snapshot = registry.snapshot()
+
+    def totals(name: str) -> Dict[str, Dict[str, float]]:
+        values = snapshot.get(name, {}).get("values", {})
+        return {dict(key).get("node", ""): series for key, series in values.items()}
+
+    node_series = totals("agent_node_duration_seconds")
+    llm_series = totals("agent_node_llm_seconds")
+    nodes = {}
+    for node, series in sorted(node_series.items()):
+        llm_time = llm_series.get(node, {}).get("sum", 0.0)
+        nodes[node] = {
+            "calls": series["count"],
+            "mean": series["sum"] / series["count"] if series["count"] else 0.0,
+            "llm_mean": llm_time / series["count"] if series["count"] else 0.0,
+            "overhead_mean": (series["sum"] - llm_time) / series["count"] if series["count"] else 0.0,
+        }
+    return {"nodes": nodes}
+
+def bench_memory(llm: FakeGigaChat, runs: int, **graph_options) -> Dict[str, Any]:
+    """Пиковая память Python-объектов на один запуск (tracemalloc)"""
+    runtime = make_runtime(llm)
+    runtime.warmup(callbacks=[], **graph_options)
+    peaks = []
+    tracemalloc.start()
+    try:
+        for topic in _topics(runs):
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+            try:
+                agents.run_multi_agent_system(topic, runtime=runtime, callbacks=[], **graph_options)
+            except Exception:
+                continue
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append((peak - base) / 1024)
+    finally:
+        tracemalloc.stop()
+    return {"peak_kb_per_run": sum(peaks) / len(peaks) if peaks else 0.0, "peak_kb_max": max(peaks, default=0.0)}
+
+
+def _lookup(report: Dict[str, Any], path: str) -> Optional[float]:
+    value: Any = report
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.2) -> List[str]:
+    """
+    Сравнивает отчет с базовым.
+
+    Returns:
+        Описания метрик, ухудшившихся больше чем на tolerance (доля)
+    """
+    regressions = []
+    for path, higher_is_better in REGRESSION_KEYS.items():
+        current, previous = _lookup(report, path), _lookup(baseline, path)
+        if not current or not previous:
+            continue
+        change = (current - previous) / previous
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f"{path}: {previous:.4g} → {current:.4g} ({change:+.0%})")
+    return regressions
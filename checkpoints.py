@@ -0,0 +1,76 @@
+import asyncio
+import sqlite3
+from typing import List, Optional
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.checkpoint.memory import InMemorySaver
+
+
+def _sqlite_saver_class():
+    """Класс SQLite-чекпоинтера; пакет langgraph-checkpoint-sqlite импортируется только при необходимости"""
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    class SqliteCheckpointer(SqliteSaver):
+        """
+        SqliteSaver, который можно использовать и из graph.invoke, и из graph.ainvoke.
+
+        Async-методы выполняют синхронные операции в пуле потоков: соединение
+        открыто с check_same_thread=False и защищено блокировкой SqliteSaver.
+        """
+
+        async def aget_tuple(self, config):
+            return await asyncio.to_thread(self.get_tuple, config)
+
+        async def alist(self, config, *, filter=None, before=None, limit=None):
+            items = await asyncio.to_thread(
+                lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+            )
+            for item in items:
+                yield item
+
+        async def aput(self, config, checkpoint, metadata, new_versions):
+            return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+        async def aput_writes(self, config, writes, task_id, task_path=""):
+            return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+        async def adelete_thread(self, thread_id):
+            return await asyncio.to_thread(self.delete_thread, thread_id)
+
+    return SqliteCheckpointer
+
+
+def create_checkpointer(path: Optional[str] = None) -> BaseCheckpointSaver:
+    """
+    Создает чекпоинтер для сохранения прогресса запусков графа.
+
+    Args:
+        path: Путь к SQLite-файлу; None - хранение в памяти процесса
+
+    Returns:
+        Чекпоинтер LangGraph
+    """
+    if path is None:
+        return InMemorySaver()
+    # Файл может быть общим для нескольких процессов пакета: ждем освобождения блокировки записи
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30.0)
+    checkpointer = _sqlite_saver_class()(conn)
+    checkpointer.setup()
+    return checkpointer
+
+
+def list_thread_ids(checkpointer: BaseCheckpointSaver) -> List[str]:
+    """Возвращает идентификаторы всех запусков, сохраненных в чекпоинтере"""
+    if isinstance(checkpointer, InMemorySaver):
+        return list(checkpointer.storage.keys())
+    conn = getattr(checkpointer, "conn", None)
+    if isinstance(conn, sqlite3.Connection):
+        # Быстрый путь для SQLite: не читаем сами чекпоинты
+        with checkpointer.lock:
+            rows = conn.execute("SELECT DISTINCT thread_id FROM checkpoints").fetchall()
+        return [row[0] for row in rows]
+    thread_ids = []
+    for item in checkpointer.list(None):
+        thread_id = item.config["configurable"]["thread_id"]
+        if thread_id not in thread_ids:
+            thread_ids.append(thread_id)
+    return thread_ids
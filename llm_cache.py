@@ -0,0 +1,286 @@
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+# Режимы кэширования для отдельных нод
+CACHE_ALWAYS = "always"  # Кэшировать всегда
+CACHE_DETERMINISTIC = "deterministic"  # Кэшировать только при temperature == 0
+CACHE_NEVER = "never"  # Не кэшировать
+
+# Политика по умолчанию: анализ темы детерминирован по смыслу и повторяется чаще всего
+DEFAULT_CACHE_POLICY = {
+    "analyst": CACHE_ALWAYS,
+    "writer": CACHE_DETERMINISTIC,
+    "section_writer": CACHE_DETERMINISTIC,
+    "critic": CACHE_DETERMINISTIC,
+}
+
+
+class ResponseCache(ABC):
+    """
+    Базовый класс кэша ответов LLM со счетчиками попаданий по нодам.
+
+    Хранилище реализует get, set и clear; без них экземпляр не создается.
+    """
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._stats_lock = threading.Lock()
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        """Ответ по ключу; None - промах"""
+
+    @abstractmethod
+    def set(self, key: str, value: str) -> None:
+        """Сохраняет ответ по ключу"""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Удаляет все записи"""
+
+    def record(self, node: str, hit: bool) -> None:
+        """Учитывает попадание или промах для ноды"""
+        with self._stats_lock:
+            counters = self._stats.setdefault(node, {"hits": 0, "misses": 0})
+            counters["hits" if hit else "misses"] += 1
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Возвращает копию счетчиков попаданий и промахов по нодам"""
+        with self._stats_lock:
+            return {node: dict(counters) for node, counters in self._stats.items()}
+
+
+class LRUCache(ResponseCache):
+    """In-memory кэш с вытеснением давно не использованных записей"""
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None):
+        """
+        Args:
+            max_entries: Максимальное количество записей
+            ttl: Время жизни записи в секундах; None - без ограничения
+        """
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, created_at = item
+            if self.ttl is not None and time.time() - created_at > self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._data[key] = (value, time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteCache(ResponseCache):
+    """
+    Персистентный кэш в SQLite-файле с TTL и вытеснением по размеру.
+
+    Файл можно разделять между процессами: база открывается в режиме WAL.
+    """
+
+    def __init__(self, path: str = "llm_cache.sqlite", ttl: Optional[float] = None,
+                 max_entries: Optional[int] = None, max_bytes: Optional[int] = None):
+        """
+        Args:
+            path: Путь к файлу базы
+            ttl: Время жизни записи в секундах; None - без ограничения
+            max_entries: Максимальное количество записей
+            max_bytes: Максимальный суммарный размер значений в байтах
+        """
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30.0)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache(accessed_at)")
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl is not None and now - created_at > self.ttl:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now)
+            )
+            self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        """Удаляет просроченные записи и вытесняет самые старые при превышении лимитов"""
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+        if self.max_entries is not None:
+            count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+        if self.max_bytes is not None:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - self.max_bytes
+                freed = 0
+                stale = []
+                for key, size in self._conn.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at"):
+                    stale.append((key,))
+                    freed += size
+                    if freed >= excess:
+                        break
+                self._conn.executemany("DELETE FROM llm_cache WHERE key = ?", stale)
+
+    def clear(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM llm_cache")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _model_fingerprint(llm) -> str:
+    """Строка с параметрами модели, от которых зависит ответ"""
+    if hasattr(llm, "_get_llm_string"):
+        return llm._get_llm_string()
+    return repr(llm)
+
+def make_cache_key(llm, messages: List[Any]) -> str:
+    """Ключ кэша по параметрам модели и полностью отформатированному промпту"""
+    prompt = json.dumps([(m.type, m.content) for m in messages], ensure_ascii=False)
+    return hashlib.sha256(f"{_model_fingerprint(llm)}\n{prompt}".encode("utf-8")).hexdigest()
+
+def is_cacheable(llm, mode: str) -> bool:
+    """Проверяет, разрешает ли режим кэширования ответы данной модели"""
+    if mode == CACHE_ALWAYS:
+        return True
+    if mode == CACHE_DETERMINISTIC:
+        return getattr(llm, "temperature", None) == 0
+    return False
+
+
+class CachedLLM:
+    """Обертка над моделью, отдающая ответы из кэша для одной ноды графа"""
+
+    def __init__(self, llm, cache: ResponseCache, node: str):
+        self.llm = llm
+        self.cache = cache
+        self.node = node
+
+    def __getattr__(self, name: str):
+        # Параметры модели (temperature и т.д.) берем у исходного клиента
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def _lookup(self, messages: List[Any]):
+        key = make_cache_key(self.llm, messages)
+        value = self.cache.get(key)
+        self.cache.record(self.node, value is not None)
+        if value is None:
+            return key, None
+        return key, AIMessage(content=value, response_metadata={"cache_hit": True})
+
+    def invoke(self, messages: List[Any], **kwargs):
+        key, cached = self._lookup(messages)
+        if cached is not None:
+            return cached
+        response = self.llm.invoke(messages, **kwargs)
+        self.cache.set(key, response.content)
+        return response
+
+    async def ainvoke(self, messages: List[Any], **kwargs):
+        # Чтение и запись кэша (у SQLite - файл и блокировка) выполняются в потоке,
+        # чтобы не останавливать цикл событий с другими запусками
+        key, cached = await asyncio.to_thread(self._lookup, messages)
+        if cached is not None:
+            return cached
+        response = await self.llm.ainvoke(messages, **kwargs)
+        await asyncio.to_thread(self.cache.set, key, response.content)
+        return response
+
+    async def astream(self, messages: List[Any], **kwargs):
+        key, cached = await asyncio.to_thread(self._lookup, messages)
+        if cached is not None:
+            # Ответ из кэша отдаем одним фрагментом
+            yield AIMessageChunk(content=cached.content, response_metadata=cached.response_metadata)
+            return
+        content = []
+        async for chunk in self.llm.astream(messages, **kwargs):
+            content.append(chunk.content)
+            yield chunk
+        await asyncio.to_thread(self.cache.set, key, "".join(content))
+
+
+def with_cache(llm, cache: Optional[ResponseCache], node: str, policy: Optional[Dict[str, str]] = None):
+    """
+    Оборачивает модель кэшем для ноды, если это разрешено политикой.
+
+    Args:
+        llm: Исходная модель
+        cache: Кэш ответов; None отключает кэширование
+        node: Имя ноды графа
+        policy: Режимы кэширования по нодам; по умолчанию DEFAULT_CACHE_POLICY
+
+    Returns:
+        CachedLLM или исходная модель
+    """
+    if cache is None:
+        return llm
+    mode = (policy or DEFAULT_CACHE_POLICY).get(node, CACHE_NEVER)
+    if not is_cacheable(llm, mode):
+        return llm
+    return CachedLLM(llm, cache, node)
@@ -0,0 +1,607 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import deque
+from typing import Callable, Deque, Dict, List, Any, Optional, Tuple
+from metrics import REGISTRY, MetricsRegistry
+
+# Причины повторов: перегрузка провайдера снижает лимит параллелизма
+RETRY_RATE_LIMIT = "rate_limit"
+RETRY_SERVER = "server"
+RETRY_TIMEOUT = "timeout"
+RETRY_CONNECTION = "connection"
+OVERLOAD_REASONS = (RETRY_RATE_LIMIT, RETRY_TIMEOUT)
+
+# Дедлайн запуска (time.time()) для вызовов в текущем контексте: после него ожидание лимитов
+# и повторы прекращаются. Синхронный вызов, брошенный по дедлайну, иначе продолжал бы
+# повторяться в фоновом потоке, занимая слот параллелизма
+_call_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("llm_call_deadline", default=None)
+
+
+@contextmanager
+def call_deadline(deadline: Optional[float]):
+    """Ограничивает ожидание лимитов и повторы вызовов LLM внутри блока дедлайном deadline"""
+    token = _call_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _call_deadline.reset(token)
+
+def _past_deadline(delay: float) -> bool:
+    """Истечет ли дедлайн вызова через delay секунд"""
+    deadline = _call_deadline.get()
+    return deadline is not None and time.time() + delay >= deadline
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    """HTTP-статус ошибки: gigachat.exceptions.ResponseError(url, status, content, headers) или httpx"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is None and len(error.args) >= 2 and isinstance(error.args[1], int):
+        status = error.args[1]
+    return status
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Значение заголовка Retry-After в секундах, если провайдер его прислал"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers is None and len(error.args) >= 4:
+        headers = error.args[3]
+    try:
+        return float(headers.get("retry-after") or headers.get("Retry-After"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def retry_reason(error: Exception) -> Optional[str]:
+    """Причина, по которой вызов стоит повторить; None - ошибка не временная"""
+    status = _status_code(error)
+    if status == 429:
+        return RETRY_RATE_LIMIT
+    if status is not None:
+        return RETRY_SERVER if status >= 500 else None
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)) or "Timeout" in type(error).__name__:
+        return RETRY_TIMEOUT
+    if isinstance(error, ConnectionError) or "Connect" in type(error).__name__:
+        return RETRY_CONNECTION
+    return None
+
+def estimate_tokens(messages: List[Any]) -> int:
+    """Грубая оценка токенов промпта по длине текста (около 4 символов на токен)"""
+    return sum(len(str(getattr(message, "content", message))) for message in messages) // 4 + 1
+
+def _usage_tokens(response) -> Optional[int]:
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return usage.get("total_tokens")
+    return (getattr(response, "response_metadata", None) or {}).get("token_usage", {}).get("total_tokens")
+
+
+class TokenBucket:
+    """
+    Корзина токенов с пополнением rate единиц в минуту.
+
+    Запрос резервирует единицы сразу, даже если их пока не хватает: баланс уходит
+    в минус, а вызывающий ждет, пока корзина его покроет. Поэтому ожидающие
+    обслуживаются по очереди, а не гонятся друг с другом после каждого пополнения.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        """
+        Args:
+            rate_per_minute: Скорость пополнения
+            capacity: Максимальный запас для всплесков; по умолчанию - минутная норма
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Резервирует amount единиц и возвращает, сколько секунд нужно подождать"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= min(amount, self.capacity)
+            return max(0.0, -self._tokens / self.rate)
+
+    def adjust(self, amount: float) -> None:
+        """Корректирует баланс, когда фактический расход отличается от зарезервированного"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.capacity, self._tokens - amount)
+
+
+class AdaptiveConcurrency:
+    """
+    Лимит одновременных вызовов LLM с подстройкой AIMD.
+
+    Каждый успешный вызов увеличивает лимит на 1/limit (примерно +1 за "круг" вызовов),
+    перегрузка - ответ 429, таймаут или задержка выше latency_target - уменьшает его
+    в backoff_ratio раз, не чаще раза в cooldown секунд. Слоты общие для потоков и event loop.
+    """
+
+    def __init__(self, initial_limit: int = 4, min_limit: int = 1, max_limit: int = 64,
+                 latency_target: Optional[float] = None, backoff_ratio: float = 0.5, cooldown: float = 1.0):
+        """
+        Args:
+            initial_limit: Начальный лимит
+            min_limit: Нижняя граница лимита
+            max_limit: Верхняя граница лимита
+            latency_target: Задержка вызова в секундах, выше которой считаем провайдера перегруженным
+            backoff_ratio: Множитель лимита при перегрузке
+            cooldown: Минимальный интервал между снижениями лимита, секунды
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff_ratio = backoff_ratio
+        self.cooldown = cooldown
+        self._limit = float(initial_limit)
+        self._in_flight = 0
+        self._waiters: Deque[Callable[[], None]] = deque()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _wake(self) -> None:
+        # Вызывается под блокировкой: передает освободившиеся слоты ожидающим по очереди
+        while self._waiters and self._in_flight < self.limit:
+            self._in_flight += 1
+            self._waiters.popleft()()
+
+    def _try_acquire(self) -> bool:
+        if not self._waiters and self._in_flight < self.limit:
+            self._in_flight += 1
+            return True
+        return False
+
+    def acquire(self) -> None:
+        """Занимает слот, блокируя поток до его освобождения"""
+        with self._lock:
+            if self._try_acquire():
+                return
+            event = threading.Event()
+            self._waiters.append(event.set)
+        event.wait()
+
+    async def aacquire(self) -> None:
+        """Занимает слот, не блокируя event loop"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._try_acquire():
+                return
+            future = loop.create_future()
+
+            def waker():
+                loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+            self._waiters.append(waker)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waker in self._waiters:
+                    self._waiters.remove(waker)
+                    raise
+            # Слот уже был передан этой задаче - возвращаем его
+            self.release()
+            raise
+
+    def release(self, latency: Optional[float] = None, overloaded: bool = False) -> None:
+        """
+        Освобождает слот и подстраивает лимит.
+
+        Args:
+            latency: Длительность успешного вызова; None - вызов завершился ошибкой
+            overloaded: Ошибка говорит о перегрузке провайдера
+        """
+        with self._lock:
+            self._in_flight -= 1
+            now = time.monotonic()
+            if overloaded or (latency is not None and self.latency_target is not None and latency > self.latency_target):
+                if now - self._last_decrease >= self.cooldown:
+                    self._limit = max(self.min_limit, self._limit * self.backoff_ratio)
+                    self._last_decrease = now
+            elif latency is not None:
+                self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+            self._wake()
+
+
+class RetryPolicy:
+    """Экспоненциальная задержка с полным джиттером для временных ошибок"""
+
+    def __init__(self, max_retries: int = 3, base_delay: float = 1.0, max_delay: float = 30.0):
+        """
+        Args:
+            max_retries: Максимальное количество повторов одного вызова
+            base_delay: Задержка перед первым повтором, секунды (верхняя граница джиттера)
+            max_delay: Максимальная задержка, секунды
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, error: Exception) -> float:
+        """Пауза перед повтором номер attempt (с нуля)"""
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after)
+        # Полный джиттер: клиенты, упершиеся в лимит одновременно, не повторяют запросы синхронно
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class HedgePolicy:
+    """
+    Дублирование медленных асинхронных вызовов.
+
+    Если ответ не пришел за p95 задержки ноды, отправляется второй такой же запрос
+    и берется первый ответ. Доля дублей ограничена max_ratio, чтобы не удваивать нагрузку
+    при общей деградации провайдера.
+    """
+
+    def __init__(self, percentile: float = 95.0, min_samples: int = 20, window: int = 200,
+                 max_ratio: float = 0.1, min_delay: float = 0.05):
+        """
+        Args:
+            percentile: Перцентиль задержки, после которого отправляется дубль
+            min_samples: Сколько успешных вызовов ноды нужно до первого дубля
+            window: Сколько последних задержек учитывается
+            max_ratio: Максимальная доля продублированных вызовов
+            min_delay: Минимальная задержка перед дублем, секунды
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self.max_ratio = max_ratio
+        self.min_delay = min_delay
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._calls = 0
+        self._hedged = 0
+        self._lock = threading.Lock()
+
+    def observe(self, node: str, latency: float) -> None:
+        with self._lock:
+            self._latencies.setdefault(node, deque(maxlen=self.window)).append(latency)
+
+    def delay(self, node: str) -> Optional[float]:
+        """Задержка перед дублем для ноды; None - статистики пока недостаточно"""
+        with self._lock:
+            self._calls += 1
+            samples = sorted(self._latencies.get(node, ()))
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return max(self.min_delay, samples[index])
+
+    def allow(self) -> bool:
+        """Резервирует дубль, если бюджет дублей не исчерпан"""
+        with self._lock:
+            if self._hedged + 1 > self._calls * self.max_ratio:
+                return False
+            self._hedged += 1
+            return True
+
+
+class LLMLimiter:
+    """
+    Общие для всех нод и запусков ограничения вызовов LLM.
+
+    Перед вызовом резервируются запрос и оценка токенов в корзинах requests/min
+    и tokens/min, затем занимается слот адаптивного параллелизма. Временные ошибки
+    повторяются с экспоненциальной задержкой, асинхронные вызовы могут дублироваться.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 concurrency: Optional[AdaptiveConcurrency] = None, retry: Optional[RetryPolicy] = None,
+                 hedge: Optional[HedgePolicy] = None, expected_completion_tokens: int = 1000,
+                 metrics: Optional[MetricsRegistry] = REGISTRY):
+        """
+        Args:
+            requests_per_minute: Лимит запросов в минуту; None - без ограничения
+            tokens_per_minute: Лимит токенов (промпт + ответ) в минуту; None - без ограничения
+            concurrency: Адаптивный лимит одновременных вызовов; None - без ограничения
+            retry: Политика повторов; None - без повторов
+            hedge: Политика дублирования асинхронных вызовов; None - без дублей
+            expected_completion_tokens: Оценка длины ответа при резервировании токенов
+            metrics: Реестр метрик; None отключает метрики
+        """
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = concurrency
+        self.retry = retry
+        self.hedge = hedge
+        self.expected_completion_tokens = expected_completion_tokens
+        self.metrics = metrics
+        if metrics is not None:
+            self.queue_wait = metrics.histogram("agent_llm_queue_wait_seconds", "Ожидание лимитов перед вызовом LLM")
+            self.retries = metrics.counter("agent_llm_retries_total", "Повторы вызовов LLM по причине")
+            self.hedges = metrics.counter("agent_llm_hedges_total", "Дублированные вызовы LLM")
+            if concurrency is not None:
+                metrics.add_collector("llm_concurrency", self._collect)
+
+    @classmethod
+    def from_env(cls, metrics: Optional[MetricsRegistry] = REGISTRY, share: int = 1) -> "LLMLimiter":
+        """
+        Ограничения из переменных окружения: GIGACHAT_RPM, GIGACHAT_TPM,
+        GIGACHAT_CONCURRENCY (начальный лимит), GIGACHAT_LATENCY_TARGET (задержка вызова в секундах,
+        выше которой лимит параллелизма снижается), GIGACHAT_MAX_RETRIES, GIGACHAT_HEDGE=1
+
+        Args:
+            metrics: Реестр метрик; None отключает метрики
+            share: Число процессов, между которыми делятся лимиты провайдера; каждому
+                достается 1/share запросов, токенов и начального параллелизма
+        """
+        rpm = os.getenv("GIGACHAT_RPM")
+        tpm = os.getenv("GIGACHAT_TPM")
+        concurrency = os.getenv("GIGACHAT_CONCURRENCY")
+        latency_target = os.getenv("GIGACHAT_LATENCY_TARGET")
+        return cls(
+            requests_per_minute=float(rpm) / share if rpm else None,
+            tokens_per_minute=float(tpm) / share if tpm else None,
+            concurrency=AdaptiveConcurrency(
+                initial_limit=max(1, int(concurrency) // share),
+                latency_target=float(latency_target) if latency_target else None,
+            ) if concurrency else None,
+            retry=RetryPolicy(max_retries=int(os.getenv("GIGACHAT_MAX_RETRIES", "3"))),
+            hedge=HedgePolicy() if os.getenv("GIGACHAT_HEDGE") == "1" else None,
+            metrics=metrics,
+        )
+
+    def _collect(self) -> List[str]:
+        return [
+            "# HELP agent_llm_concurrency_limit Текущий адаптивный лимит одновременных вызовов LLM",
+            "# TYPE agent_llm_concurrency_limit gauge",
+            f"agent_llm_concurrency_limit {self.concurrency.limit}",
+            "# HELP agent_llm_in_flight Выполняющиеся вызовы LLM",
+            "# TYPE agent_llm_in_flight gauge",
+            f"agent_llm_in_flight {self.concurrency.in_flight}",
+        ]
+
+    def _reserve(self, messages: List[Any]) -> Tuple[float, int]:
+        """Резервирует запрос и токены; возвращает время ожидания и зарезервированные токены"""
+        wait = 0.0
+        if self.requests is not None:
+            wait = self.requests.reserve(1)
+        reserved = 0
+        if self.tokens is not None:
+            reserved = estimate_tokens(messages) + self.expected_completion_tokens
+            wait = max(wait, self.tokens.reserve(reserved))
+        return wait, reserved
+
+    def _refund(self, reserved: int) -> None:
+        """Возвращает резерв вызова, который так и не был выполнен"""
+        if self.requests is not None:
+            self.requests.adjust(-1)
+        if self.tokens is not None and reserved:
+            self.tokens.adjust(-reserved)
+
+    def _settle(self, reserved: int, response) -> None:
+        if self.tokens is None or not reserved:
+            return
+        actual = _usage_tokens(response)
+        if actual is not None:
+            self.tokens.adjust(actual - reserved)
+
+    def _record_wait(self, node: str, started: float) -> None:
+        if self.metrics is not None:
+            self.queue_wait.observe(time.perf_counter() - started, node=node)
+
+    def _finish(self, node: str, started: float, error: Optional[Exception] = None, cancelled: bool = False) -> None:
+        """Освобождает слот параллелизма и учитывает задержку вызова"""
+        if cancelled:
+            # Отмененный дубль ничего не говорит о состоянии провайдера
+            if self.concurrency is not None:
+                self.concurrency.release()
+            return
+        latency = time.perf_counter() - started
+        if error is None and self.hedge is not None:
+            self.hedge.observe(node, latency)
+        if self.concurrency is not None:
+            overloaded = error is not None and retry_reason(error) in OVERLOAD_REASONS
+            self.concurrency.release(None if error is not None else latency, overloaded)
+
+    def _retry_delay(self, node: str, attempt: int, error: Exception) -> Optional[float]:
+        """Пауза перед повтором или None, если ошибку нужно пробросить"""
+        if self.retry is None or attempt >= self.retry.max_retries:
+            return None
+        reason = retry_reason(error)
+        if reason is None:
+            return None
+        delay = self.retry.delay(attempt, error)
+        if _past_deadline(delay):
+            return None
+        if self.metrics is not None:
+            self.retries.inc(node=node, reason=reason)
+        return delay
+
+    # --- синхронные вызовы ---
+
+    def _acquire(self, node: str, messages: List[Any]) -> int:
+        started = time.perf_counter()
+        wait, reserved = self._reserve(messages)
+        if wait and _past_deadline(wait):
+            self._refund(reserved)
+            raise TimeoutError("Дедлайн вызова LLM истечет раньше, чем позволят лимиты")
+        if wait:
+            time.sleep(wait)
+        if self.concurrency is not None:
+            self.concurrency.acquire()
+        self._record_wait(node, started)
+        return reserved
+
+    def call(self, node: str, messages: List[Any], func: Callable[[], Any]):
+        """Выполняет синхронный вызов func() с ограничениями и повторами"""
+        attempt = 0
+        while True:
+            reserved = self._acquire(node, messages)
+            started = time.perf_counter()
+            try:
+                response = func()
+            except Exception as e:
+                self._finish(node, started, e)
+                delay = self._retry_delay(node, attempt, e)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                continue
+            self._finish(node, started)
+            self._settle(reserved, response)
+            return response
+
+    # --- асинхронные вызовы ---
+
+    async def _aacquire(self, node: str, messages: List[Any]) -> int:
+        started = time.perf_counter()
+        wait, reserved = self._reserve(messages)
+        if wait and _past_deadline(wait):
+            self._refund(reserved)
+            raise TimeoutError("Дедлайн вызова LLM истечет раньше, чем позволят лимиты")
+        if wait:
+            await asyncio.sleep(wait)
+        if self.concurrency is not None:
+            await self.concurrency.aacquire()
+        self._record_wait(node, started)
+        return reserved
+
+    async def _asingle(self, node: str, messages: List[Any], factory: Callable[[], Any]):
+        reserved = await self._aacquire(node, messages)
+        started = time.perf_counter()
+        try:
+            response = await factory()
+        except asyncio.CancelledError:
+            self._finish(node, started, cancelled=True)
+            raise
+        except Exception as e:
+            self._finish(node, started, e)
+            raise
+        self._finish(node, started)
+        self._settle(reserved, response)
+        return response
+
+    async def _ahedged(self, node: str, messages: List[Any], factory: Callable[[], Any]):
+        delay = self.hedge.delay(node) if self.hedge is not None else None
+        if delay is None:
+            return await self._asingle(node, messages, factory)
+        tasks = {asyncio.ensure_future(self._asingle(node, messages, factory))}
+        hedge_task = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and self.hedge.allow():
+                if self.metrics is not None:
+                    self.hedges.inc(node=node, result="sent")
+                hedge_task = asyncio.ensure_future(self._asingle(node, messages, factory))
+                tasks.add(hedge_task)
+            while True:
+                done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if self.metrics is not None and task is hedge_task:
+                            self.hedges.inc(node=node, result="won")
+                        return task.result()
+                if not pending:
+                    # Упали оба запроса: пробрасываем ошибку первого
+                    raise next(iter(done)).exception()
+                tasks = pending
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def acall(self, node: str, messages: List[Any], factory: Callable[[], Any]):
+        """Выполняет асинхронный вызов await factory() с ограничениями, повторами и дублированием"""
+        attempt = 0
+        while True:
+            try:
+                return await self._ahedged(node, messages, factory)
+            except Exception as e:
+                delay = self._retry_delay(node, attempt, e)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def astream(self, node: str, messages: List[Any], factory: Callable[[], Any]):
+        """
+        Потоковый вызов с ограничениями.
+
+        Повтор возможен только до первого фрагмента ответа; потоковые вызовы не дублируются,
+        чтобы токены не попадали в поток дважды.
+        """
+        attempt = 0
+        while True:
+            reserved = await self._aacquire(node, messages)
+            started = time.perf_counter()
+            error = None
+            response = None
+            try:
+                async for chunk in factory():
+                    response = chunk if response is None else response + chunk
+                    yield chunk
+            except asyncio.CancelledError:
+                self._finish(node, started, cancelled=True)
+                raise
+            except Exception as e:
+                error = e
+                self._finish(node, started, error)
+            except BaseException:
+                # Потребитель закрыл генератор (GeneratorExit)
+                self._finish(node, started, cancelled=True)
+                raise
+            else:
+                self._finish(node, started)
+            if error is None:
+                self._settle(reserved, response)
+                return
+            delay = None if response is not None else self._retry_delay(node, attempt, error)
+            if delay is None:
+                raise error
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+class LimitedLLM:
+    """Обертка над моделью, выполняющая вызовы одной ноды через общий LLMLimiter"""
+
+    def __init__(self, llm, limiter: LLMLimiter, node: str):
+        self.llm = llm
+        self.limiter = limiter
+        self.node = node
+
+    def __getattr__(self, name: str):
+        # Параметры модели (temperature и т.д.) берем у исходного клиента
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def invoke(self, messages: List[Any], **kwargs):
+        return self.limiter.call(self.node, messages, lambda: self.llm.invoke(messages, **kwargs))
+
+    async def ainvoke(self, messages: List[Any], **kwargs):
+        return await self.limiter.acall(self.node, messages, lambda: self.llm.ainvoke(messages, **kwargs))
+
+    async def astream(self, messages: List[Any], **kwargs):
+        async for chunk in self.limiter.astream(self.node, messages, lambda: self.llm.astream(messages, **kwargs)):
+            yield chunk
+
+
+def with_limits(llm, limiter: Optional[LLMLimiter], node: str):
+    """Оборачивает модель ограничениями для ноды; без limiter возвращает исходную модель"""
+    if limiter is None:
+        return llm
+    return LimitedLLM(llm, limiter, node)
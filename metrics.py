@@ -0,0 +1,396 @@
+import time
+import bisect
+import threading
+from typing import Callable, Dict, List, Any, Optional, Tuple
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Границы бакетов гистограмм по умолчанию (секунды): от быстрых нод до многоминутных генераций
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+LabelValues = Tuple[Tuple[str, str], ...]
+
+
+def _labels_key(labels: Dict[str, Any]) -> LabelValues:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def _format_labels(labels: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    body = ",".join('{}="{}"'.format(name, value.replace("\\", "\\\\").replace('"', '\\"')) for name, value in items)
+    return "{" + body + "}"
+
+
+class Counter:
+    """Монотонно растущий счетчик с метками"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self, reset: bool = False) -> Dict[LabelValues, float]:
+        with self._lock:
+            values = dict(self._values)
+            if reset:
+                self._values.clear()
+            return values
+
+    def merge(self, values: Dict[LabelValues, float]) -> None:
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0.0) + value
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in sorted(self.snapshot().items())]
+
+
+class Histogram:
+    """Гистограмма значений с метками в формате Prometheus"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # По каждому набору меток: счетчики бакетов, сумма и количество наблюдений
+        self._values: Dict[LabelValues, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _labels_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            if index < len(self.buckets):
+                series["buckets"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def snapshot(self, reset: bool = False) -> Dict[LabelValues, Dict[str, Any]]:
+        with self._lock:
+            values = {
+                key: {"buckets": list(series["buckets"]), "sum": series["sum"], "count": series["count"]}
+                for key, series in self._values.items()
+            }
+            if reset:
+                self._values.clear()
+            return values
+
+    def merge(self, values: Dict[LabelValues, Dict[str, Any]]) -> None:
+        with self._lock:
+            for key, other in values.items():
+                series = self._values.get(key)
+                if series is None:
+                    series = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                series["buckets"] = [a + b for a, b in zip(series["buckets"], other["buckets"])]
+                series["sum"] += other["sum"]
+                series["count"] += other["count"]
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, series in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["buckets"]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', repr(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {series['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик процесса: снимок для кода и текстовый формат Prometheus для мониторинга"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._collectors: Dict[str, Callable[[], List[str]]] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, help: str, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = self._metrics[name] = cls(name, help, **kwargs)
+        return metric
+
+    def counter(self, name: str, help: str = "") -> Counter:
+        """Возвращает счетчик, создавая его при первом обращении"""
+        return self._get(Counter, name, help)
+
+    def histogram(self, name: str, help: str = "", buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """Возвращает гистограмму, создавая ее при первом обращении"""
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def add_collector(self, name: str, collector: Callable[[], List[str]]) -> None:
+        """
+        Регистрирует функцию, дописывающую строки Prometheus при каждом экспорте.
+
+        Коллектор с тем же именем заменяется: повторная регистрация (например, новым
+        AgentRuntime) не дублирует семейства метрик и не накапливает коллекторы.
+        """
+        with self._lock:
+            self._collectors[name] = collector
+
+    def remove_collector(self, name: str) -> None:
+        """Удаляет коллектор по имени, если он зарегистрирован"""
+        with self._lock:
+            self._collectors.pop(name, None)
+
+    def snapshot(self, reset: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        Снимок всех метрик.
+
+        Args:
+            reset: Обнулить метрики после снимка, чтобы следующий снимок содержал только приращения
+
+        Returns:
+            {имя: {"type": "counter" | "histogram", "help": ..., "buckets": ..., "values": {метки: значение}}}
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        result = {}
+        for metric in metrics:
+            result[metric.name] = {"type": metric.kind, "help": metric.help, "values": metric.snapshot(reset)}
+            if metric.kind == "histogram":
+                result[metric.name]["buckets"] = metric.buckets
+        return result
+
+    def merge(self, snapshot: Dict[str, Dict[str, Any]]) -> None:
+        """Добавляет к метрикам снимок другого реестра (например, из рабочего процесса)"""
+        for name, data in snapshot.items():
+            if data["type"] == "counter":
+                self.counter(name, data["help"]).merge(data["values"])
+            else:
+                self.histogram(name, data["help"], tuple(data["buckets"])).merge(data["values"])
+
+    def render_prometheus(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+            collectors = list(self._collectors.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for collector in collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+# Реестр процесса по умолчанию
+REGISTRY = MetricsRegistry()
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Callback LangChain, измеряющий запуски графа, ноды и вызовы LLM.
+
+    Записывает:
+        agent_run_duration_seconds, agent_runs_total{status} - запуски графа целиком
+        agent_node_duration_seconds{node}, agent_node_errors_total{node} - ноды графа
+        agent_llm_duration_seconds{node}, agent_llm_requests_total{node,status},
+        agent_llm_tokens_total{node,type} - вызовы LLM и токены prompt/completion
+        agent_node_llm_seconds{node} - время ноды, пока выполнялся хотя бы один ее вызов LLM:
+            параллельные вызовы (конвейерный аналитик, спекулятивные черновики) не суммируются
+    """
+
+    # Обработчик вызывается прямо в потоке/цикле событий: он только пишет в счетчики
+    run_inline = True
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY):
+        self.registry = registry
+        self.run_duration = registry.histogram("agent_run_duration_seconds", "Длительность запуска графа")
+        self.runs = registry.counter("agent_runs_total", "Запуски графа по статусу")
+        self.node_duration = registry.histogram("agent_node_duration_seconds", "Длительность выполнения ноды")
+        self.node_errors = registry.counter("agent_node_errors_total", "Ошибки нод")
+        self.llm_duration = registry.histogram("agent_llm_duration_seconds", "Длительность вызова LLM")
+        self.llm_requests = registry.counter("agent_llm_requests_total", "Вызовы LLM по статусу")
+        self.llm_tokens = registry.counter("agent_llm_tokens_total", "Токены LLM (prompt/completion)")
+        self.node_llm = registry.histogram("agent_node_llm_seconds", "Время ноды, занятое вызовами LLM")
+        # run_id -> (вид, нода, время начала)
+        self._started: Dict[Any, Tuple[str, str, float]] = {}
+        self._roots = set()
+        # run_id вложенной цепочки или вызова LLM -> run_id ноды
+        self._node_of: Dict[Any, Any] = {}
+        # run_id ноды -> [активные вызовы LLM, начало текущего интервала, накопленное время];
+        # вызовы одной ноды идут из разных потоков, поэтому изменения под блокировкой
+        self._llm_busy: Dict[Any, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        if parent_run_id is None:
+            self._roots.add(run_id)
+            self._started[run_id] = ("run", "", time.perf_counter())
+        elif parent_run_id in self._roots:
+            # Нода графа - прямой потомок запуска; вложенные цепочки не считаем
+            node = (metadata or {}).get("langgraph_node") or kwargs.get("name", "")
+            self._llm_busy[run_id] = [0, 0.0, 0.0]
+            self._started[run_id] = ("node", node, time.perf_counter())
+        else:
+            owner = self._owner(parent_run_id)
+            if owner is not None:
+                self._node_of[run_id] = owner
+
+    def _owner(self, parent_run_id) -> Any:
+        """run_id ноды, внутри которой выполняется дочерний запуск"""
+        return parent_run_id if parent_run_id in self._llm_busy else self._node_of.get(parent_run_id)
+
+    def _finish_chain(self, run_id, error: bool) -> None:
+        self._node_of.pop(run_id, None)
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        kind, node, start = started
+        elapsed = time.perf_counter() - start
+        if kind == "run":
+            self._roots.discard(run_id)
+            self.run_duration.observe(elapsed)
+            self.runs.inc(status="error" if error else "ok")
+        else:
+            self.node_duration.observe(elapsed, node=node)
+            with self._lock:
+                active, since, busy = self._llm_busy.pop(run_id, (0, 0.0, 0.0))
+            if active:
+                # Вызовы, отмененные вместе с нодой, не сообщают о завершении
+                busy += time.perf_counter() - since
+            self.node_llm.observe(busy, node=node)
+            if error:
+                self.node_errors.inc(node=node)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish_chain(run_id, error=False)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._finish_chain(run_id, error=True)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self._start_llm(run_id, parent_run_id, metadata)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, metadata=None, **kwargs):
+        self._start_llm(run_id, parent_run_id, metadata)
+
+    def _start_llm(self, run_id, parent_run_id, metadata) -> None:
+        now = time.perf_counter()
+        self._started[run_id] = ("llm", (metadata or {}).get("langgraph_node", ""), now)
+        owner = self._owner(parent_run_id)
+        if owner is None:
+            return
+        self._node_of[run_id] = owner
+        with self._lock:
+            busy = self._llm_busy.get(owner)
+            if busy is not None:
+                if not busy[0]:
+                    busy[1] = now
+                busy[0] += 1
+
+    def _finish_llm(self, run_id) -> Optional[Tuple[str, float]]:
+        """Нода и длительность завершенного вызова LLM; время занятости ноды закрывается с последним вызовом"""
+        started = self._started.pop(run_id, None)
+        owner = self._node_of.pop(run_id, None)
+        if started is None:
+            return None
+        _, node, start = started
+        now = time.perf_counter()
+        with self._lock:
+            busy = self._llm_busy.get(owner)
+            if busy is not None and busy[0]:
+                busy[0] -= 1
+                if not busy[0]:
+                    busy[2] += now - busy[1]
+        return node, now - start
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        finished = self._finish_llm(run_id)
+        if finished is None:
+            return
+        node, elapsed = finished
+        self.llm_duration.observe(elapsed, node=node)
+        self.llm_requests.inc(node=node, status="ok")
+        prompt_tokens, completion_tokens = _token_usage(response)
+        if prompt_tokens:
+            self.llm_tokens.inc(prompt_tokens, node=node, type="prompt")
+        if completion_tokens:
+            self.llm_tokens.inc(completion_tokens, node=node, type="completion")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        finished = self._finish_llm(run_id)
+        if finished is None:
+            return
+        node, elapsed = finished
+        self.llm_duration.observe(elapsed, node=node)
+        self.llm_requests.inc(node=node, status="error")
+
+
+def _token_usage(response) -> Tuple[int, int]:
+    """Токены prompt/completion из LLMResult"""
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if not isinstance(usage, dict):
+        usage = getattr(usage, "__dict__", {})
+    return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+
+def cache_collector(cache) -> Callable[[], List[str]]:
+    """Экспортирует счетчики попаданий кэша ответов LLM в формате Prometheus"""
+    def collect() -> List[str]:
+        lines = [
+            "# HELP agent_llm_cache_requests_total Обращения к кэшу ответов LLM",
+            "# TYPE agent_llm_cache_requests_total counter",
+        ]
+        for node, counters in sorted(cache.stats().items()):
+            lines.append(f'agent_llm_cache_requests_total{{node="{node}",result="hit"}} {counters["hits"]}')
+            lines.append(f'agent_llm_cache_requests_total{{node="{node}",result="miss"}} {counters["misses"]}')
+        return lines
+    return collect
+
+
+def start_metrics_server(port: int = 9100, registry: MetricsRegistry = REGISTRY, host: str = "127.0.0.1"):
+    """
+    Запускает HTTP-эндпоинт /metrics в фоновом потоке.
+
+    По умолчанию эндпоинт доступен только локально; для сбора метрик с другой машины
+    передайте host="0.0.0.0".
+
+    Returns:
+        Экземпляр сервера; остановить - server.shutdown()
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
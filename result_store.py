@@ -0,0 +1,229 @@
+import re
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+WORD_RE = re.compile(r"\w+")
+ROMAN_RE = re.compile(r"^(?=[ivxlcdm]+$)m{0,3}(cm|cd|d?c{0,3})(xc|xl|l?x{0,3})(ix|iv|v?i{0,3})$")
+# Кириллические буквы, которыми часто набирают римские цифры ("ХХ век")
+CYRILLIC_ROMAN = str.maketrans({"Х": "X", "І": "I"})
+# Короткие слова, которые меняют смысл темы на противоположный, но почти не меняют шинглы
+NEGATIONS = frozenset({"не", "ни", "нет", "без", "not", "no", "non", "without"})
+
+# Режимы переиспользования найденного результата
+REUSE_RESULT = "result"  # Вернуть сохраненный результат без запуска графа
+REUSE_SEED = "seed"  # Взять анализ и принятый контент как отправную точку: запуск начинается с критика
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def normalize_topic(topic: str) -> str:
+    """
+    Нормализованная тема: регистр, ё/е, пунктуация и порядок слов не учитываются.
+
+    "Искусственный интеллект в современном образовании!" и
+    "современном образовании: искусственный интеллект в" дают одну строку.
+    """
+    words = WORD_RE.findall(topic.lower().replace("ё", "е"))
+    return " ".join(sorted(words))
+
+def topic_shingles(topic: str, size: int = 3) -> FrozenSet[str]:
+    """
+    Шинглы нормализованной темы: символьные n-граммы каждого слова с границами.
+
+    Не зависят от порядка слов и почти не меняются при смене окончаний
+    ("современном" / "современное"), поэтому сходство тем устойчиво к словоформам.
+    """
+    shingles = set()
+    for word in normalize_topic(topic).split():
+        padded = f"^{word}$"
+        if len(padded) <= size:
+            shingles.add(padded)
+        else:
+            shingles.update(padded[i:i + size] for i in range(len(padded) - size + 1))
+    return frozenset(shingles)
+
+def distinguishing_tokens(topic: str) -> FrozenSet[str]:
+    """
+    Слова темы, которые должны совпадать у похожих тем: числа, римские цифры и отрицания.
+
+    "История России XIX века" и "... XX века" или "ИИ опасен" и "ИИ не опасен" почти
+    совпадают по шинглам, но это разные темы. Римскими цифрами считаются только слова
+    в верхнем регистре, чтобы "mix" или "di" не принимались за числа.
+    """
+    tokens = set()
+    for word in WORD_RE.findall(topic.replace("ё", "е")):
+        lowered = word.lower()
+        if any(char.isdigit() for char in word) or lowered in NEGATIONS:
+            tokens.add(lowered)
+        elif word.isupper():
+            roman = word.translate(CYRILLIC_ROMAN).lower()
+            if ROMAN_RE.match(roman):
+                tokens.add(roman)
+    return frozenset(tokens)
+
+def jaccard(left: FrozenSet[str], right: FrozenSet[str]) -> float:
+    if not left and not right:
+        return 1.0
+    return len(left & right) / len(left | right)
+
+
+class MinHashIndex:
+    """
+    Индекс похожих множеств шинглов: MinHash-сигнатуры с LSH по полосам.
+
+    Кандидаты ищутся по совпадению хотя бы одной полосы сигнатуры, поэтому поиск
+    не перебирает все темы; окончательное сходство считается точно по шинглам кандидатов.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm должен делиться на bands")
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(num_perm)]
+        self._buckets: List[Dict[Tuple[int, ...], set]] = [{} for _ in range(bands)]
+        self._shingles: Dict[str, FrozenSet[str]] = {}
+
+    def signature(self, shingles: FrozenSet[str]) -> List[int]:
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in shingles]
+        if not hashes:
+            return [0] * len(self._perms)
+        return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in self._perms]
+
+    def _bands(self, signature: List[int]):
+        for band in range(self.bands):
+            yield band, tuple(signature[band * self.rows:(band + 1) * self.rows])
+
+    def add(self, key: str, shingles: FrozenSet[str]) -> None:
+        if key in self._shingles:
+            return
+        self._shingles[key] = shingles
+        for band, value in self._bands(self.signature(shingles)):
+            self._buckets[band].setdefault(value, set()).add(key)
+
+    def query(self, shingles: FrozenSet[str]) -> List[Tuple[str, float]]:
+        """Похожие ключи с точным коэффициентом Жаккара, по убыванию сходства"""
+        candidates = set()
+        for band, value in self._bands(self.signature(shingles)):
+            candidates.update(self._buckets[band].get(value, ()))
+        scored = [(key, jaccard(shingles, self._shingles[key])) for key in candidates]
+        return sorted(scored, key=lambda item: item[1], reverse=True)
+
+    def __len__(self) -> int:
+        return len(self._shingles)
+
+
+@dataclass
+class StoredResult:
+    """Найденный результат похожей темы"""
+    topic: str
+    similarity: float
+    mode: str  # REUSE_RESULT или REUSE_SEED
+    result: Dict[str, Any]
+
+
+class ResultStore:
+    """
+    Хранилище результатов запусков по темам с поиском почти совпадающих тем.
+
+    Темы нормализуются (normalize_topic) и индексируются MinHash по шинглам. По умолчанию
+    результат возвращается как есть только для темы с тем же нормализованным ключом; для
+    темы со сходством не ниже seed_threshold запуск начинается с ее анализа и принятого
+    контента. Темы с разными числами, римскими цифрами или отрицаниями (distinguishing_tokens)
+    похожими не считаются.
+    Без path записи хранятся в памяти процесса, с path - в SQLite-файле (индекс строится
+    при открытии).
+    """
+
+    def __init__(self, path: Optional[str] = None, result_threshold: float = 1.0,
+                 seed_threshold: Optional[float] = 0.85, ttl: Optional[float] = None):
+        """
+        Args:
+            path: Путь к SQLite-файлу; None - хранение в памяти
+            result_threshold: Сходство тем (0-1), начиная с которого результат возвращается без запуска;
+                1.0 - только при совпадении нормализованных тем
+            seed_threshold: Сходство, начиная с которого запуск начинается с сохраненного контента;
+                None - только готовые результаты
+            ttl: Время жизни записи в секундах; None - без ограничения
+        """
+        self.result_threshold = result_threshold
+        self.seed_threshold = seed_threshold
+        self.ttl = ttl
+        self._index = MinHashIndex()
+        self._records: Dict[str, Tuple[str, Dict[str, Any], float]] = {}
+        self._lock = threading.Lock()
+        self._conn = None
+        if path is not None:
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30.0)
+            with self._lock, self._conn:
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS topic_results ("
+                    "key TEXT PRIMARY KEY, topic TEXT NOT NULL, result TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+                for key, topic, result, created_at in self._conn.execute(
+                    "SELECT key, topic, result, created_at FROM topic_results"
+                ):
+                    self._remember(key, topic, json.loads(result), created_at)
+
+    def _remember(self, key: str, topic: str, result: Dict[str, Any], created_at: float) -> None:
+        self._records[key] = (topic, result, created_at)
+        self._index.add(key, topic_shingles(topic))
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def put(self, topic: str, result: Dict[str, Any]) -> None:
+        """
+        Сохраняет результат темы.
+
+        Args:
+            topic: Тема
+            result: Результат запуска в виде, пригодном для JSON (см. agents.jsonable_result)
+        """
+        key = normalize_topic(topic)
+        now = time.time()
+        with self._lock:
+            self._remember(key, topic, result, now)
+            if self._conn is not None:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO topic_results (key, topic, result, created_at) VALUES (?, ?, ?, ?)",
+                        (key, topic, json.dumps(result, ensure_ascii=False), now)
+                    )
+
+    def lookup(self, topic: str) -> Optional[StoredResult]:
+        """Ищет сохраненный результат для темы; None, если похожей темы нет"""
+        key = normalize_topic(topic)
+        with self._lock:
+            record = self._records.get(key)
+            if record is not None and not self._expired(record[2]):
+                return StoredResult(record[0], 1.0, REUSE_RESULT, record[1])
+            tokens = distinguishing_tokens(topic)
+            for other, similarity in self._index.query(topic_shingles(topic)):
+                stored_topic, result, created_at = self._records[other]
+                if self._expired(created_at) or distinguishing_tokens(stored_topic) != tokens:
+                    continue
+                if self.result_threshold < 1.0 and similarity >= self.result_threshold:
+                    return StoredResult(stored_topic, similarity, REUSE_RESULT, result)
+                if self.seed_threshold is not None and similarity >= self.seed_threshold:
+                    return StoredResult(stored_topic, similarity, REUSE_SEED, result)
+                # Кандидаты отсортированы по сходству: дальше только менее похожие
+                break
+        return None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._records)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
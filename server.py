@@ -0,0 +1,443 @@
+import json
+import time
+import uuid
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+from urllib.parse import parse_qs
+import agents
+from agents import AgentRuntime
+
+logger = logging.getLogger("agents.server")
+
+# Статусы задания
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Параметры запуска, которые клиент может передать вместе с темой
+RUN_OPTIONS = ("timeout", "keep_drafts", "max_messages")
+
+
+def parse_run_options(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Проверяет параметры запуска из тела запроса.
+
+    Returns:
+        Заданные параметры из RUN_OPTIONS
+
+    Raises:
+        ValueError: Параметр неверного типа или вне допустимого диапазона
+    """
+    options = {name: payload[name] for name in RUN_OPTIONS if payload.get(name) is not None}
+    timeout = options.get("timeout")
+    if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0):
+        raise ValueError("timeout должен быть положительным числом секунд")
+    if "keep_drafts" in options and not isinstance(options["keep_drafts"], bool):
+        raise ValueError("keep_drafts должен быть true или false")
+    max_messages = options.get("max_messages")
+    if max_messages is not None and (isinstance(max_messages, bool) or not isinstance(max_messages, int) or max_messages < 0):
+        raise ValueError("max_messages должен быть неотрицательным целым числом")
+    return options
+
+
+class QueueFull(Exception):
+    """Очередь заданий заполнена: клиенту нужно повторить запрос позже"""
+
+
+class Draining(Exception):
+    """Сервер останавливается и новые задания не принимает"""
+
+
+class Job:
+    """Задание на обработку темы и его события для потокового вывода"""
+
+    def __init__(self, topic: str, options: Dict[str, Any], subscriber_buffer: int = 1000):
+        self.id = uuid.uuid4().hex
+        self.topic = topic
+        self.options = options
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        # Токены получают только подписчики во время работы: итоговый текст есть в результате,
+        # поэтому для повторного чтения хранятся лишь события нод и итог
+        self.events: List[Dict[str, Any]] = []
+        # Сколько событий может ждать медленного подписчика: сверх этого его токены отбрасываются
+        self.subscriber_buffer = subscriber_buffer
+        self.tokens_dropped = 0
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        if event["type"] != "token":
+            self.events.append(event)
+        for subscriber in self._subscribers:
+            if event["type"] == "token" and subscriber.qsize() >= self.subscriber_buffer:
+                # Клиент не успевает читать поток: токены не копятся в памяти, итоговый текст
+                # он получит в событии final. События нод немногочисленны и доставляются всегда
+                self.tokens_dropped += 1
+                continue
+            subscriber.put_nowait(event)
+
+    def finish(self, status: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished_at = time.time()
+        self.publish({"type": "final", "result": result} if status == DONE else {"type": "error", "error": error})
+
+    async def follow(self):
+        """Отдает сохраненные события задания, затем новые до его завершения"""
+        # Снимок и подписка без await между ними: ни одно событие не теряется и не повторяется
+        history = list(self.events)
+        if self.finished:
+            for event in history:
+                yield event
+            return
+        subscriber = asyncio.Queue()
+        self._subscribers.add(subscriber)
+        try:
+            for event in history:
+                yield event
+            while True:
+                event = await subscriber.get()
+                yield event
+                if event["type"] in ("final", "error"):
+                    return
+        finally:
+            self._subscribers.discard(subscriber)
+
+    def describe(self) -> Dict[str, Any]:
+        """Статус задания без результата"""
+        return {
+            "job_id": self.id,
+            "topic": self.topic,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error
+        }
+
+
+class JobQueue:
+    """
+    Ограниченная очередь заданий с пулом обработчиков.
+
+    Все задания выполняются одним AgentRuntime, поэтому клиенты GigaChat и Langfuse,
+    скомпилированный граф и лимиты вызовов LLM общие для всех запросов. Если в очереди
+    нет места, submit() сразу отказывает (QueueFull) вместо неограниченного накопления заданий.
+    """
+
+    def __init__(self, runtime: Optional[AgentRuntime] = None, workers: int = 4, max_queue: int = 100,
+                 keep_finished: int = 1000, subscriber_buffer: int = 1000, **graph_options):
+        """
+        Args:
+            runtime: Окружение с клиентами и кэшем графов; по умолчанию agents.get_runtime()
+            workers: Число одновременно выполняемых запусков
+            max_queue: Сколько заданий может ждать обработчика; сверх этого submit() отказывает
+            keep_finished: Сколько завершенных заданий хранить для запросов статуса и результата
+            subscriber_buffer: Сколько событий хранить для каждого клиента потокового вывода;
+                токены сверх этого отбрасываются, если клиент читает медленнее, чем пишет модель
+            graph_options: Параметры графа (max_revisions, parallel_sections, ...), см. create_agent_graph
+        """
+        if workers < 1:
+            raise ValueError("workers должен быть не меньше 1")
+        self.runtime = runtime or agents.get_runtime()
+        self.workers = workers
+        self.max_queue = max_queue
+        self.keep_finished = keep_finished
+        self.subscriber_buffer = subscriber_buffer
+        self.graph_options = graph_options
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._draining = False
+
+    async def start(self) -> None:
+        """Создает клиенты и граф заранее и запускает обработчиков"""
+        await asyncio.to_thread(self.runtime.warmup, **self.graph_options)
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._draining = False
+        self._tasks = [asyncio.create_task(self._worker(index)) for index in range(self.workers)]
+        logger.info("Очередь заданий запущена: обработчиков %s, мест в очереди %s", self.workers, self.max_queue)
+
+    def submit(self, topic: str, **options) -> Job:
+        """
+        Ставит тему в очередь.
+
+        Args:
+            topic: Тема
+            options: Параметры запуска (timeout, keep_drafts, max_messages), см. arun_multi_agent_system
+
+        Raises:
+            Draining: Сервер останавливается
+            QueueFull: В очереди нет места
+        """
+        if self._draining or self._queue is None:
+            raise Draining("Сервер останавливается")
+        job = Job(topic, options, self.subscriber_buffer)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFull(f"Очередь заполнена ({self.max_queue} заданий)") from None
+        self.jobs[job.id] = job
+        self._evict()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние очереди для проверки работоспособности"""
+        running = sum(1 for job in self.jobs.values() if job.status == RUNNING)
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": running,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "draining": self._draining
+        }
+
+    async def drain(self, timeout: Optional[float] = None) -> None:
+        """
+        Плавная остановка: новые задания не принимаются, принятые выполняются до конца.
+
+        Args:
+            timeout: Сколько секунд ждать завершения принятых заданий; по истечении
+                незавершенные задания отменяются
+        """
+        self._draining = True
+        if self._queue is None:
+            return
+        logger.info("Остановка: ждем завершения заданий (в очереди %s)", self._queue.qsize())
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Задания не завершились за %s с, отменяем их", timeout)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Задания, которые так и не начали выполняться
+        while not self._queue.empty():
+            job = self._queue.get_nowait()
+            job.finish(FAILED, error="Сервер остановлен до начала обработки")
+            self._queue.task_done()
+        await asyncio.to_thread(self.runtime.flush_traces)
+
+    def _evict(self) -> None:
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self.jobs[job_id]
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        job.status = RUNNING
+        job.started_at = time.time()
+        logger.debug("Задание %s: начало обработки", job.id)
+        try:
+            async for event in agents.astream_multi_agent_system(
+                job.topic, runtime=self.runtime, run_id=job.id, **job.options, **self.graph_options
+            ):
+                if event["type"] == "final":
+                    job.finish(DONE, result=agents.jsonable_result(event["result"]))
+                else:
+                    job.publish(event)
+        except asyncio.CancelledError:
+            job.finish(FAILED, error="Обработка прервана остановкой сервера")
+            raise
+        except Exception as e:
+            logger.warning("Задание %s завершилось ошибкой: %s", job.id, e)
+            job.finish(FAILED, error=str(e))
+        else:
+            logger.debug("Задание %s: обработка завершена", job.id)
+        finally:
+            self._evict()
+
+
+class ServiceApp:
+    """
+    ASGI-приложение над JobQueue.
+
+    Эндпоинты:
+        POST /jobs - поставить тему в очередь: {"topic": ..., "timeout": ...} → 202 {"job_id", "status"};
+            429 с Retry-After, если очередь заполнена, 503 во время остановки
+        GET /jobs/{id} - статус задания
+        GET /jobs/{id}/result - результат: 200 после завершения, 202 пока задание выполняется
+        GET /jobs/{id}/stream - события задания (Server-Sent Events), как у astream_multi_agent_system
+        GET /health - состояние очереди
+    """
+
+    def __init__(self, queue: JobQueue, drain_timeout: Optional[float] = 300.0, retry_after: int = 5):
+        """
+        Args:
+            queue: Очередь заданий
+            drain_timeout: Сколько секунд при остановке ждать принятые задания
+            retry_after: Значение заголовка Retry-After (секунды) в ответах 429 и 503
+        """
+        self.queue = queue
+        self.drain_timeout = drain_timeout
+        self.retry_after = retry_after
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    await self.queue.start()
+                except Exception as e:
+                    await send({"type": "lifespan.startup.failed", "message": str(e)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.queue.drain(self.drain_timeout)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send) -> None:
+        method = scope["method"]
+        parts = [part for part in scope["path"].split("/") if part]
+        if parts == ["health"] and method == "GET":
+            await self._json(send, 200, self.queue.stats())
+        elif parts == ["jobs"] and method == "POST":
+            await self._submit(receive, send)
+        elif len(parts) in (2, 3) and parts[0] == "jobs" and method == "GET":
+            job = self.queue.get(parts[1])
+            action = parts[2] if len(parts) == 3 else None
+            if job is None:
+                await self._json(send, 404, {"error": "Задание не найдено"})
+            elif action is None:
+                await self._json(send, 200, job.describe())
+            elif action == "result":
+                await self._result(send, job)
+            elif action == "stream":
+                await self._stream(send, job, parse_qs(scope.get("query_string", b"").decode()))
+            else:
+                await self._json(send, 404, {"error": "Неизвестный эндпоинт"})
+        else:
+            await self._json(send, 404, {"error": "Неизвестный эндпоинт"})
+
+    async def _submit(self, receive, send) -> None:
+        try:
+            payload = json.loads(await self._body(receive) or b"{}")
+        except ValueError:
+            await self._json(send, 400, {"error": "Тело запроса должно быть JSON"})
+            return
+        topic = payload.get("topic") if isinstance(payload, dict) else None
+        if not isinstance(topic, str) or not topic.strip():
+            await self._json(send, 400, {"error": "Не задана тема (topic)"})
+            return
+        try:
+            options = parse_run_options(payload)
+        except ValueError as e:
+            await self._json(send, 400, {"error": str(e)})
+            return
+        try:
+            job = self.queue.submit(topic, **options)
+        except QueueFull as e:
+            await self._json(send, 429, {"error": str(e)}, [(b"retry-after", str(self.retry_after).encode())])
+            return
+        except Draining as e:
+            await self._json(send, 503, {"error": str(e)}, [(b"retry-after", str(self.retry_after).encode())])
+            return
+        await self._json(send, 202, {"job_id": job.id, "status": job.status},
+                         [(b"location", f"/jobs/{job.id}".encode())])
+
+    async def _result(self, send, job: Job) -> None:
+        if job.status == DONE:
+            await self._json(send, 200, job.result)
+        elif job.status == FAILED:
+            await self._json(send, 500, job.describe())
+        else:
+            await self._json(send, 202, job.describe())
+
+    async def _stream(self, send, job: Job, query: Dict[str, List[str]]) -> None:
+        # ?tokens=0 - без токенов писателя, только события нод и итог
+        tokens = query.get("tokens", ["1"])[0] not in ("0", "false")
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream; charset=utf-8"), (b"cache-control", b"no-cache")]
+        })
+        async for event in job.follow():
+            if event["type"] == "token" and not tokens:
+                continue
+            data = json.dumps(event, ensure_ascii=False)
+            await send({"type": "http.response.body", "body": f"event: {event['type']}\ndata: {data}\n\n".encode("utf-8"), "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    @staticmethod
+    async def _body(receive) -> bytes:
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                return body
+
+    @staticmethod
+    async def _json(send, status: int, payload: Any, headers: Optional[List] = None) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json; charset=utf-8"),
+                        (b"content-length", str(len(body)).encode())] + (headers or [])
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def create_app(runtime: Optional[AgentRuntime] = None, workers: int = 4, max_queue: int = 100,
+               drain_timeout: Optional[float] = 300.0, **graph_options) -> ServiceApp:
+    """
+    Создает ASGI-приложение сервиса.
+
+    Args:
+        runtime: Окружение с клиентами и кэшем графов; по умолчанию agents.get_runtime()
+        workers: Число одновременно выполняемых запусков
+        max_queue: Размер очереди заданий; при заполненной очереди POST /jobs отвечает 429
+        drain_timeout: Сколько секунд при остановке ждать принятые задания
+        graph_options: Параметры графа (max_revisions, parallel_sections, ...), см. create_agent_graph
+    """
+    return ServiceApp(JobQueue(runtime, workers=workers, max_queue=max_queue, **graph_options), drain_timeout)
+
+
+def serve(host: str = "127.0.0.1", port: int = 8000, runtime: Optional[AgentRuntime] = None, **app_options) -> None:
+    """
+    Запускает сервис на uvicorn; по SIGINT/SIGTERM принятые задания дорабатываются до остановки.
+
+    Args:
+        host: Адрес
+        port: Порт
+        runtime: Окружение с клиентами и кэшем графов; по умолчанию agents.get_runtime()
+        app_options: Параметры create_app (workers, max_queue, drain_timeout, параметры графа)
+    """
+    try:
+        import uvicorn
+    except ImportError:
+        raise RuntimeError("Для режима сервиса установите uvicorn: pip install uvicorn") from None
+    app = create_app(runtime, **app_options)
+    # Плавную остановку выполняет lifespan приложения, поэтому uvicorn не ограничиваем по времени
+    uvicorn.run(app, host=host, port=port, lifespan="on", log_level="warning")
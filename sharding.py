@@ -0,0 +1,155 @@
+import os
+import asyncio
+import functools
+import itertools
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+import agents
+from agents import AgentRuntime
+from checkpoints import create_checkpointer
+from llm_cache import SQLiteCache
+from llm_limits import LLMLimiter
+from result_store import ResultStore
+from metrics import REGISTRY, MetricsRegistry
+
+logger = logging.getLogger("agents.sharding")
+
+# Параметры запуска, а не графа: при прогреве графа в рабочем процессе не передаются
+RUN_OPTIONS = ("keep_drafts", "max_messages")
+
+Shard = List[Tuple[int, str]]
+
+
+def worker_runtime(env_file: str = "config.env", cache_path: Optional[str] = None, processes: int = 1,
+                   result_store_path: Optional[str] = None, checkpoint_path: Optional[str] = None) -> AgentRuntime:
+    """
+    Окружение рабочего процесса по умолчанию.
+
+    Args:
+        env_file: Файл с переменными окружения
+        cache_path: SQLite-файл кэша ответов LLM, общий для всех процессов; None - без кэша
+        processes: Число рабочих процессов: лимиты GIGACHAT_* делятся между ними поровну
+        result_store_path: SQLite-файл результатов по темам; индекс похожих тем каждый процесс
+            строит при старте, поэтому результаты других процессов видны только в следующем пакете
+        checkpoint_path: SQLite-файл чекпоинтов, общий для всех процессов; None - запуски не сохраняются
+    """
+    runtime = AgentRuntime(
+        env_file=env_file,
+        cache=SQLiteCache(cache_path) if cache_path else None,
+        checkpointer=create_checkpointer(checkpoint_path) if checkpoint_path else None,
+        result_store=ResultStore(result_store_path) if result_store_path else None
+    )
+    runtime.load_env()
+    runtime.limiter = LLMLimiter.from_env(runtime.metrics, share=processes)
+    return runtime
+
+
+# Состояние рабочего процесса: окружение с прогретым графом и собственный цикл событий,
+# к которому привязаны асинхронные клиенты
+_runtime: Optional[AgentRuntime] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_graph_options: Dict[str, Any] = {}
+
+def _init_worker(runtime_factory: Callable[[], AgentRuntime], graph_options: Dict[str, Any]) -> None:
+    global _runtime, _loop, _graph_options
+    _runtime = runtime_factory()
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+    _graph_options = graph_options
+    _runtime.warmup(**{name: value for name, value in graph_options.items() if name not in RUN_OPTIONS})
+    logger.debug("Рабочий процесс %s готов", os.getpid())
+
+def _run_shard(shard: Shard, concurrency: int, timeout: Optional[float]) -> Tuple[List[Tuple[int, Dict[str, Any]]], Dict[str, Any]]:
+    """Выполняет часть тем в рабочем процессе; возвращает результаты и приращение метрик"""
+    async def collect():
+        indexes = [index for index, _ in shard]
+        return [
+            (indexes[local], result)
+            async for local, result in agents.run_batch(
+                [topic for _, topic in shard], max_concurrency=concurrency, runtime=_runtime,
+                timeout=timeout, **_graph_options
+            )
+        ]
+    results = _loop.run_until_complete(collect())
+    metrics = _runtime.metrics.snapshot(reset=True) if _runtime.metrics is not None else {}
+    return results, metrics
+
+def _shards(topics: Iterable[str], size: int) -> Iterable[Shard]:
+    numbered = enumerate(topics)
+    while True:
+        shard = list(itertools.islice(numbered, size))
+        if not shard:
+            return
+        yield shard
+
+
+async def run_sharded(topics: Iterable[str], processes: Optional[int] = None, concurrency: int = 10,
+                      shard_size: Optional[int] = None, runtime_factory: Optional[Callable[[], AgentRuntime]] = None,
+                      timeout: Optional[float] = None, registry: Optional[MetricsRegistry] = REGISTRY,
+                      **graph_options) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    """
+    Обрабатывает набор тем в пуле процессов - аналог run_batch для нескольких ядер.
+
+    Темы делятся на части по shard_size и раздаются рабочим процессам. Каждый процесс один раз
+    создает свое окружение (клиенты и скомпилированный граф) и выполняет до concurrency
+    запусков одновременно. Темы читаются из итератора по мере освобождения процессов:
+    в работе и в очереди не больше двух частей на процесс. Метрики процессов добавляются
+    в registry родителя после каждой части.
+
+    Args:
+        topics: Итерируемый набор тем
+        processes: Число рабочих процессов; по умолчанию os.cpu_count()
+        concurrency: Число одновременных запусков в одном процессе
+        shard_size: Сколько тем отдавать процессу за раз; по умолчанию 2 * concurrency
+        runtime_factory: Функция без аргументов, создающая окружение в рабочем процессе; должна
+            сериализоваться pickle (функция модуля или functools.partial). По умолчанию
+            worker_runtime с лимитами GIGACHAT_*, поделенными между процессами
+        timeout: Ограничение времени каждого запуска в секундах
+        registry: Реестр метрик родителя; None - метрики процессов не собираются
+        graph_options: Параметры графа и запуска, см. run_batch
+
+    Yields:
+        Пары (индекс темы во входном наборе, результат) в порядке завершения. Если запуск
+        или рабочий процесс упал, результат содержит тему и текст ошибки в поле "error".
+    """
+    processes = processes or os.cpu_count() or 1
+    shard_size = shard_size or 2 * concurrency
+    if runtime_factory is None:
+        runtime_factory = functools.partial(worker_runtime, processes=processes)
+    loop = asyncio.get_running_loop()
+    # spawn: рабочие процессы не наследуют потоки и клиенты родителя
+    pool = ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(runtime_factory, graph_options)
+    )
+    pending: Dict[asyncio.Future, Shard] = {}
+    shards = _shards(topics, shard_size)
+    try:
+        while True:
+            for shard in shards:
+                pending[loop.run_in_executor(pool, _run_shard, shard, concurrency, timeout)] = shard
+                if len(pending) >= 2 * processes:
+                    break
+            if not pending:
+                break
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                shard = pending.pop(future)
+                try:
+                    results, metrics = future.result()
+                except Exception as e:
+                    logger.warning("Рабочий процесс не обработал %s тем: %s", len(shard), e)
+                    results = [(index, {"topic": topic, "error": str(e)}) for index, topic in shard]
+                else:
+                    if registry is not None:
+                        registry.merge(metrics)
+                for item in results:
+                    yield item
+    finally:
+        for future in pending:
+            future.cancel()
+        pool.shutdown(wait=not pending, cancel_futures=True)
@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip("langgraph")
+
+from batch import count_topics, read_topics
+
+
+def write(tmp_path, name: str, text: str) -> str:
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_fallback_id_is_line_number(tmp_path):
+    path = write(tmp_path, "topics.jsonl", '"Первая"\n\nне json\n{"topic": "Вторая"}\n"Третья"\n')
+    assert list(read_topics(path)) == [("1", "Первая"), ("4", "Вторая"), ("5", "Третья")]
+
+
+def test_duplicate_ids_are_skipped(tmp_path):
+    path = write(tmp_path, "topics.jsonl", '{"id": "2", "topic": "Первая"}\n"Вторая"\n{"id": "a", "topic": "Третья"}\n{"id": "a", "topic": "Четвертая"}\n')
+    assert list(read_topics(path)) == [("2", "Первая"), ("a", "Третья")]
+
+
+def test_count_matches_processed_records(tmp_path):
+    path = write(tmp_path, "topics.jsonl", '"Первая"\nне json\n{"title": "без темы"}\n{"topic": "Вторая"}\n\n')
+    assert count_topics(path) == len(list(read_topics(path))) == 2
+
+
+def test_csv_ids_and_count(tmp_path):
+    path = write(tmp_path, "topics.csv", 'id,topic\n,Первая\nx,\nx,Вторая\n')
+    assert list(read_topics(path)) == [("2", "Первая"), ("x", "Вторая")]
+    assert count_topics(path) == 2
@@ -0,0 +1,21 @@
+import pytest
+
+pytest.importorskip("langgraph")
+
+from benchmarks.fake_llm import FakeGigaChat  # noqa: E402
+from benchmarks.runner import make_runtime  # noqa: E402
+import agents  # noqa: E402
+
+
+@pytest.mark.parametrize("graph_options", [
+    {},
+    {"parallel_sections": True},
+    {"pipelined": True},
+    {"revision_mode": "segments"},
+])
+def test_timeout_before_first_draft_returns_empty_content(graph_options):
+    runtime = make_runtime(FakeGigaChat(latency=0.3))
+    result = agents.run_multi_agent_system("Тема", runtime=runtime, callbacks=[], timeout=0.5, **graph_options)
+    assert result["truncated"]
+    assert result["content"] == ""
+    assert result["tool_results"] == {}
@@ -0,0 +1,26 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from llm_cache import LRUCache, ResponseCache, SQLiteCache  # noqa: E402
+
+
+def test_incomplete_backend_fails_on_creation():
+    class GetOnly(ResponseCache):
+        def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnly()
+    with pytest.raises(TypeError):
+        ResponseCache()
+
+
+@pytest.mark.parametrize("make", [LRUCache, lambda: SQLiteCache(":memory:")])
+def test_backends_store_and_clear(make):
+    cache = make()
+    assert cache.get("k") is None
+    cache.set("k", "ответ")
+    assert cache.get("k") == "ответ"
+    cache.clear()
+    assert cache.get("k") is None
@@ -0,0 +1,225 @@
+import asyncio
+import pytest
+
+pytest.importorskip("langgraph")
+
+from langchain_core.messages import HumanMessage  # noqa: E402
+from benchmarks.fake_llm import FakeGigaChat  # noqa: E402
+import llm_limits  # noqa: E402
+from llm_limits import (  # noqa: E402
+    AdaptiveConcurrency, HedgePolicy, LimitedLLM, LLMLimiter, RetryPolicy, TokenBucket, call_deadline,
+)
+from metrics import MetricsRegistry  # noqa: E402
+import agents  # noqa: E402
+
+
+class CountingLimiter(LLMLimiter):
+    def __init__(self):
+        super().__init__(metrics=None)
+        self.nodes = []
+
+    def call(self, node, messages, func):
+        self.nodes.append(node)
+        return super().call(node, messages, func)
+
+
+def test_graph_without_llm_uses_runtime_limiter(monkeypatch):
+    limiter = CountingLimiter()
+    runtime = agents.AgentRuntime(llm=FakeGigaChat(latency=0.0), metrics=None, limiter=limiter)
+    monkeypatch.setattr(agents, "_default_runtime", runtime)
+    graph = agents.create_agent_graph(callbacks=[])
+    graph.invoke(agents._initial_state("Тема"))
+    assert {"analyst", "writer", "critic"} <= set(limiter.nodes)
+
+
+class FakeClock:
+    """Подменяет модуль time в llm_limits: sleep только сдвигает часы"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    perf_counter = monotonic
+    time = monotonic
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(llm_limits, "time", fake)
+    # Джиттер повторов - верхняя граница интервала
+    monkeypatch.setattr(llm_limits.random, "uniform", lambda low, high: high)
+    return fake
+
+
+class StatusError(Exception):
+    """Ошибка провайдера в формате gigachat ResponseError(url, status, content, headers)"""
+
+    def __init__(self, status, headers=None):
+        super().__init__("url", status, b"", headers or {})
+
+
+class FlakyLLM:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def invoke(self, messages, **kwargs):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+MESSAGES = [HumanMessage(content="вопрос")]
+
+
+def test_token_bucket_queues_reservations(clock):
+    bucket = TokenBucket(60, capacity=2)
+    assert [bucket.reserve(1) for _ in range(3)] == [0.0, 0.0, 1.0]
+    clock.now += 1
+    assert bucket.reserve(1) == 1.0
+    bucket.adjust(-1)
+    assert bucket.reserve(1) == 1.0
+
+
+def test_adaptive_concurrency_grows_and_backs_off(clock):
+    limiter = AdaptiveConcurrency(initial_limit=4, latency_target=2.0, cooldown=1.0)
+    for _ in range(4):
+        limiter.acquire()
+    limiter.release(latency=0.5)
+    assert limiter.limit == 4 and limiter._limit == 4.25
+    limiter.release(latency=3.0)
+    assert limiter.limit == 2
+    limiter.release(overloaded=True)  # в пределах cooldown - без повторного снижения
+    assert limiter.limit == 2
+    clock.now += 1
+    limiter.release(overloaded=True)
+    assert limiter.limit == 1
+    assert limiter.in_flight == 0
+
+
+def test_adaptive_concurrency_hands_slots_to_waiters_in_order():
+    limiter = AdaptiveConcurrency(initial_limit=1)
+
+    async def scenario():
+        await limiter.aacquire()
+        order = []
+
+        async def waiter(name):
+            await limiter.aacquire()
+            order.append(name)
+            limiter.release(latency=0.0)
+
+        tasks = [asyncio.ensure_future(waiter(name)) for name in "ab"]
+        await asyncio.sleep(0)
+        assert limiter.in_flight == 1 and not order
+        limiter.release(latency=0.0)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["a", "b"]
+    assert limiter.in_flight == 0
+
+
+def test_retry_policy_backoff_and_retry_after(clock):
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+    assert [policy.delay(attempt, StatusError(500)) for attempt in range(4)] == [1.0, 2.0, 4.0, 5.0]
+    assert policy.delay(0, StatusError(429, {"retry-after": "3"})) == 3.0
+
+
+def test_hedge_policy_waits_for_samples_and_limits_ratio():
+    hedge = HedgePolicy(percentile=50, min_samples=4, max_ratio=0.5, min_delay=0.0)
+    assert hedge.delay("writer") is None
+    for latency in (1.0, 2.0, 3.0, 4.0):
+        hedge.observe("writer", latency)
+    assert hedge.delay("writer") == 3.0
+    assert hedge.allow()
+    assert not hedge.allow()  # два вызова - не больше одного дубля
+
+
+def test_limited_llm_retries_transient_errors(clock):
+    registry = MetricsRegistry()
+    limiter = LLMLimiter(retry=RetryPolicy(max_retries=3, base_delay=1.0), metrics=registry)
+    llm = FlakyLLM([StatusError(429), StatusError(503)])
+    assert LimitedLLM(llm, limiter, "writer").invoke(MESSAGES) == "ok"
+    assert llm.calls == 3
+    assert clock.sleeps == [1.0, 2.0]
+    retries = registry.snapshot()["agent_llm_retries_total"]["values"]
+    assert sum(retries.values()) == 2
+
+
+def test_limited_llm_does_not_retry_permanent_errors(clock):
+    limiter = LLMLimiter(retry=RetryPolicy(max_retries=3), metrics=None)
+    llm = FlakyLLM([StatusError(400)])
+    with pytest.raises(StatusError):
+        LimitedLLM(llm, limiter, "writer").invoke(MESSAGES)
+    assert llm.calls == 1 and clock.sleeps == []
+
+
+def test_retries_stop_at_deadline(clock):
+    concurrency = AdaptiveConcurrency(initial_limit=2)
+    limiter = LLMLimiter(concurrency=concurrency, retry=RetryPolicy(max_retries=5, base_delay=1.0), metrics=None)
+    llm = FlakyLLM([StatusError(503)] * 5)
+    with call_deadline(clock.now + 2.5), pytest.raises(StatusError):
+        LimitedLLM(llm, limiter, "writer").invoke(MESSAGES)
+    # Первый повтор (1 с) успевает, второй (2 с) уже нет
+    assert llm.calls == 2 and clock.sleeps == [1.0]
+    assert concurrency.in_flight == 0
+
+
+def test_rate_limit_wait_past_deadline_is_refunded(clock):
+    limiter = LLMLimiter(requests_per_minute=60, metrics=None)
+    limiter.requests.capacity = limiter.requests._tokens = 1
+    llm = FlakyLLM([])
+    LimitedLLM(llm, limiter, "writer").invoke(MESSAGES)
+    with call_deadline(clock.now + 0.5), pytest.raises(TimeoutError):
+        LimitedLLM(llm, limiter, "writer").invoke(MESSAGES)
+    assert llm.calls == 1
+    assert limiter.requests.reserve(1) == 1.0
+
+
+def test_hedged_call_returns_first_response():
+    hedge = HedgePolicy(min_samples=1, min_delay=0.0)
+    hedge.observe("writer", 0.01)
+    hedge._calls = 10  # бюджет дублей уже накоплен
+    limiter = LLMLimiter(hedge=hedge, metrics=None)
+    stalled = asyncio.Event()
+    calls = []
+
+    async def factory():
+        calls.append(len(calls))
+        if len(calls) == 1:
+            await stalled.wait()  # первый запрос не отвечает
+        return f"ответ {len(calls)}"
+
+    assert asyncio.run(limiter.acall("writer", MESSAGES, factory)) == "ответ 2"
+    assert len(calls) == 2
+
+
+def test_from_env_reads_latency_target(monkeypatch):
+    monkeypatch.setenv("GIGACHAT_CONCURRENCY", "8")
+    monkeypatch.setenv("GIGACHAT_LATENCY_TARGET", "2.5")
+    limiter = LLMLimiter.from_env(metrics=None, share=2)
+    assert limiter.concurrency.limit == 4
+    assert limiter.concurrency.latency_target == 2.5
+
+
+def test_sync_deadline_reaches_limiter():
+    seen = []
+
+    class DeadlineProbe:
+        def invoke(self, messages):
+            seen.append(llm_limits._call_deadline.get())
+            return "ok"
+
+    deadline = llm_limits.time.time() + 60
+    assert agents._invoke_before(DeadlineProbe(), MESSAGES, deadline) == "ok"
+    assert seen == [deadline]
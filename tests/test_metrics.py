@@ -0,0 +1,52 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from llm_cache import LRUCache  # noqa: E402
+from metrics import MetricsRegistry, cache_collector  # noqa: E402
+
+
+def test_collectors_are_replaced_by_name():
+    registry = MetricsRegistry()
+    for _ in range(3):
+        registry.add_collector("llm_cache", cache_collector(LRUCache()))
+    output = registry.render_prometheus()
+    assert output.count("# TYPE agent_llm_cache_requests_total counter") == 1
+
+
+def test_removed_collector_is_not_rendered():
+    registry = MetricsRegistry()
+    registry.add_collector("llm_cache", cache_collector(LRUCache()))
+    registry.remove_collector("llm_cache")
+    assert "agent_llm_cache_requests_total" not in registry.render_prometheus()
+
+
+def node_times(node: str, **graph_options):
+    from benchmarks.fake_llm import FakeGigaChat
+    from benchmarks.runner import make_runtime
+    import agents
+
+    registry = MetricsRegistry()
+    runtime = make_runtime(FakeGigaChat(latency=0.05), registry)
+    agents.run_multi_agent_system("Тема", runtime=runtime, callbacks=[], **graph_options)
+    snapshot = registry.snapshot()
+
+    def total(name: str) -> float:
+        values = snapshot[name]["values"]
+        return sum(series["sum"] for key, series in values.items() if dict(key).get("node") == node)
+
+    return total("agent_node_duration_seconds"), total("agent_node_llm_seconds"), total("agent_llm_duration_seconds")
+
+
+def test_concurrent_llm_calls_are_not_summed_for_pipelined_analyst():
+    pytest.importorskip("langgraph")
+    node, busy, summed = node_times("analyst", pipelined=True)
+    assert summed > node
+    assert 0 < busy <= node
+
+
+def test_concurrent_llm_calls_are_not_summed_for_speculative_writer():
+    pytest.importorskip("langgraph")
+    node, busy, summed = node_times("writer", speculative_drafts=3)
+    assert summed > node
+    assert 0 < busy <= node
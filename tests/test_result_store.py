@@ -0,0 +1,57 @@
+from result_store import REUSE_RESULT, REUSE_SEED, ResultStore, distinguishing_tokens
+
+TOPIC = "Искусственный интеллект в современном образовании"
+
+
+def stored(topic: str, **options) -> ResultStore:
+    store = ResultStore(**options)
+    store.put(topic, {"topic": topic, "accepted_content": "текст"})
+    return store
+
+
+def test_exact_normalized_topic_returns_result():
+    found = stored(TOPIC).lookup("современном образовании: искусственный интеллект в!")
+    assert found.mode == REUSE_RESULT
+    assert found.similarity == 1.0
+
+
+def test_similar_topic_only_seeds_by_default():
+    found = stored(TOPIC).lookup("Искусственный интеллект в современном образование")
+    assert found.mode == REUSE_SEED
+
+
+def test_unrelated_topic_is_not_found():
+    assert stored(TOPIC).lookup("История России") is None
+
+
+def test_negation_blocks_match():
+    store = stored("Почему ИИ опасен для общества", seed_threshold=0.5)
+    assert store.lookup("Почему ИИ не опасен для общества") is None
+
+
+def test_number_difference_blocks_match():
+    store = stored("Переход с Python 2 на новые версии", seed_threshold=0.5)
+    assert store.lookup("Переход с Python 3 на новые версии") is None
+
+
+def test_roman_numeral_difference_blocks_match():
+    store = stored("История России XIX века", seed_threshold=0.5)
+    assert store.lookup("История России XX века") is None
+    # Римские цифры, набранные кириллической "Х", тоже различаются
+    assert store.lookup("История России ХХ века") is None
+
+
+def test_distinguishing_tokens_ignore_lowercase_roman_lookalikes():
+    assert distinguishing_tokens("mix di civil") == frozenset()
+    assert distinguishing_tokens("Python 3, часть IV, не") == {"3", "iv", "не"}
+
+
+def test_fuzzy_result_reuse_is_opt_in():
+    store = stored(TOPIC, result_threshold=0.9)
+    assert store.lookup("Искусственный интеллект в современном образование").mode == REUSE_RESULT
+
+
+def test_sqlite_store_is_loaded_on_open(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    stored(TOPIC, path=path).close()
+    assert ResultStore(path).lookup(TOPIC).result["accepted_content"] == "текст"
@@ -0,0 +1,59 @@
+import time
+import asyncio
+import pytest
+
+pytest.importorskip("langgraph")
+
+from benchmarks.fake_llm import FakeGigaChat  # noqa: E402
+from benchmarks.runner import make_runtime  # noqa: E402
+from checkpoints import create_checkpointer  # noqa: E402
+import agents  # noqa: E402
+
+
+class Crash(BaseException):
+    """Падение процесса посреди запуска: ноды графа его не перехватывают"""
+
+
+class CrashingLLM(FakeGigaChat):
+    crash_role: str = "writer"
+    crashed: bool = False
+
+    def _generate(self, messages, *args, **kwargs):
+        if not self.crashed and self.role(messages) == self.crash_role:
+            self.crashed = True
+            raise Crash()
+        return super()._generate(messages, *args, **kwargs)
+
+
+def crashed_run(run_id: str):
+    runtime = make_runtime(CrashingLLM(latency=0.0))
+    runtime.checkpointer = create_checkpointer()
+    with pytest.raises(Crash):
+        agents.run_multi_agent_system("Тема", runtime=runtime, run_id=run_id, callbacks=[], timeout=0.2)
+    time.sleep(0.3)  # дедлайн исходного запуска истекает, пока процесс "перезапускается"
+    return runtime
+
+
+def test_resume_after_deadline_finishes_run():
+    runtime = crashed_run("job-1")
+    assert agents.list_incomplete_runs(runtime)[0]["next"] == ["writer"]
+    result = agents.resume_run("job-1", runtime=runtime)
+    assert not result["truncated"]
+    assert result["scores"]
+    assert agents.list_incomplete_runs(runtime) == []
+
+
+def test_resume_with_timeout_sets_new_deadline():
+    runtime = crashed_run("job-2")
+    started = time.time()
+    result = agents.resume_run("job-2", runtime=runtime, timeout=60)
+    assert not result["truncated"]
+    state = runtime.get_graph().get_state({"configurable": {"thread_id": "job-2"}}).values
+    assert started + 59 < state["deadline"] < time.time() + 61
+
+
+def test_aresume_after_deadline_finishes_run():
+    runtime = crashed_run("job-3")
+    result = asyncio.run(agents.aresume_run("job-3", runtime=runtime))
+    assert not result["truncated"]
+    assert result["scores"]
@@ -0,0 +1,37 @@
+import pytest
+
+pytest.importorskip("langgraph")
+
+from langchain_core.callbacks import BaseCallbackHandler  # noqa: E402
+from benchmarks.fake_llm import FakeGigaChat  # noqa: E402
+from benchmarks.runner import make_runtime  # noqa: E402
+from result_store import ResultStore  # noqa: E402
+import agents  # noqa: E402
+
+
+class ChainCounter(BaseCallbackHandler):
+    def __init__(self):
+        self.starts = 0
+
+    def on_chain_start(self, *args, **kwargs):
+        self.starts += 1
+
+
+def test_per_request_callbacks_reuse_compiled_graph():
+    runtime = make_runtime(FakeGigaChat(latency=0.0))
+    handlers = [ChainCounter() for _ in range(3)]
+    for handler in handlers:
+        agents.run_multi_agent_system("Тема", runtime=runtime, callbacks=[handler])
+    assert len(runtime._graphs) == 1
+    assert all(handler.starts > 0 for handler in handlers)
+
+
+def test_reused_result_has_same_shape_as_fresh_run():
+    runtime = make_runtime(FakeGigaChat(latency=0.0))
+    runtime.result_store = ResultStore()
+    fresh = agents.run_multi_agent_system("Тема", runtime=runtime, callbacks=[])
+    reused = agents.run_multi_agent_system("Тема", runtime=runtime, callbacks=[])
+    assert reused["reused"]["mode"] == "result"
+    assert set(reused) - {"reused"} == set(fresh)
+    assert [type(message) for message in reused["messages"]] == [type(message) for message in fresh["messages"]]
+    assert [message.content for message in reused["messages"]] == [message.content for message in fresh["messages"]]
@@ -0,0 +1,78 @@
+import pytest
+
+pytest.importorskip("langgraph")
+
+from langchain_core.callbacks import BaseCallbackHandler  # noqa: E402
+from langgraph.types import Send  # noqa: E402
+from benchmarks.fake_llm import FakeGigaChat  # noqa: E402
+from benchmarks.runner import make_runtime  # noqa: E402
+from agents import _initial_state, parse_sections, route_sections, section_from_line  # noqa: E402
+import agents  # noqa: E402
+
+
+def test_explicit_section_lines():
+    analysis = "Анализ темы.\n**РАЗДЕЛ 1:** Введение - цели\r\n- РАЗДЕЛ 2. История\n> ### раздел 3: Итоги"
+    assert parse_sections(analysis) == ["Введение - цели", "История", "Итоги"]
+
+
+def test_section_lines_take_priority_over_headings():
+    analysis = "## План\n## Детали\nРАЗДЕЛ: Первый\nРАЗДЕЛ: Второй"
+    assert parse_sections(analysis) == ["Первый", "Второй"]
+
+
+def test_empty_heading_does_not_swallow_next_line():
+    assert parse_sections("РАЗДЕЛ:\nРАЗДЕЛ: Б\nРАЗДЕЛ: В") == ["Б", "В"]
+    assert parse_sections("## \nТекст введения\n## История\n## Итоги") == ["История", "Итоги"]
+    assert parse_sections("1. \nТекст\n2. Второй\n3. Третий") == ["Второй", "Третий"]
+    assert parse_sections("РАЗДЕЛ: **\nРАЗДЕЛ: А\nРАЗДЕЛ: Б") == ["А", "Б"]
+
+
+def test_headings_and_numbered_fallbacks():
+    assert parse_sections("# Введение\nтекст\n## Итоги\nтекст") == ["Введение", "Итоги"]
+    assert parse_sections("План:\n1. Введение\n2) Итоги") == ["Введение", "Итоги"]
+
+
+@pytest.mark.parametrize("analysis", ["", "Анализ без плана.", "РАЗДЕЛ: Единственный", "# Один заголовок"])
+def test_fewer_than_two_sections_is_no_plan(analysis):
+    assert parse_sections(analysis) == []
+
+
+def test_sections_over_limit_are_merged():
+    analysis = "\n".join(f"РАЗДЕЛ: Р{index}" for index in range(1, 6))
+    assert parse_sections(analysis, max_sections=2) == ["Р1; Р2; Р3", "Р4; Р5"]
+
+
+def test_section_from_line():
+    assert section_from_line("  РАЗДЕЛ: Введение - цели  ") == "Введение - цели"
+    assert section_from_line("Обычная строка") is None
+    assert section_from_line("РАЗДЕЛ:") is None
+
+
+def test_route_fans_out_sections_in_order():
+    state = {**_initial_state("Тема", deadline=123.0), "analysis": "План", "sections": ["А", "Б"]}
+    sends = route_sections(state)
+    assert all(isinstance(send, Send) and send.node == "section_writer" for send in sends)
+    assert [(send.arg["index"], send.arg["section"], send.arg["total"]) for send in sends] == [(0, "А", 2), (1, "Б", 2)]
+    assert all(send.arg["deadline"] == 123.0 for send in sends)
+
+
+def test_route_without_sections_goes_to_single_writer():
+    assert route_sections({**_initial_state("Тема"), "sections": []}) == "writer"
+
+
+class NodeCalls(BaseCallbackHandler):
+    def __init__(self):
+        self.nodes = []
+
+    def on_chat_model_start(self, serialized, messages, *, metadata=None, **kwargs):
+        self.nodes.append((metadata or {}).get("langgraph_node"))
+
+
+@pytest.mark.parametrize("sections, section_calls", [(4, 4), (1, 0)])
+def test_graph_writes_sections_or_falls_back_to_writer(sections, section_calls):
+    runtime = make_runtime(FakeGigaChat(latency=0.0, sections=sections, critic_scores=[9.0]))
+    calls = NodeCalls()
+    result = agents.run_multi_agent_system("Тема", runtime=runtime, callbacks=[calls], parallel_sections=True)
+    assert calls.nodes.count("section_writer") == section_calls
+    assert calls.nodes.count("writer") == (0 if section_calls else 1)
+    assert result["content"] and not result["truncated"]
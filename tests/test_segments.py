@@ -0,0 +1,107 @@
+import pytest
+
+pytest.importorskip("langgraph")
+
+from langchain_core.callbacks import BaseCallbackHandler  # noqa: E402
+from langchain_core.messages import AIMessage  # noqa: E402
+from langchain_core.runnables import RunnableLambda  # noqa: E402
+from benchmarks.fake_llm import FakeGigaChat  # noqa: E402
+from benchmarks.runner import make_runtime  # noqa: E402
+from agents import (  # noqa: E402
+    _initial_state, create_segment_critic_agent, create_segment_writer_agent, segment_hash, split_segments,
+)
+import agents  # noqa: E402
+
+SEGMENTS = ["Первый абзац.", "Второй абзац.", "Третий абзац."]
+
+
+class ScriptedLLM:
+    """Отвечает заданным текстом и запоминает промпты"""
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.prompts = []
+        self.runnable = RunnableLambda(self._call)
+
+    def _call(self, messages):
+        self.prompts.append(messages[-1].content)
+        return AIMessage(content=self.reply(messages) if callable(self.reply) else self.reply)
+
+
+def reviewed_state(**overrides):
+    state = {**_initial_state("Тема"), "analysis": "План материала", "content": "\n\n".join(SEGMENTS)}
+    state.update(overrides)
+    return state
+
+
+def test_writer_rewrites_only_segments_with_issues():
+    llm = ScriptedLLM("Исправленный второй абзац.")
+    writer = create_segment_writer_agent(llm.runnable, full_writer=RunnableLambda(lambda state: {}))
+    update = writer.invoke(reviewed_state(segments=SEGMENTS, segment_issues={"P2": "Добавь пример"}))
+    assert update["segments"] == ["Первый абзац.", "Исправленный второй абзац.", "Третий абзац."]
+    assert update["changed_segments"] == ["P2"]
+    assert len(llm.prompts) == 1 and "Второй абзац." in llm.prompts[0] and "Добавь пример" in llm.prompts[0]
+
+
+def test_recheck_sends_only_changed_segments_and_keeps_accepted_verdicts():
+    segments = ["Первый абзац.", "Исправленный второй абзац.", "Третий абзац."]
+    verdicts = {segment_hash(SEGMENTS[0]): "", segment_hash(SEGMENTS[1]): "Добавь пример",
+                segment_hash(SEGMENTS[2]): ""}
+    llm = ScriptedLLM('Исправление принято.\n{"score": 7, "decision": "ДОРАБОТАТЬ"}')
+    critic = create_segment_critic_agent(llm.runnable)
+    update = critic.invoke(reviewed_state(content="\n\n".join(segments), segments=segments,
+                                          segment_verdicts=verdicts, revision_count=1))
+    prompt = llm.prompts[0]
+    assert "Повторная проверка" in prompt
+    assert "[P2]" in prompt and "[P1]" not in prompt and "[P3]" not in prompt
+    # Перепроверка без новых замечаний: исправления приняты
+    assert update["needs_revision"] is False
+    assert update["segment_issues"] == {}
+    assert update["segment_verdicts"][segment_hash(SEGMENTS[0])] == ""
+    assert update["segment_verdicts"][segment_hash(segments[1])] == ""
+
+
+def test_fully_rewritten_content_gets_full_review():
+    old_verdicts = {segment_hash(segment): "Переписать" for segment in SEGMENTS}
+    llm = ScriptedLLM('Слабо.\n{"score": 4, "decision": "ДОРАБОТАТЬ"}')
+    critic = create_segment_critic_agent(llm.runnable)
+    update = critic.invoke(reviewed_state(content="Новый первый.\n\nНовый второй.", segment_verdicts=old_verdicts,
+                                          revision_count=1))
+    prompt = llm.prompts[0]
+    assert "Повторная проверка" not in prompt
+    assert "План материала" in prompt and "[P1]" in prompt and "[P2]" in prompt
+    # Полная проверка без адресных замечаний - снова полная доработка
+    assert update["needs_revision"] is True
+    assert update["segments"] == ["Новый первый.", "Новый второй."]
+
+
+def test_reviewed_segments_are_not_sent_again():
+    verdicts = {segment_hash(segment): "" for segment in SEGMENTS}
+    llm = ScriptedLLM("не должен вызываться")
+    update = create_segment_critic_agent(llm.runnable).invoke(reviewed_state(segment_verdicts=verdicts))
+    assert llm.prompts == []
+    assert update["needs_revision"] is False
+
+
+class Prompts(BaseCallbackHandler):
+    def __init__(self):
+        self.critic = []
+
+    def on_chat_model_start(self, serialized, messages, *, metadata=None, **kwargs):
+        if (metadata or {}).get("langgraph_node") == "critic":
+            self.critic.append(messages[0][-1].content)
+
+
+def test_graph_rewrites_only_flagged_segment():
+    runtime = make_runtime(FakeGigaChat(latency=0.0, critic_scores=[5.0, 9.0]))
+    prompts = Prompts()
+    result = agents.run_multi_agent_system("Тема", runtime=runtime, callbacks=[prompts], revision_mode="segments")
+    drafts = [message.content[len("Контент: "):] for message in result["messages"]
+              if message.content.startswith("Контент: ")]
+    first, final = split_segments(drafts[0]), split_segments(result["accepted_content"])
+    # Критик отметил P1: переписан только он, остальные фрагменты и их вердикты сохранены
+    assert final[1:] == first[1:] and final[0] != first[0]
+    assert len(prompts.critic) == 2
+    assert "[P2]" in prompts.critic[0]
+    assert "[P1]" in prompts.critic[1] and "[P2]" not in prompts.critic[1]
+    assert result["scores"] == [5.0, 9.0] and not result["truncated"]
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("langgraph")
+
+import server  # noqa: E402
+
+
+@pytest.mark.parametrize("payload", [
+    {"timeout": "abc"},
+    {"timeout": 0},
+    {"keep_drafts": 1},
+    {"max_messages": 1.5},
+    {"max_messages": -1},
+])
+def test_invalid_run_options_are_rejected(payload):
+    with pytest.raises(ValueError):
+        server.parse_run_options(payload)
+
+
+def test_valid_run_options_are_kept():
+    payload = {"topic": "Тема", "timeout": 5, "keep_drafts": False, "max_messages": 0}
+    assert server.parse_run_options(payload) == {"timeout": 5, "keep_drafts": False, "max_messages": 0}
+
+
+def test_slow_subscriber_drops_tokens_but_gets_node_events_and_final():
+    async def scenario():
+        job = server.Job("Тема", {}, subscriber_buffer=3)
+        received = []
+
+        async def read():
+            async for event in job.follow():
+                received.append(event["type"])
+
+        reader = asyncio.create_task(read())
+        await asyncio.sleep(0)
+        for _ in range(10):
+            job.publish({"type": "token", "node": "writer", "content": "..."})
+        job.publish({"type": "node", "node": "writer"})
+        job.finish(server.DONE, result={})
+        await reader
+        return received, job.tokens_dropped
+
+    received, dropped = asyncio.run(scenario())
+    assert received == ["token"] * 3 + ["node", "final"]
+    assert dropped == 7
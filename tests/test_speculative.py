@@ -0,0 +1,138 @@
+import json
+import pytest
+
+pytest.importorskip("langgraph")
+
+from langchain_core.callbacks import BaseCallbackHandler  # noqa: E402
+from langchain_core.messages import AIMessage  # noqa: E402
+from langchain_core.runnables import RunnableLambda  # noqa: E402
+from benchmarks.fake_llm import FakeGigaChat  # noqa: E402
+from benchmarks.runner import make_runtime  # noqa: E402
+from agents import (  # noqa: E402
+    _initial_state, best_draft_index, create_speculative_critic_agent, parse_verdict, split_draft_reviews,
+)
+import agents  # noqa: E402
+
+REVIEW = """**ВАРИАНТ 1:** Слабая структура.
+ВАРИАНТ 2: Хорошо раскрыта тема.
+### Вариант 3.
+Мало примеров.
+{"verdicts": [{"draft": 1, "score": 5, "decision": "ДОРАБОТАТЬ"}, {"draft": 2, "score": 8.5, "decision": "ПРИНЯТЬ"}, {"draft": 3, "score": 7, "decision": "ДОРАБОТАТЬ"}]}"""
+
+
+def verdict(score, decision=None):
+    return {"score": score, "criteria": {}, "decision": decision}
+
+
+def test_reviews_are_split_per_draft():
+    reviews = split_draft_reviews(REVIEW, 3)
+    assert reviews[0].startswith("Слабая структура.")
+    assert reviews[1].startswith("Хорошо раскрыта тема.")
+    assert reviews[2].startswith("Мало примеров.")
+    assert [parse_verdict(review)["score"] for review in reviews] == [5.0, 8.5, 7.0]
+    assert parse_verdict(reviews[1])["decision"] == "accept"
+
+
+def test_missing_draft_review_is_empty():
+    reviews = split_draft_reviews('ВАРИАНТ 1: Неплохо.\n{"verdicts": [{"draft": 1, "score": 6}]}', 2)
+    assert parse_verdict(reviews[0])["score"] == 6.0
+    assert reviews[1] == ""
+
+
+def test_unsplittable_review_gives_empty_reviews():
+    assert split_draft_reviews('Все варианты слабые.\n{"score": 4, "decision": "ДОРАБОТАТЬ"}', 3) == ["", "", ""]
+
+
+def test_best_draft_by_score_then_accept_then_order():
+    assert best_draft_index([verdict(6), verdict(8), verdict(7)]) == 1
+    assert best_draft_index([verdict(8, "revise"), verdict(8, "accept")]) == 1
+    assert best_draft_index([verdict(8), verdict(8)]) == 0
+    assert best_draft_index([verdict(None), verdict(None, "accept"), verdict(2)]) == 2
+    assert best_draft_index([verdict(None), verdict(None)]) == 0
+
+
+def critic_update(text: str):
+    critic = create_speculative_critic_agent(RunnableLambda(lambda messages: AIMessage(content=text)))
+    state = {**_initial_state("Тема"), "analysis": "План", "candidates": ["Первый", "Второй", "Третий"],
+             "revision_count": 1}
+    return critic.invoke(state)
+
+
+def test_critic_chooses_best_draft():
+    update = critic_update(REVIEW)
+    assert update["content"] == "Второй"
+    assert update["scores"] == [8.5]
+    assert update["needs_revision"] is False
+    assert update["feedback"].startswith("Хорошо раскрыта тема.")
+    assert update["candidates"] == []
+
+
+def test_unsplittable_critic_output_takes_first_draft_with_whole_review():
+    text = 'Все варианты слабые.\n{"score": 4, "decision": "ДОРАБОТАТЬ"}'
+    update = critic_update(text)
+    assert update["content"] == "Первый"
+    assert update["feedback"] == text
+    assert update["scores"] == [4.0]
+    assert update["needs_revision"] is True
+
+
+class CriticOutputs(BaseCallbackHandler):
+    def __init__(self):
+        self.reviews = []
+
+    def on_llm_end(self, response, **kwargs):
+        text = response.generations[0][0].text
+        if '"verdicts"' in text:
+            self.reviews.append(text)
+
+
+def test_graph_keeps_best_scored_draft_each_round():
+    runtime = make_runtime(FakeGigaChat(latency=0.0, critic_scores=[5.0, 8.5]))
+    outputs = CriticOutputs()
+    result = agents.run_multi_agent_system("Тема", runtime=runtime, callbacks=[outputs], speculative_drafts=3)
+    best_scores = [
+        max(item["score"] for item in json.loads(review[review.index('{"verdicts"'):])["verdicts"])
+        for review in outputs.reviews
+    ]
+    assert len(best_scores) >= 1
+    assert result["scores"] == best_scores
+    assert result["content"] and not result["truncated"]
+
+
+class AnalyzedTexts:
+    """Подмена инструмента analyze_text, запоминающая проанализированные тексты"""
+    def __init__(self):
+        self.texts = []
+
+    def invoke(self, args):
+        self.texts.append(args["text"])
+        return "Анализ"
+
+
+def test_pipelined_prefetch_skips_unchosen_drafts(monkeypatch):
+    analyzed = AnalyzedTexts()
+    monkeypatch.setattr(agents, "analyze_text", analyzed)
+    runtime = make_runtime(FakeGigaChat(latency=0.0, critic_scores=[5.0, 8.5], sections=0))
+    result = agents.run_multi_agent_system("Тема", runtime=runtime, speculative_drafts=3, pipelined=True)
+    assert len(result["scores"]) == 2
+    # Варианты критик еще не выбрал: анализируют только инструменты и только принятую версию
+    assert analyzed.texts == [result["accepted_content"]]
+
+
+def test_tools_ignore_prefetch_of_another_draft(monkeypatch):
+    analyzed = AnalyzedTexts()
+    monkeypatch.setattr(agents, "analyze_text", analyzed)
+    state = {
+        **_initial_state("Тема"),
+        "content": "Текст",
+        "draft_id": 2,
+        "tool_prefetch": {"draft_id": 1, "key": agents.segment_hash("Текст"), "result": "Старый анализ"},
+    }
+    update = agents.create_tools_agent()(state)
+    assert analyzed.texts == ["Текст"]
+    assert "Старый анализ" not in update["content"]
+
+    state["tool_prefetch"] = {**state["tool_prefetch"], "draft_id": 2}
+    update = agents.create_tools_agent()(state)
+    assert analyzed.texts == ["Текст"]
+    assert "Старый анализ" in update["content"]
@@ -0,0 +1,29 @@
+import pytest
+
+from text_analytics import analyze_stream, analyze_text
+
+
+@pytest.mark.parametrize("text, words, sentences", [
+    ("Привет, мир! Как дела? Хорошо…", 5, 3),  # концы предложений: . ! ? …
+    ("Отлично!!! Ужас?!", 2, 2),  # серия знаков - один конец предложения
+    ("Кто-то пришёл. Ещё раз", 4, 2),  # слово через дефис - одно; хвост без точки - предложение
+    ("Слово — другое слово", 3, 1),  # тире и пунктуация не слова
+    ("Версия 3.5 вышла.", 4, 2),  # точка внутри числа делит его
+    ("...", 0, 0),
+    ("", 0, 0),
+])
+def test_word_and_sentence_counts(text, words, sentences):
+    stats = analyze_text(text)
+    assert (stats.word_count, stats.sentence_count) == (words, sentences)
+
+
+def test_sentiment_words_count_whole_words_per_occurrence():
+    stats = analyze_text("Хорошо, хорошо! Хорошонько плохо.")
+    assert (stats.positive_count, stats.negative_count) == (2, 1)
+    assert stats.sentiment == "Положительная"
+
+
+def test_stream_matches_single_pass():
+    text = "Отлично! Кто-то пришёл. Ещё раз… Версия 3.5 вышла ужасно"
+    chunks = [text[i:i + 3] for i in range(0, len(text), 3)]
+    assert analyze_stream(chunks) == analyze_text(text)
@@ -0,0 +1,101 @@
+import time
+import uuid
+
+import pytest
+
+pytest.importorskip("langchain_core")
+trace_sdk = pytest.importorskip("opentelemetry.sdk.trace")
+
+from tracing import BackgroundExporter, TraceSampler  # noqa: E402
+
+
+class Observation:
+    """Наблюдение как в Langfuse 3.x: обертка над спаном с end(end_time=...)"""
+
+    def __init__(self, span):
+        self._otel_span = span
+
+    def end(self, *, end_time=None):
+        self._otel_span.end(end_time=end_time)
+        return self
+
+
+class SpanHandler:
+    """Обработчик, который, как Langfuse, создает спан OpenTelemetry на каждый шаг"""
+
+    def __init__(self, observation=Observation):
+        self.tracer = trace_sdk.TracerProvider().get_tracer("test")
+        self.observation = observation
+        self.runs = {}
+        self.spans = {}
+
+    def on_chain_start(self, serialized, inputs, run_id, **kwargs):
+        self.runs[run_id] = self.spans[run_id] = self.observation(self.tracer.start_span(serialized["name"]))
+
+    def on_chain_end(self, outputs, run_id, **kwargs):
+        self.runs.pop(run_id).end()
+
+
+def chain_events(started: float):
+    root, child = uuid.uuid4(), uuid.uuid4()
+    return root, child, [
+        ("on_chain_start", ({"name": "graph"}, {}), {"run_id": root, "parent_run_id": None}, started),
+        ("on_chain_start", ({"name": "writer"}, {}), {"run_id": child, "parent_run_id": root}, started + 1),
+        ("on_chain_end", ({},), {"run_id": child, "parent_run_id": root}, started + 4),
+        ("on_chain_end", ({},), {"run_id": root, "parent_run_id": None}, started + 5),
+    ]
+
+
+def test_replayed_spans_keep_recorded_timings():
+    handler = SpanHandler()
+    started = 1_700_000_000.0
+    root, child, events = chain_events(started)
+    BackgroundExporter(lambda: handler, metrics=None)._replay(events)
+    graph, writer = (handler.spans[run_id]._otel_span for run_id in (root, child))
+    assert graph.start_time == int(started * 1e9)
+    assert (graph.end_time - graph.start_time) / 1e9 == pytest.approx(5.0)
+    assert (writer.end_time - writer.start_time) / 1e9 == pytest.approx(3.0)
+
+
+def test_unsupported_observation_is_left_alone():
+    class OldObservation(Observation):
+        def end(self):
+            self._otel_span.end()
+
+    handler = SpanHandler(OldObservation)
+    root, _, events = chain_events(1_700_000_000.0)
+    before = time.time_ns()
+    BackgroundExporter(lambda: handler, metrics=None)._replay(events)
+    assert handler.spans[root]._otel_span.start_time >= before
+
+
+def test_langfuse_handler_spans_keep_recorded_timings():
+    version = pytest.importorskip("langfuse.version").__version__
+    if not version.startswith("3."):
+        pytest.skip(f"тест для Langfuse 3.x, установлена {version}")
+    from langfuse import Langfuse
+    from langfuse.langchain import CallbackHandler
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+    exported = InMemorySpanExporter()
+    provider = trace_sdk.TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exported))
+    # Спаны SDK не отправляются на сервер, а попадают только в exported
+    Langfuse(public_key="pk-test-timings", secret_key="sk-test", host="http://127.0.0.1:9", tracer_provider=provider,
+             blocked_instrumentation_scopes=["langfuse-sdk"])
+    handler = CallbackHandler(public_key="pk-test-timings")
+    started = time.time() - 100
+    _, _, events = chain_events(started)
+    BackgroundExporter(lambda: handler, metrics=None)._replay(events)
+    durations = {span.name: (span.end_time - span.start_time) / 1e9 for span in exported.get_finished_spans()}
+    assert durations == {"graph": pytest.approx(5.0), "writer": pytest.approx(3.0)}
+
+
+def test_zero_sample_rate_exports_nothing_by_default(monkeypatch):
+    monkeypatch.setenv("LANGFUSE_SAMPLE_RATE", "0")
+    monkeypatch.delenv("LANGFUSE_TRACE_ERRORS", raising=False)
+    monkeypatch.delenv("LANGFUSE_SLOW_RUN_SECONDS", raising=False)
+    assert not TraceSampler.from_env().enabled
+    monkeypatch.setenv("LANGFUSE_TRACE_ERRORS", "1")
+    assert TraceSampler.from_env().enabled
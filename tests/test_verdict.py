@@ -0,0 +1,71 @@
+import pytest
+
+pytest.importorskip("langgraph")
+
+from langchain_core.messages import AIMessage  # noqa: E402
+from langchain_core.runnables import RunnableLambda  # noqa: E402
+from agents import RevisionPolicy, _initial_state, create_critic_agent, parse_verdict  # noqa: E402
+
+
+def test_json_verdict():
+    verdict = parse_verdict(
+        'Хороший текст.\n{"score": 8.5, "criteria": {"structure": 9, "clarity": "высокая"}, "decision": "ПРИНЯТЬ"}'
+    )
+    assert verdict == {"score": 8.5, "criteria": {"structure": 9.0}, "decision": "accept"}
+
+
+def test_json_in_fenced_code_block():
+    text = 'Замечания: мало примеров.\n```json\n{"score": 6, "decision": "ДОРАБОТАТЬ"}\n```'
+    assert parse_verdict(text) == {"score": 6.0, "criteria": {}, "decision": "revise"}
+
+
+def test_last_of_several_objects_wins():
+    text = (
+        'Пример формата: {"score": 10, "decision": "ПРИНЯТЬ"}\n'
+        'Данные: {"source": "wiki"}\n'
+        'Итог: {"score": 5, "criteria": {"relevance": 4}, "decision": "revise"}\n'
+        'Ссылка: {"url": "https://example.com"}'
+    )
+    assert parse_verdict(text) == {"score": 5.0, "criteria": {"relevance": 4.0}, "decision": "revise"}
+
+
+def test_malformed_json_falls_back_to_markers():
+    text = 'РЕШЕНИЕ: ДОРАБОТАТЬ\n{"score": 7, "decision": "ПРИНЯТЬ"'
+    assert parse_verdict(text) == {"score": None, "criteria": {}, "decision": "revise"}
+
+
+def test_unparseable_score_keeps_decision():
+    verdict = parse_verdict('{"score": "7/10", "decision": "ACCEPT"}')
+    assert verdict["score"] is None
+    assert verdict["decision"] == "accept"
+
+
+def test_json_without_decision_uses_marker():
+    verdict = parse_verdict('{"score": 9}\nРЕШЕНИЕ: ПРИНЯТЬ')
+    assert verdict == {"score": 9.0, "criteria": {}, "decision": "accept"}
+
+
+@pytest.mark.parametrize("text, decision", [
+    ("Текст хороший.\nРЕШЕНИЕ: ПРИНЯТЬ", "accept"),
+    ("Нужно больше примеров.\nРЕШЕНИЕ: ДОРАБОТАТЬ", "revise"),
+])
+def test_free_text_verdict_without_json(text, decision):
+    assert parse_verdict(text) == {"score": None, "criteria": {}, "decision": decision}
+
+
+def test_missing_verdict_is_unclear():
+    assert parse_verdict("Текст неплохой, но есть вопросы.") == {"score": None, "criteria": {}, "decision": None}
+    assert parse_verdict("") == {"score": None, "criteria": {}, "decision": None}
+
+
+@pytest.mark.parametrize("text, route", [
+    ('{"score": 9, "decision": "ДОРАБОТАТЬ"}', "tools"),  # оценка выше порога останавливает доработки
+    ('```json\n{"score": 5, "decision": "ДОРАБОТАТЬ"}\n```', "writer"),
+    ("РЕШЕНИЕ: ПРИНЯТЬ", "tools"),
+    ("Без решения", "tools"),  # неясный вердикт принимается как есть
+])
+def test_verdict_decides_revision_loop(text, route):
+    critic = create_critic_agent(RunnableLambda(lambda messages: AIMessage(content=text)))
+    state = {**_initial_state("Тема"), "content": "Текст"}
+    state.update(critic.invoke(state))
+    assert RevisionPolicy()(state) == route
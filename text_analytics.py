@@ -0,0 +1,170 @@
+import re
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional, Sequence
+from concurrent.futures import ProcessPoolExecutor
+
+# Словари для простого анализа настроения
+POSITIVE_WORDS = ['хорошо', 'отлично', 'прекрасно', 'замечательно', 'удивительно', 'великолепно']
+NEGATIVE_WORDS = ['плохо', 'ужасно', 'отвратительно', 'ужас', 'кошмар']
+
+# Один проход по тексту: слова из словарей настроения, прочие слова и концы предложений.
+# Словарные слова проверяются первыми и только целиком, поэтому "хорошо" не совпадет с "хорошонько".
+_TOKEN_RE = re.compile(
+    r"(?P<positive>(?:{positive})(?!\w))"
+    r"|(?P<negative>(?:{negative})(?!\w))"
+    r"|(?P<word>\w+(?:[-']\w+)*)"
+    r"|(?P<end>[.!?…]+)".format(
+        positive="|".join(sorted(map(re.escape, POSITIVE_WORDS), key=len, reverse=True)),
+        negative="|".join(sorted(map(re.escape, NEGATIVE_WORDS), key=len, reverse=True)),
+    ),
+    re.IGNORECASE
+)
+
+# Батчи меньше этого размера обрабатываются в текущем процессе: запуск пула дороже
+PARALLEL_THRESHOLD = 64
+
+
+@dataclass
+class TextStats:
+    """Статистика текста"""
+    word_count: int = 0
+    sentence_count: int = 0
+    positive_count: int = 0
+    negative_count: int = 0
+
+    @property
+    def avg_sentence_length(self) -> float:
+        """Средняя длина предложения в словах"""
+        return self.word_count / self.sentence_count if self.sentence_count > 0 else 0
+
+    @property
+    def sentiment(self) -> str:
+        """Эмоциональная окраска по словарям настроения"""
+        if self.positive_count > self.negative_count:
+            return "Положительная"
+        if self.negative_count > self.positive_count:
+            return "Отрицательная"
+        return "Нейтральная"
+
+
+class TextAnalyzer:
+    """
+    Инкрементальный анализатор: принимает текст частями и не хранит его целиком.
+
+    Часть текста после последнего пробельного символа откладывается до следующего
+    фрагмента, чтобы слово или конец предложения на границе не были посчитаны дважды.
+    """
+
+    # Если в буфере так и не встретился пробел, он обрабатывается принудительно
+    MAX_TAIL = 1 << 16
+
+    def __init__(self):
+        self.stats = TextStats()
+        self._in_sentence = False
+        self._tail = ""
+
+    def _scan(self, text: str) -> None:
+        stats = self.stats
+        in_sentence = self._in_sentence
+        for match in _TOKEN_RE.finditer(text):
+            kind = match.lastgroup
+            if kind == "end":
+                if in_sentence:
+                    stats.sentence_count += 1
+                    in_sentence = False
+                continue
+            stats.word_count += 1
+            in_sentence = True
+            if kind == "positive":
+                stats.positive_count += 1
+            elif kind == "negative":
+                stats.negative_count += 1
+        self._in_sentence = in_sentence
+
+    def update(self, chunk: str) -> None:
+        """Добавляет очередной фрагмент текста"""
+        text = self._tail + chunk
+        cut = max(text.rfind(" "), text.rfind("\n"), text.rfind("\t"))
+        if cut == -1 and len(text) < self.MAX_TAIL:
+            self._tail = text
+            return
+        if cut == -1:
+            cut = len(text) - 1
+        self._scan(text[:cut + 1])
+        self._tail = text[cut + 1:]
+
+    def finish(self) -> TextStats:
+        """Завершает анализ и возвращает статистику"""
+        if self._tail:
+            self._scan(self._tail)
+            self._tail = ""
+        if self._in_sentence:
+            # Последнее предложение без точки тоже считается
+            self.stats.sentence_count += 1
+            self._in_sentence = False
+        return self.stats
+
+
+def analyze_text(text: str) -> TextStats:
+    """Считает слова, предложения и настроение текста за один проход"""
+    analyzer = TextAnalyzer()
+    analyzer._scan(text)
+    return analyzer.finish()
+
+def analyze_stream(chunks: Iterable[str]) -> TextStats:
+    """Анализирует текст, поступающий фрагментами, не собирая его целиком"""
+    analyzer = TextAnalyzer()
+    for chunk in chunks:
+        analyzer.update(chunk)
+    return analyzer.finish()
+
+def _read_chunks(path: str, chunk_size: int, encoding: str) -> Iterator[str]:
+    with open(path, encoding=encoding) as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def analyze_file(path: str, chunk_size: int = 1 << 20, encoding: str = "utf-8") -> TextStats:
+    """
+    Анализирует текстовый файл по частям.
+
+    Args:
+        path: Путь к файлу
+        chunk_size: Размер читаемого фрагмента в символах
+        encoding: Кодировка файла
+    """
+    return analyze_stream(_read_chunks(path, chunk_size, encoding))
+
+def analyze_many(texts: Sequence[str], processes: Optional[int] = None, chunksize: int = 16) -> List[TextStats]:
+    """
+    Анализирует набор текстов, распределяя большие батчи по пулу процессов.
+
+    Args:
+        texts: Тексты для анализа
+        processes: Число процессов; None - по числу ядер, 1 - без пула
+        chunksize: Сколько текстов передается процессу за раз
+
+    Returns:
+        Статистика в порядке входных текстов
+    """
+    texts = list(texts)
+    if processes == 1 or len(texts) < PARALLEL_THRESHOLD:
+        return [analyze_text(text) for text in texts]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(analyze_text, texts, chunksize=chunksize))
+
+def format_report(stats: TextStats, current_time: Optional[str] = None) -> str:
+    """Форматирует статистику в отчет, который добавляется к контенту"""
+    if current_time is None:
+        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return f"""
+📊 АНАЛИЗ ТЕКСТА:
+⏰ Время анализа: {current_time}
+📝 Количество слов: {stats.word_count}
+📄 Количество предложений: {stats.sentence_count}
+📏 Средняя длина предложения: {stats.avg_sentence_length:.1f} слов
+😊 Эмоциональная окраска: {stats.sentiment}
+    """.strip()
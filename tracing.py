@@ -0,0 +1,300 @@
+import os
+import time
+import queue
+import atexit
+import random
+import inspect
+import logging
+import functools
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from langchain_core.callbacks import BaseCallbackHandler
+from metrics import REGISTRY, MetricsRegistry
+
+logger = logging.getLogger("agents.tracing")
+
+# Событие callback: (метод, позиционные аргументы, именованные аргументы, время)
+Event = Tuple[str, tuple, Dict[str, Any], float]
+# Перенос записанного времени на наблюдение обработчика: (обработчик, run_id, время, это начало шага)
+TimingHook = Callable[[Any, Any, float, bool], None]
+
+
+def _supports_end_time(observation) -> bool:
+    """Принимает ли end() наблюдения время окончания (end_time, Langfuse 3.x)"""
+    try:
+        return "end_time" in inspect.signature(observation.end).parameters
+    except (AttributeError, TypeError, ValueError):
+        return False
+
+_timings_warned = False
+
+def _timings_unsupported(observation) -> None:
+    global _timings_warned
+    if not _timings_warned:
+        _timings_warned = True
+        logger.warning("Наблюдения %s не поддерживают перенос времени: длительность шагов в трассах - "
+                       "время их отправки", type(observation).__name__)
+
+def restore_langfuse_timings(handler, run_id, at: float, start: bool) -> None:
+    """
+    Переносит записанное время события на наблюдение Langfuse при воспроизведении трассы.
+
+    Обработчик Langfuse создает наблюдения (спаны OpenTelemetry) в момент воспроизведения,
+    поэтому без переноса каждый шаг отправленной трассы длился бы почти ноль. Время окончания
+    передается в публичный аргумент end(end_time=...) наблюдения. Время начала SDK задать
+    не позволяет (start_span его не принимает), поэтому оно записывается в спан OpenTelemetry
+    сразу после создания, пока спан не завершен и не экспортирован. Если наблюдение устроено
+    иначе (другая версия SDK), время не переносится, и об этом один раз пишется предупреждение.
+    """
+    observation = getattr(handler, "runs", {}).get(run_id)
+    if observation is None:
+        return
+    span = getattr(observation, "_otel_span", None)
+    if span is None or not _supports_end_time(observation) or not isinstance(getattr(span, "_start_time", None), int):
+        _timings_unsupported(observation)
+        return
+    at_ns = int(at * 1e9)
+    if start:
+        span._start_time = at_ns
+    else:
+        observation.end = functools.partial(observation.end, end_time=at_ns)
+
+
+@dataclass
+class TraceSampler:
+    """
+    Правила отбора запусков для трассировки.
+
+    Attributes:
+        rate: Доля запусков, которые трассируются всегда (0-1); 0 без остальных правил -
+            трассы не отправляются
+        always_on_error: Трассировать все запуски, завершившиеся ошибкой, сверх доли rate
+        slow_run_seconds: Трассировать все запуски не короче этого времени; None - не учитывать
+    """
+    rate: float = 1.0
+    always_on_error: bool = False
+    slow_run_seconds: Optional[float] = None
+
+    @classmethod
+    def from_env(cls) -> "TraceSampler":
+        """Правила из переменных окружения: LANGFUSE_SAMPLE_RATE, LANGFUSE_TRACE_ERRORS, LANGFUSE_SLOW_RUN_SECONDS"""
+        slow = os.getenv("LANGFUSE_SLOW_RUN_SECONDS")
+        return cls(
+            rate=float(os.getenv("LANGFUSE_SAMPLE_RATE", "1.0")),
+            always_on_error=os.getenv("LANGFUSE_TRACE_ERRORS", "0") == "1",
+            slow_run_seconds=float(slow) if slow else None,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0 or self.always_on_error or self.slow_run_seconds is not None
+
+    @property
+    def needs_recording(self) -> bool:
+        """Нужно ли записывать события незапланированных запусков, чтобы решить по их итогу"""
+        return self.always_on_error or self.slow_run_seconds is not None
+
+
+class BackgroundExporter:
+    """
+    Фоновая отправка отобранных трасс.
+
+    Записанные события запусков складываются в ограниченную очередь и воспроизводятся
+    на обработчике Langfuse в отдельном потоке, поэтому сериализация и отправка не задерживают
+    вызовы LLM. Если очередь заполнена, трасса отбрасывается, а не блокирует запуск.
+    """
+
+    def __init__(self, handler_factory: Callable[[], Any], on_flush: Optional[Callable[[], None]] = None,
+                 max_traces: int = 1000, batch_size: int = 50, metrics: Optional[MetricsRegistry] = REGISTRY,
+                 timings: Optional[TimingHook] = restore_langfuse_timings):
+        """
+        Args:
+            handler_factory: Создает обработчик callbacks, на котором воспроизводятся трассы
+                (вызывается в фоновом потоке при первой трассе)
+            on_flush: Вызывается после отправки пачки трасс (например, Langfuse.flush)
+            max_traces: Сколько трасс может ждать отправки; сверх этого трассы отбрасываются
+            batch_size: Сколько трасс отправлять за одну пачку
+            metrics: Реестр метрик; None отключает метрики
+            timings: Перенос записанного времени событий на наблюдения обработчика;
+                None - время шагов остается временем отправки
+        """
+        self.handler_factory = handler_factory
+        self.timings = timings
+        self.on_flush = on_flush
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[List[Event]]" = queue.Queue(maxsize=max_traces)
+        self._handler = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.dropped = metrics.counter("agent_traces_dropped_total", "Трассы, отброшенные из-за переполнения очереди") if metrics is not None else None
+
+    def submit(self, events: List[Event]) -> bool:
+        """Ставит трассу в очередь отправки; False, если очередь заполнена"""
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(events)
+        except queue.Full:
+            if self.dropped is not None:
+                self.dropped.inc()
+            logger.debug("Очередь трасс заполнена, трасса отброшена")
+            return False
+        return True
+
+    def flush(self, timeout: Optional[float] = 10.0) -> bool:
+        """Ждет отправки поставленных трасс; False, если не успели за timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                    self._thread.start()
+                    # Трассы, поставленные перед выходом процесса, успевают уйти
+                    atexit.register(self.flush, 5.0)
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                for events in batch:
+                    self._replay(events)
+                if self.on_flush is not None:
+                    self.on_flush()
+            except Exception as e:
+                logger.warning("Ошибка отправки трасс: %s", e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _replay(self, events: List[Event]) -> None:
+        if self._handler is None:
+            self._handler = self.handler_factory()
+        for method, args, kwargs, at in events:
+            start = method.endswith("_start")
+            if self.timings is not None and not start:
+                self.timings(self._handler, kwargs["run_id"], at, False)
+            getattr(self._handler, method)(*args, **kwargs)
+            if self.timings is not None and start:
+                self.timings(self._handler, kwargs["run_id"], at, True)
+
+
+class SampledTracingHandler(BaseCallbackHandler):
+    """
+    Callback LangChain, который отбирает запуски графа для трассировки.
+
+    Решение принимается по корневому запуску: доля rate отбирается сразу, остальные
+    записываются и отправляются, только если завершились ошибкой или дольше slow_run_seconds.
+    События записываются в памяти без сериализации и передаются BackgroundExporter после
+    завершения запуска. Записанное время событий переносится на наблюдения при отправке
+    (см. restore_langfuse_timings) и дублируется в metadata (started_at, duration_seconds).
+    """
+
+    # Обработчик вызывается прямо в потоке/цикле событий: он только дописывает события в список
+    run_inline = True
+
+    def __init__(self, exporter: BackgroundExporter, sampler: Optional[TraceSampler] = None,
+                 metrics: Optional[MetricsRegistry] = REGISTRY):
+        self.exporter = exporter
+        self.sampler = sampler or TraceSampler()
+        self.traces = metrics.counter("agent_traces_total", "Запуски графа по решению о трассировке") if metrics is not None else None
+        # Корневой запуск -> (отобран сразу, время начала, события); вложенный запуск -> корневой
+        self._runs: Dict[Any, Tuple[bool, float, List[Event]]] = {}
+        self._root_of: Dict[Any, Any] = {}
+        self._lock = threading.Lock()
+
+    def _record(self, method: str, args: tuple, kwargs: Dict[str, Any]) -> None:
+        run_id = kwargs["run_id"]
+        parent_run_id = kwargs.get("parent_run_id")
+        with self._lock:
+            if parent_run_id is None and method.endswith("_start") and run_id not in self._root_of:
+                sampled = random.random() < self.sampler.rate
+                if not sampled and not self.sampler.needs_recording:
+                    return
+                self._runs[run_id] = (sampled, time.time(), [])
+                self._root_of[run_id] = run_id
+            root = self._root_of.get(run_id)
+            if root is None and parent_run_id is not None:
+                root = self._root_of.get(parent_run_id)
+                if root is not None:
+                    self._root_of[run_id] = root
+            if root is None:
+                return
+            self._runs[root][2].append((method, args, kwargs, time.time()))
+        if run_id == root and not method.endswith("_start"):
+            self._finish(root, error=method.endswith("_error"))
+
+    def _finish(self, root, error: bool) -> None:
+        with self._lock:
+            sampled, started, events = self._runs.pop(root)
+            for _, _, kwargs, _ in events:
+                self._root_of.pop(kwargs["run_id"], None)
+        duration = time.time() - started
+        slow = self.sampler.slow_run_seconds
+        if sampled:
+            reason = "sampled"
+        elif error and self.sampler.always_on_error:
+            reason = "error"
+        elif slow is not None and duration >= slow:
+            reason = "slow"
+        else:
+            reason = "skipped"
+        if reason != "skipped" and not self.exporter.submit(_with_timings(events)):
+            reason = "dropped"
+        if self.traces is not None:
+            self.traces.inc(decision=reason)
+
+    def on_chain_start(self, *args, **kwargs):
+        self._record("on_chain_start", args, kwargs)
+
+    def on_chain_end(self, *args, **kwargs):
+        self._record("on_chain_end", args, kwargs)
+
+    def on_chain_error(self, *args, **kwargs):
+        self._record("on_chain_error", args, kwargs)
+
+    def on_chat_model_start(self, *args, **kwargs):
+        self._record("on_chat_model_start", args, kwargs)
+
+    def on_llm_start(self, *args, **kwargs):
+        self._record("on_llm_start", args, kwargs)
+
+    def on_llm_end(self, *args, **kwargs):
+        self._record("on_llm_end", args, kwargs)
+
+    def on_llm_error(self, *args, **kwargs):
+        self._record("on_llm_error", args, kwargs)
+
+    def on_tool_start(self, *args, **kwargs):
+        self._record("on_tool_start", args, kwargs)
+
+    def on_tool_end(self, *args, **kwargs):
+        self._record("on_tool_end", args, kwargs)
+
+    def on_tool_error(self, *args, **kwargs):
+        self._record("on_tool_error", args, kwargs)
+
+
+def _with_timings(events: List[Event]) -> List[Event]:
+    """Добавляет в metadata стартовых событий фактическое время начала и длительность шага"""
+    ended = {kwargs["run_id"]: at for method, _, kwargs, at in events if not method.endswith("_start")}
+    result = []
+    for method, args, kwargs, at in events:
+        if method.endswith("_start"):
+            timing = {"started_at": at}
+            if kwargs["run_id"] in ended:
+                timing["duration_seconds"] = round(ended[kwargs["run_id"]] - at, 6)
+            kwargs = {**kwargs, "metadata": {**(kwargs.get("metadata") or {}), **timing}}
+        result.append((method, args, kwargs, at))
+    return result